@@ -0,0 +1,136 @@
+#!/usr/bin/env python
+
+"""Time fixing every string in a locale file, with one rule pass versus chained replaces.
+
+Run with `python benchmarks/bench_fix_locale.py [path/to/en.yml]`. Without a file, this makes up a
+locale the size of Mastodon's config/locales/en.yml. Chained replaces are quicker for the two
+default terms, but grow with every term added, while the compiled rules stay nearly flat.
+"""
+
+import argparse
+import copy
+import random
+import string
+import timeit
+from pathlib import Path
+
+from ruamel.yaml import YAML
+
+from mastools.scripts import fix_locale
+from mastools.scripts.fix_locale import Rule
+
+# Roughly what Mastodon's own en.yml has
+SECTIONS = 60
+KEYS_PER_SECTION = 40
+NESTED_KEYS = 5
+
+EXTRA_RULES = (
+    Rule("boost", "reblog", whole_word=True, preserve_case=True),
+    Rule("boosted", "reblogged", whole_word=True, preserve_case=True),
+    Rule("favourite", "like", whole_word=True, preserve_case=True),
+    Rule("favourites", "likes", whole_word=True, preserve_case=True),
+    Rule("instance", "server", whole_word=True, preserve_case=True),
+    Rule("instances", "servers", whole_word=True, preserve_case=True),
+)
+
+
+def random_text(rng):
+    """Return a sentence that sometimes mentions a term to fix."""
+
+    words = ["".join(rng.choice(string.ascii_lowercase) for _ in range(rng.randint(2, 9)))]
+    for _ in range(rng.randint(2, 15)):
+        if rng.random() < 0.05:
+            words.append(rng.choice(["post", "Post", "boost", "favourite", "instance"]))
+        else:
+            words.append("".join(rng.choice(string.ascii_lowercase) for _ in range(5)))
+    return " ".join(words)
+
+
+def make_locale(rng):
+    """Return a made-up locale shaped like Mastodon's."""
+
+    return {
+        "en": {
+            f"section{section}": {
+                f"key{key}": (
+                    {f"nested{nested}": random_text(rng) for nested in range(NESTED_KEYS)}
+                    if key % 4 == 0
+                    else random_text(rng)
+                )
+                for key in range(KEYS_PER_SECTION)
+            }
+            for section in range(SECTIONS)
+        }
+    }
+
+
+def strings_in(locale):
+    """Return every string in the locale."""
+
+    found = []
+    stack = [locale]
+    while stack:
+        for value in stack.pop().values():
+            if isinstance(value, dict):
+                stack.append(value)
+            elif isinstance(value, str):
+                found.append(str(value))
+    return found
+
+
+def chained(rules):
+    """Return a function that fixes a string with one replace per term, for comparison."""
+
+    pairs = [pair for rule in rules for pair in fix_locale.case_forms(rule)]
+
+    def repair(value):
+        for find, replace in pairs:
+            value = value.replace(find, replace)
+        return value
+
+    return repair
+
+
+def main():
+    """Time both approaches with the default rules and with a bigger rule table."""
+
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument("filename", nargs="?", type=Path, help="A locale file to fix")
+    args = parser.parse_args()
+
+    rng = random.Random(0)
+    if args.filename:
+        locale = YAML().load(args.filename)
+    else:
+        locale = make_locale(rng)
+    values = strings_in(locale)
+    print(f"{len(values)} strings")
+
+    print(f"{'rules':>6} {'compiled ms':>12} {'chained ms':>12}")
+    many_rules = tuple(
+        Rule("".join(rng.choice(string.ascii_lowercase) for _ in range(8)), "x", whole_word=True)
+        for _ in range(100)
+    )
+    for rules in (
+        fix_locale.DEFAULT_RULES,
+        fix_locale.DEFAULT_RULES + EXTRA_RULES,
+        fix_locale.DEFAULT_RULES + EXTRA_RULES + many_rules,
+    ):
+        results = []
+        for repair in (fix_locale.compile_rules(rules), chained(rules)):
+            seconds = min(
+                timeit.repeat(lambda: [repair(value) for value in values], number=1, repeat=5)
+            )
+            results.append(seconds * 1000)
+        print(f"{len(rules):>6} {results[0]:>12.2f} {results[1]:>12.2f}")
+
+    # deep_update changes the locale, so give each run a fresh copy.
+    copies = [copy.deepcopy(locale) for _ in range(5)]
+    seconds = min(
+        timeit.repeat(lambda: fix_locale.deep_update(copies.pop()), number=1, repeat=len(copies))
+    )
+    print(f"deep_update over the whole locale: {seconds * 1000:.2f} ms")
+
+
+if __name__ == "__main__":
+    main()
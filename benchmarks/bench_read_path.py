@@ -0,0 +1,110 @@
+#!/usr/bin/env python
+
+"""Compare ways of reading the accounts that the scans look at, in rows per second.
+
+The scans used to hydrate whole Accounts entities, then switched to ORM queries of just the
+columns they need, and now run a Core select() of the same table columns. This fills a scratch
+database with synthetic.py and times all three reading every local account.
+
+    python benchmarks/bench_read_path.py --count 100000
+    python benchmarks/bench_read_path.py --database-url postgresql://localhost/mastools_bench
+
+Don't point it at a real Mastodon database: it drops the accounts and users tables.
+"""
+
+import argparse
+import tempfile
+import time
+
+from sqlalchemy import create_engine
+from sqlalchemy.orm import Session
+
+import synthetic  # pylint: disable=import-error  ; it's next to this file
+from mastools.models import Accounts
+from mastools.scripts import common, user_changes
+
+COLUMNS = ("id", "username", "created_at", "fields", "note")
+
+
+def orm_entities(session, batch_size):
+    """Read whole Accounts entities through the ORM."""
+
+    return (
+        session.query(Accounts)
+        .filter(Accounts.domain == None)  # pylint: disable=singleton-comparison
+        .yield_per(batch_size)
+    )
+
+
+def orm_columns(session, batch_size):
+    """Read the needed columns through an ORM query."""
+
+    columns = [getattr(Accounts, name) for name in COLUMNS]
+    return (
+        session.query(*columns)
+        .filter(Accounts.domain == None)  # pylint: disable=singleton-comparison
+        .yield_per(batch_size)
+    )
+
+
+def core_columns(session, batch_size):
+    """Read the needed columns with a Core select(), the way the scans do."""
+
+    columns = [user_changes.ACCOUNTS[name] for name in COLUMNS]
+    return common.stream(session, user_changes.local_accounts(*columns), batch_size)
+
+
+READERS = {"orm-entities": orm_entities, "orm-columns": orm_columns, "core-columns": core_columns}
+
+
+def rows_per_second(engine, reader, batch_size, repeat):
+    """Return the best rate at which the reader got through every row, and how many there were."""
+
+    best = None
+    for _ in range(repeat):
+        with Session(bind=engine) as session:
+            start = time.perf_counter()
+            count = sum(1 for _ in reader(session, batch_size))
+            elapsed = time.perf_counter() - start
+        best = elapsed if best is None else min(best, elapsed)
+    return count / best, count
+
+
+def run(args):
+    """Fill the database and time each reader against it."""
+
+    engine = create_engine(args.database_url)
+    synthetic.generate(engine, args.count, args)
+
+    baseline = None
+    for name, reader in READERS.items():
+        rate, count = rows_per_second(engine, reader, args.batch_size, args.repeat)
+        baseline = baseline or rate
+        print(f"{name:<14} {count} rows  {rate:>10,.0f} rows/s  {rate / baseline:.2f}x")
+
+
+def handle_command_line():
+    """Handle the command line."""
+
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument(
+        "--database-url",
+        help="SQLAlchemy URL of a scratch database (default: an SQLite file in a temp directory)",
+    )
+    parser.add_argument("--count", type=int, default=100_000, help="How many accounts to create")
+    parser.add_argument("--repeat", type=int, default=3, help="Take the best of this many runs")
+    common.add_batch_size_argument(parser)
+    synthetic.add_arguments(parser)
+    args = parser.parse_args()
+
+    if args.database_url:
+        run(args)
+        return
+
+    with tempfile.TemporaryDirectory() as temp_dir:
+        args.database_url = f"sqlite:///{temp_dir}/mastodon.sqlite3"
+        run(args)
+
+
+if __name__ == "__main__":
+    handle_command_line()
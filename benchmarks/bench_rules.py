@@ -0,0 +1,94 @@
+#!/usr/bin/env python
+
+"""Show how the cost of checking an account grows with the number of spam rules.
+
+Run with `python benchmarks/bench_rules.py`. The combined rules should stay roughly flat as rules
+are added, while checking each rule separately grows linearly.
+"""
+
+import random
+import re
+import string
+import timeit
+
+from mastools.scripts import rules
+from mastools.scripts.rules import Rules, account_texts
+
+ACCOUNTS = 2000
+RULE_COUNTS = (1, 10, 100, 1000)
+
+
+def random_word(rng, length):
+    """Return a random lowercase word."""
+
+    return "".join(rng.choice(string.ascii_lowercase) for _ in range(length))
+
+
+def make_accounts(rng):
+    """Return cached-style data for ordinary accounts that shouldn't match anything."""
+
+    return [
+        {
+            "note": " ".join(random_word(rng, rng.randint(2, 9)) for _ in range(40)),
+            "fields": [
+                {"name": random_word(rng, 6), "value": random_word(rng, 20)} for _ in range(4)
+            ],
+        }
+        for _ in range(ACCOUNTS)
+    ]
+
+
+def make_definitions(rng, count):
+    """Return the definitions of count rules, mostly spam domains plus a few patterns."""
+
+    definitions = {
+        f"domain{index}": {"literals": [f"{random_word(rng, 10)}.example"]}
+        for index in range(count)
+    }
+    definitions["phone"] = {"patterns": [r"\+?\d[\d ().-]{8,}\d"]}
+    return definitions
+
+
+def separately(definitions):
+    """Return a function that checks every rule on its own, for comparison."""
+
+    patterns = [
+        re.compile(
+            "|".join(map(re.escape, value.get("literals", ())) or value["patterns"]), re.IGNORECASE
+        )
+        for value in definitions.values()
+    ]
+
+    def search(account):
+        texts = account_texts(account)
+        return any(pattern.search(text) for pattern in patterns for text in texts)
+
+    return search
+
+
+def main():
+    """Time both approaches for each number of rules."""
+
+    rng = random.Random(0)
+    accounts = make_accounts(rng)
+
+    print(
+        "literals are matched with",
+        "a trie regex" if rules.ahocorasick is None else "pyahocorasick",
+    )
+    print(f"{'rules':>6} {'combined us/account':>20} {'separate us/account':>20}")
+    for count in RULE_COUNTS:
+        definitions = make_definitions(rng, count)
+        combined = Rules(definitions).search
+        separate = separately(definitions)
+        results = []
+        for search in (combined, separate):
+            seconds = min(
+                timeit.repeat(lambda: [search(account) for account in accounts], number=1, repeat=3)
+            )
+            results.append(seconds / ACCOUNTS * 1_000_000)
+        print(f"{count:>6} {results[0]:>20.2f} {results[1]:>20.2f}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,294 @@
+#!/usr/bin/env python
+
+"""Time the mastools subcommands against synthetic databases of different sizes.
+
+For each size, this fills the database with synthetic.py and then runs each scenario in a fresh
+process, recording its wall time, number of queries, number of rows fetched from the database, and
+peak RSS. The results are written as JSON so that runs from different releases can be compared.
+
+    python benchmarks/bench_scans.py --sizes 10000 100000 --output bench_results.json
+    python benchmarks/bench_scans.py --database-url postgresql://localhost/mastools_bench
+
+Don't point it at a real Mastodon database: it drops the accounts and users tables.
+"""
+
+import argparse
+import contextlib
+import json
+import os
+import platform
+import resource
+import sqlite3
+import subprocess
+import sys
+import tempfile
+import time
+from datetime import datetime, timezone
+from importlib import metadata
+from pathlib import Path
+
+from sqlalchemy import create_engine, event, update
+from sqlalchemy.engine import make_url
+from sqlalchemy.orm import sessionmaker
+
+import synthetic  # pylint: disable=import-error  ; it's next to this file
+from mastools.models import Accounts
+from mastools.scripts import common, unconfirmed_users, user_changes
+
+SCENARIOS = {}
+
+# What the counting cursors have seen
+COUNTS = {"queries": 0, "rows": 0}
+
+
+def scenario(name):
+    """Register a function that sets up a scenario and returns the thing to time."""
+
+    def register(func):
+        SCENARIOS[name] = func
+        return func
+
+    return register
+
+
+def count_rows(rows):
+    """Add the rows to the count, and return them."""
+
+    if rows is None:
+        return rows
+    if isinstance(rows, list):
+        COUNTS["rows"] += len(rows)
+    else:
+        COUNTS["rows"] += 1
+    return rows
+
+
+def counting_cursor_class(base):
+    """Return a subclass of the DB-API cursor class that counts the rows fetched through it."""
+
+    class CountingCursor(base):
+        """A cursor that counts the rows fetched through it."""
+
+        def fetchone(self):
+            return count_rows(super().fetchone())
+
+        def fetchmany(self, *args, **kwargs):
+            return count_rows(super().fetchmany(*args, **kwargs))
+
+        def fetchall(self):
+            return count_rows(super().fetchall())
+
+    return CountingCursor
+
+
+class CountingSQLiteConnection(sqlite3.Connection):
+    """An SQLite connection whose cursors count the rows fetched through them."""
+
+    def cursor(self, factory=None):  # pylint: disable=arguments-differ,unused-argument
+        return super().cursor(counting_cursor_class(sqlite3.Cursor))
+
+
+def counting_engine(url):
+    """Return an engine for the URL that counts queries and rows."""
+
+    if make_url(url).get_backend_name() == "postgresql":
+        from psycopg2.extensions import cursor  # pylint: disable=import-outside-toplevel
+
+        engine = create_engine(url, connect_args={"cursor_factory": counting_cursor_class(cursor)})
+    else:
+        engine = create_engine(url, connect_args={"factory": CountingSQLiteConnection})
+
+    @event.listens_for(engine, "before_cursor_execute")
+    def count_query(*args):  # pylint: disable=unused-argument,unused-variable
+        COUNTS["queries"] += 1
+
+    return engine
+
+
+def reset_peak_rss():
+    """Forget the peak RSS so far, if the OS allows that."""
+
+    with contextlib.suppress(OSError):
+        Path("/proc/self/clear_refs").write_text("5")
+
+
+def peak_rss_kb():
+    """Return the peak RSS in kB since the last reset."""
+
+    with contextlib.suppress(OSError):
+        for line in Path("/proc/self/status").read_text().splitlines():
+            if line.startswith("VmHWM:"):
+                return int(line.split()[1])
+
+    return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+
+
+@scenario("users_with_urls")
+def users_with_urls(session):
+    """Just the account scan."""
+
+    return lambda: user_changes.users_with_urls(session)
+
+
+def show_user_changes(session, full, output_format="text"):
+    """Find and render the user changes the way show-user-changes does, but to nowhere."""
+
+    with open(os.devnull, "w", encoding="utf-8") as devnull:
+        user_changes.emit_changes(
+            user_changes.iter_user_changes(session, full=full),
+            user_changes.EMITTERS[output_format](devnull),
+        )
+
+
+@scenario("show-user-changes-full")
+def show_user_changes_full(session):
+    """A first run, with nothing cached."""
+
+    return lambda: show_user_changes(session, full=True)
+
+
+@scenario("show-user-changes-full-ndjson")
+def show_user_changes_full_ndjson(session):
+    """A first run, written as NDJSON for a program to read."""
+
+    return lambda: show_user_changes(session, full=True, output_format="ndjson")
+
+
+@scenario("show-user-changes-incremental")
+def show_user_changes_incremental(session):
+    """A later run, after 1% of the accounts changed."""
+
+    show_user_changes(session, full=True)
+    session.execute(
+        update(Accounts)
+        .where(Accounts.id % 100 == 0)
+        .values(updated_at=datetime(2100, 1, 1), note=Accounts.note + " http://new.example")
+    )
+    session.flush()
+    return lambda: show_user_changes(session, full=False)
+
+
+@scenario("show-unconfirmed-users")
+def show_unconfirmed_users(session):
+    """Find and print the unconfirmed users, to nowhere."""
+
+    def run():
+        with open(os.devnull, "w", encoding="utf-8") as devnull:
+            for email, username, created_at in unconfirmed_users.unconfirmed_users(session):
+                print(f"{username} <{email}> was created at {created_at}", file=devnull)
+
+    return run
+
+
+def measure(database_url, name):
+    """Run one scenario and return its measurements."""
+
+    session = sessionmaker(bind=counting_engine(database_url))()
+    with tempfile.TemporaryDirectory() as cache_dir:
+        common.MASTOOLS_DIR = Path(cache_dir)
+        func = SCENARIOS[name](session)
+
+        COUNTS.update(queries=0, rows=0)
+        reset_peak_rss()
+        start = time.perf_counter()
+        func()
+        wall_seconds = time.perf_counter() - start
+        result = {
+            "wall_seconds": round(wall_seconds, 4),
+            "queries": COUNTS["queries"],
+            "rows": COUNTS["rows"],
+            "peak_rss_kb": peak_rss_kb(),
+        }
+
+    # Don't keep anything the scenario changed.
+    session.rollback()
+    return result
+
+
+def measure_in_subprocess(database_url, name):
+    """Run one scenario in a fresh interpreter so that their memory use doesn't mix."""
+
+    output = subprocess.run(
+        [sys.executable, __file__, "--measure", name, "--database-url", database_url],
+        check=True,
+        capture_output=True,
+        text=True,
+    ).stdout
+    return json.loads(output)
+
+
+def version():
+    """Return the installed mastools version, if it's installed."""
+
+    try:
+        return metadata.version("mastools")
+    except metadata.PackageNotFoundError:
+        return "unknown"
+
+
+def run(args):
+    """Generate each size of database and measure every scenario against it."""
+
+    engine = create_engine(args.database_url)
+    results = []
+    for size in args.sizes:
+        start = time.perf_counter()
+        synthetic.generate(engine, size, args)
+        print(f"generated {size} accounts in {time.perf_counter() - start:.1f}s", file=sys.stderr)
+
+        for name in args.scenarios:
+            result = dict(
+                size=size, scenario=name, **measure_in_subprocess(args.database_url, name)
+            )
+            print(json.dumps(result), file=sys.stderr)
+            results.append(result)
+
+    report = {
+        "mastools_version": version(),
+        "python": platform.python_version(),
+        "database": make_url(args.database_url).get_backend_name(),
+        "run_at": datetime.now(timezone.utc).isoformat(),
+        "options": {
+            name: getattr(args, name)
+            for name in ("spam_ratio", "remote_ratio", "unconfirmed_ratio", "note_size")
+            + ("fields", "field_size", "seed")
+        },
+        "results": results,
+    }
+    Path(args.output).write_text(json.dumps(report, indent=2))
+
+
+def handle_command_line():
+    """Handle the command line."""
+
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument(
+        "--database-url",
+        help="SQLAlchemy URL of a scratch database (default: an SQLite file in a temp directory)",
+    )
+    parser.add_argument(
+        "--sizes", nargs="+", type=int, default=[10_000, 100_000], help="Numbers of accounts"
+    )
+    parser.add_argument(
+        "--scenarios", nargs="+", choices=sorted(SCENARIOS), default=list(SCENARIOS)
+    )
+    parser.add_argument("--output", default="bench_results.json", help="Where to write results")
+    parser.add_argument("--measure", choices=sorted(SCENARIOS), help=argparse.SUPPRESS)
+    synthetic.add_arguments(parser)
+    args = parser.parse_args()
+
+    if args.measure:
+        print(json.dumps(measure(args.database_url, args.measure)))
+        return
+
+    if args.database_url:
+        run(args)
+        return
+
+    with tempfile.TemporaryDirectory() as temp_dir:
+        args.database_url = f"sqlite:///{temp_dir}/mastodon.sqlite3"
+        run(args)
+
+
+if __name__ == "__main__":
+    handle_command_line()
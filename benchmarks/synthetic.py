@@ -0,0 +1,130 @@
+#!/usr/bin/env python
+
+"""Fill a database with a synthetic Mastodon instance's worth of accounts and users.
+
+This only creates the tables and columns that mastools models, which is all it needs. Don't point
+it at a real Mastodon database: it drops those tables first.
+
+    python benchmarks/synthetic.py sqlite:////tmp/mastodon.sqlite3 100000 --spam-ratio 0.05
+"""
+
+import argparse
+import random
+import string
+from datetime import datetime, timedelta
+
+from sqlalchemy import create_engine, insert
+
+from mastools.models import Accounts, Users
+from mastools.models.base import Base
+
+START = datetime(2019, 1, 1)
+CHUNK_SIZE = 10_000
+
+
+def random_words(rng, length):
+    """Return about length characters of lowercase words."""
+
+    words = []
+    size = 0
+    while size < length:
+        word = "".join(rng.choice(string.ascii_lowercase) for _ in range(rng.randint(2, 9)))
+        words.append(word)
+        size += len(word) + 1
+    return " ".join(words)[:length]
+
+
+def make_account(rng, account_id, options):
+    """Return the columns of one synthetic account."""
+
+    created_at = START + timedelta(seconds=account_id * 60)
+    spammer = rng.random() < options.spam_ratio
+    fields = [
+        {"name": random_words(rng, 8), "value": random_words(rng, options.field_size)}
+        for _ in range(rng.randint(0, options.fields))
+    ]
+    note = random_words(rng, options.note_size)
+    if spammer:
+        if fields and rng.random() < 0.5:
+            fields[0]["value"] = f"https://support-{account_id}.example/"
+        else:
+            note = f"{note} https://support-{account_id}.example/"
+
+    return {
+        "id": account_id,
+        "username": f"user{account_id}",
+        "domain": f"remote{account_id % 97}.example"
+        if rng.random() < options.remote_ratio
+        else None,
+        "created_at": created_at,
+        "updated_at": created_at + timedelta(seconds=rng.randint(0, 86400 * 30)),
+        "note": note,
+        "fields": fields,
+        "suspended_at": created_at if spammer and rng.random() < 0.2 else None,
+    }
+
+
+def make_user(rng, account, options):
+    """Return the columns of the user for a local account."""
+
+    return {
+        "id": account["id"],
+        "email": f"{account['username']}@{rng.choice(options.email_domains)}",
+        "created_at": account["created_at"],
+        "confirmed_at": None if rng.random() < options.unconfirmed_ratio else account["created_at"],
+        "account_id": account["id"],
+    }
+
+
+def generate(engine, count, options):
+    """Replace the accounts and users tables with count synthetic accounts and their users."""
+
+    Base.metadata.drop_all(engine)
+    Base.metadata.create_all(engine)
+
+    rng = random.Random(options.seed)
+    with engine.begin() as connection:
+        for first in range(1, count + 1, CHUNK_SIZE):
+            accounts = [
+                make_account(rng, account_id, options)
+                for account_id in range(first, min(first + CHUNK_SIZE, count + 1))
+            ]
+            users = [
+                make_user(rng, account, options) for account in accounts if not account["domain"]
+            ]
+            connection.execute(insert(Accounts), accounts)
+            if users:
+                connection.execute(insert(Users), users)
+
+
+def add_arguments(parser):
+    """Add the options that shape the synthetic data."""
+
+    parser.add_argument("--spam-ratio", type=float, default=0.02, help="Accounts mentioning URLs")
+    parser.add_argument("--remote-ratio", type=float, default=0.3, help="Accounts on other servers")
+    parser.add_argument("--unconfirmed-ratio", type=float, default=0.05, help="Unconfirmed users")
+    parser.add_argument("--note-size", type=int, default=200, help="Characters in each note")
+    parser.add_argument("--fields", type=int, default=4, help="Most fields an account has")
+    parser.add_argument("--field-size", type=int, default=40, help="Characters in each field")
+    parser.add_argument(
+        "--email-domains",
+        nargs="+",
+        default=["example.com", "example.net", "example.org"],
+        help="Domains to pick email addresses from",
+    )
+    parser.add_argument("--seed", type=int, default=0, help="Random seed")
+
+
+def handle_command_line():
+    """Handle the command line."""
+
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument("database_url", help="SQLAlchemy URL of the database to fill")
+    parser.add_argument("count", type=int, help="How many accounts to create")
+    add_arguments(parser)
+    args = parser.parse_args()
+    generate(create_engine(args.database_url), args.count, args)
+
+
+if __name__ == "__main__":
+    handle_command_line()
@@ -2,6 +2,6 @@
 
 from .accounts import Accounts
 from .users import Users
-from .base import session_for
+from .base import report_session_for, session_for
 
-__all__ = ["session_for", "Accounts", "Users"]
+__all__ = ["report_session_for", "session_for", "Accounts", "Users"]
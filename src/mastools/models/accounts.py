@@ -1,6 +1,7 @@
 """Model the Accounts table."""
 
 from sqlalchemy import Column, DateTime, Integer, JSON, String, Text
+from sqlalchemy.dialects.postgresql import JSONB
 
 from .base import Base
 
@@ -15,8 +16,9 @@ class Accounts(Base):
     username = Column(String, nullable=False)
     domain = Column(String)
     created_at = Column(DateTime, nullable=False)
+    updated_at = Column(DateTime, nullable=False)
     note = Column(Text, nullable=False)
-    fields = Column(JSON)
+    fields = Column(JSON().with_variant(JSONB(), "postgresql"))
     suspended_at = Column(DateTime)
 
 
@@ -36,7 +38,7 @@ class Accounts(Base):
 #  salmon_url              | character varying           |           | not null | ''::character varying
 #  hub_url                 | character varying           |           | not null | ''::character varying
 # *created_at              | timestamp without time zone |           | not null |
-#  updated_at              | timestamp without time zone |           | not null |
+# *updated_at              | timestamp without time zone |           | not null |
 # *note                    | text                        |           | not null | ''::text
 #  display_name            | character varying           |           | not null | ''::character varying
 #  uri                     | character varying           |           | not null | ''::character varying
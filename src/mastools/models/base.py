@@ -1,25 +1,121 @@
 """Common database things used everywhere."""
 
+import logging
 from functools import lru_cache
 
 from psycopg2 import connect
-from sqlalchemy import create_engine
-from sqlalchemy.orm import sessionmaker
+from sqlalchemy import create_engine, text
+from sqlalchemy.exc import OperationalError
+from sqlalchemy.orm import scoped_session, sessionmaker
 from sqlalchemy.ext.declarative import declarative_base
 
 Base = declarative_base()  # pylint: disable=invalid-name  ; This is an SQLAlchemy convention
 
+LOG = logging.getLogger(__name__)
+
+# Every session that session_for has handed out, so that threads can close their own
+SESSIONS = []
+
 
 @lru_cache()
-def session_for(*, host, database, user, password, port=5432):
-    """Return a (possibly cached) session for the connection details."""
+def engine_for(  # pylint: disable=too-many-arguments
+    *,
+    host,
+    database,
+    user,
+    password,
+    port=5432,
+    pool_size=5,
+    pool_pre_ping=False,
+    statement_timeout=None,
+):
+    """Return a (possibly cached) pooled engine for the connection details.
+
+    statement_timeout is anything PostgreSQL's statement_timeout setting understands, like 30000 or
+    "5min".
+    """
+
+    options = {}
+    if statement_timeout is not None:
+        options["options"] = f"-c statement_timeout={statement_timeout}"
 
     def pg_connect():
         """Return a connection to the Mastodon database."""
 
-        return connect(host=host, database=database, user=user, password=password, port=port)
+        return connect(
+            host=host, database=database, user=user, password=password, port=port, **options
+        )
+
+    return create_engine(
+        "postgresql+psycopg2://",
+        creator=pg_connect,
+        pool_size=pool_size,
+        pool_pre_ping=pool_pre_ping,
+    )
+
+
+@lru_cache()
+def session_for(read_only=False, **config):
+    """Return a (possibly cached) session for the connection details.
+
+    Sessions for the same details share one pooled engine, so running several subcommands in one
+    process only connects to the database once. Read-only sessions run each transaction at
+    REPEATABLE READ, so everything a report reads comes from one consistent snapshot.
+
+    Each thread that uses the session gets one of its own, on its own connection, so that `mastools
+    run` can run subcommands at the same time. Threads should call close_sessions when they're done.
+    """
+
+    engine = engine_for(**config)
+    if read_only:
+        engine = engine.execution_options(
+            isolation_level="REPEATABLE READ", postgresql_readonly=True
+        )
+
+    session = scoped_session(sessionmaker(bind=engine))
+    SESSIONS.append(session)
+    return session
+
+
+def close_sessions():
+    """Close this thread's sessions from session_for, returning their connections to the pool."""
+
+    for session in SESSIONS:
+        session.remove()
+
+
+def replica_lag(session):
+    """Return how far behind its primary the database is, or None if it isn't a replica."""
+
+    in_recovery, lag = session.execute(
+        text("SELECT pg_is_in_recovery(), now() - pg_last_xact_replay_timestamp()")
+    ).one()
+    return lag if in_recovery else None
+
+
+def report_session_for(primary, replica=None, fallback=False):
+    """Return a read-only session for reports, on the read replica if there is one.
+
+    If the replica can't be reached and fallback is set, use the primary instead. The replica's lag
+    is logged as of the start of the session's first transaction, which is when its snapshot is
+    taken.
+    """
+
+    if replica is None:
+        return session_for(read_only=True, **primary)
+
+    session = session_for(read_only=True, **replica)
+    try:
+        lag = replica_lag(session)
+    except OperationalError:
+        if not fallback:
+            raise
+        LOG.warning("can't reach the read replica, so using the primary database", exc_info=True)
+        session.rollback()
+        return session_for(read_only=True, **primary)
 
-    engine = create_engine(f"postgresql+psycopg2://", creator=pg_connect)
-    factory = sessionmaker(bind=engine)
-    session = factory()
+    if lag is None:
+        LOG.warning("the read replica isn't replicating from anything")
+    else:
+        LOG.info("the read replica is %s behind the primary", lag)
     return session
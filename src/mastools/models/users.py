@@ -16,7 +16,7 @@ class Users(Base):
     email = Column(String, nullable=False)
     created_at = Column(DateTime, nullable=False)
     confirmed_at = Column(DateTime)
-    account_id = Column(ForeignKey("accounts.id"), nullable=False)
+    account_id = Column(ForeignKey("accounts.id"), nullable=False, index=True)
 
     account = relationship("Accounts")
 
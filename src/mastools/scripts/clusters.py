@@ -0,0 +1,247 @@
+"""Group near-duplicate accounts, so that a wave of spam accounts is reported once.
+
+Spam waves tend to create lots of accounts whose notes and fields are the same but for a name or a
+number. Each account's text is cut into overlapping shingles, which are boiled down to a MinHash
+signature. Two signatures agree in about the same share of places as the two accounts share
+shingles. The signatures are split into bands, and accounts with an identical band are the only
+ones that get compared, so clustering takes about linear time instead of comparing every pair.
+
+Every clustered account's signature is kept in ~/.mastools/clusters.sqlite3, so that new accounts
+are matched against the clusters from earlier runs too.
+"""
+
+import hashlib
+import re
+import sqlite3
+import struct
+from contextlib import closing
+from datetime import datetime, timezone
+from typing import NamedTuple
+
+from mastools.scripts import common, history
+
+CLUSTERS_FILE_NAME = "clusters.sqlite3"
+
+# Bump this when anything that changes the signatures does, since old ones can't be compared to new.
+INDEX_VERSION = 1
+
+CLUSTERS_SCHEMA = """
+CREATE TABLE IF NOT EXISTS clusters (
+    id INTEGER PRIMARY KEY,
+    representative TEXT NOT NULL,
+    created_at TEXT NOT NULL
+);
+CREATE TABLE IF NOT EXISTS members (
+    username TEXT PRIMARY KEY,
+    cluster_id INTEGER NOT NULL REFERENCES clusters (id),
+    signature BLOB NOT NULL
+);
+CREATE INDEX IF NOT EXISTS members_by_cluster ON members (cluster_id);
+CREATE TABLE IF NOT EXISTS buckets (
+    band INTEGER NOT NULL,
+    bucket BLOB NOT NULL,
+    username TEXT NOT NULL,
+    PRIMARY KEY (band, bucket, username)
+) WITHOUT ROWID;
+"""
+
+SHINGLE_SIZE = 5
+SIGNATURE_SIZE = 64
+BANDS = 16
+ROWS = SIGNATURE_SIZE // BANDS
+
+# Accounts whose signatures agree in at least this share of places are in the same cluster. With
+# 16 bands of 4 rows, pairs this similar become candidates about 80% of the time, and pairs that
+# are 70% similar almost always do.
+THRESHOLD = 0.6
+
+SIGNATURE_FORMAT = struct.Struct(f"<{SIGNATURE_SIZE}I")
+BAND_FORMAT = struct.Struct(f"<{ROWS}I")
+
+
+class Cluster(NamedTuple):
+    """A group of accounts that look alike, and how many there are so far."""
+
+    id: int
+    representative: str
+    size: int
+
+
+def account_text(data):
+    """Return the normalized text of an account's cached data."""
+
+    parts = [data["note"] or ""]
+    for field in data["fields"] or ():
+        parts.extend((field.get("name") or "", field.get("value") or ""))
+    text = " ".join(parts).lower()
+
+    # Spam accounts often only differ by a number, like support-1234.example.
+    return re.sub(r"\s+", " ", re.sub(r"\d+", "0", text)).strip()
+
+
+def shingles(text):
+    """Return the set of overlapping SHINGLE_SIZE-character pieces of the text."""
+
+    if len(text) <= SHINGLE_SIZE:
+        return {text} if text else set()
+    return {text[start : start + SHINGLE_SIZE] for start in range(len(text) - SHINGLE_SIZE + 1)}
+
+
+def signature(data):
+    """Return the MinHash signature of an account's data, or None if it has no text at all."""
+
+    pieces = shingles(account_text(data))
+    if not pieces:
+        return None
+
+    # Each shingle's SHAKE output is cut into SIGNATURE_SIZE independent 32-bit hashes, and the
+    # signature is the smallest of each. That keeps the inner loops in C.
+    hashes = [
+        SIGNATURE_FORMAT.unpack(hashlib.shake_128(piece.encode()).digest(SIGNATURE_FORMAT.size))
+        for piece in pieces
+    ]
+    return tuple(map(min, zip(*hashes)))
+
+
+def band_buckets(sig):
+    """Return the (band, bucket) pairs that accounts need to share one of to be compared."""
+
+    return [
+        (band, BAND_FORMAT.pack(*sig[band * ROWS : (band + 1) * ROWS])) for band in range(BANDS)
+    ]
+
+
+def similarity(sig, other):
+    """Return the estimated share of shingles that two signatures' accounts have in common."""
+
+    return sum(mine == theirs for mine, theirs in zip(sig, other)) / SIGNATURE_SIZE
+
+
+def clusters_file():
+    """Return the Path of the clusters file."""
+
+    return common.MASTOOLS_DIR / CLUSTERS_FILE_NAME
+
+
+def open_index():
+    """Return a connection to the clusters file, creating it if it doesn't exist yet.
+
+    Raise a ValueError if it was made with different signatures than these.
+    """
+
+    clusters_file().parent.mkdir(parents=True, exist_ok=True)
+    connection = sqlite3.connect(clusters_file())
+    version = connection.execute("PRAGMA user_version").fetchone()[0]
+    if version == 0:
+        connection.executescript(CLUSTERS_SCHEMA)
+        connection.execute(f"PRAGMA user_version = {INDEX_VERSION}")
+    elif version != INDEX_VERSION:
+        connection.close()
+        raise ValueError(
+            f"Unknown clusters version number: expected {INDEX_VERSION}, got {version}. "
+            f"Delete {clusters_file()} to start over."
+        )
+    return connection
+
+
+def matching_cluster(connection, sig, buckets):
+    """Return the id of a cluster with an account like the signature's, or None."""
+
+    values = ", ".join("(?, ?)" for _ in buckets)
+    candidates = connection.execute(
+        "SELECT members.cluster_id, members.signature FROM buckets "
+        "JOIN members USING (username) "
+        f"WHERE (buckets.band, buckets.bucket) IN (VALUES {values})",
+        [value for bucket in buckets for value in bucket],
+    )
+    # Any account that's close enough will do, so stop at the first one instead of reading every
+    # member of a big cluster.
+    for cluster_id, other in candidates:
+        if similarity(sig, SIGNATURE_FORMAT.unpack(other)) >= THRESHOLD:
+            return cluster_id
+    return None
+
+
+def assign(connection, username, data, created_at):
+    """Add the account to the cluster it's like, or to a new one, and return the cluster's id.
+
+    Return None for accounts without any text to compare.
+    """
+
+    row = connection.execute(
+        "SELECT cluster_id FROM members WHERE username = ?", (username,)
+    ).fetchone()
+    if row:
+        return row[0]
+
+    sig = signature(data)
+    if sig is None:
+        return None
+
+    buckets = band_buckets(sig)
+    cluster_id = matching_cluster(connection, sig, buckets)
+    if cluster_id is None:
+        cluster_id = connection.execute(
+            "INSERT INTO clusters (representative, created_at) VALUES (?, ?)",
+            (username, created_at),
+        ).lastrowid
+
+    connection.execute(
+        "INSERT INTO members (username, cluster_id, signature) VALUES (?, ?, ?)",
+        (username, cluster_id, SIGNATURE_FORMAT.pack(*sig)),
+    )
+    connection.executemany(
+        "INSERT OR IGNORE INTO buckets (band, bucket, username) VALUES (?, ?, ?)",
+        [(band, bucket, username) for band, bucket in buckets],
+    )
+    return cluster_id
+
+
+def cluster_info(connection, cluster_id):
+    """Return the Cluster with the id."""
+
+    representative, size = connection.execute(
+        "SELECT representative, (SELECT count(*) FROM members WHERE cluster_id = clusters.id) "
+        "FROM clusters WHERE id = ?",
+        (cluster_id,),
+    ).fetchone()
+    return Cluster(cluster_id, representative, size)
+
+
+def members(cluster_id):
+    """Return the usernames of the accounts in the cluster."""
+
+    with closing(open_index()) as connection:
+        return [
+            username
+            for (username,) in connection.execute(
+                "SELECT username FROM members WHERE cluster_id = ? ORDER BY username",
+                (cluster_id,),
+            )
+        ]
+
+
+def clustered(changes, now=None):
+    """Yield (Cluster or None, list of changes) pairs for the (kind, username, old, new) changes.
+
+    Changes other than new users are yielded right away, alone and without a cluster. New users
+    are held back until the changes run out, then yielded grouped by cluster. The clusters are only
+    saved after the last group, like history.recorded does.
+    """
+
+    created_at = history.timestamp(now or datetime.now(timezone.utc))
+    groups = {}
+    with closing(open_index()) as connection:
+        for change in changes:
+            kind, username, _, new_data = change
+            cluster_id = None
+            if kind == "new":
+                cluster_id = assign(connection, username, new_data, created_at)
+            if cluster_id is None:
+                yield None, [change]
+            else:
+                groups.setdefault(cluster_id, []).append(change)
+
+        for cluster_id, group in groups.items():
+            yield cluster_info(connection, cluster_id), group
+        connection.commit()
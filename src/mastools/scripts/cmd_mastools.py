@@ -1,13 +1,71 @@
 """Configure the mastools command."""
 
 import argparse
+import importlib
+import io
 import logging
+import shlex
+import sys
+import threading
+from concurrent.futures import ThreadPoolExecutor
 
-from . import unconfirmed_users, user_changes
+from . import common, profiling
 
+# The subcommands, the modules that set them up, and their help. Importing those modules pulls in
+# SQLAlchemy, the models, and psycopg2, so only the one that's been chosen is imported. The help is
+# repeated here so that `mastools --help` can list them all without importing any.
+SUBCOMMANDS = {
+    "detect-signup-flood": (
+        "mastools.scripts.signup_flood",
+        "Warn about bursts of signups, compared to the usual rate for their email domain.",
+    ),
+    "history": (
+        "mastools.scripts.history",
+        "Show the changes that have been reported before, or how many there were over time.",
+    ),
+    "purge-unconfirmed": (
+        "mastools.scripts.purge_unconfirmed",
+        "Delete unconfirmed users, and their accounts, that signed up when or where you say.",
+    ),
+    "show-unconfirmed-users": (
+        "mastools.scripts.unconfirmed_users",
+        "Show users who haven't confirmed their email yet.",
+    ),
+    "show-user-changes": (
+        "mastools.scripts.user_changes",
+        "Fetch all current users with URLs in their account info and show any changes.",
+    ),
+    "suspend": (
+        "mastools.scripts.suspend",
+        "Suspend the local accounts named, flagged by show-user-changes, or in a cluster.",
+    ),
+    "watch": (
+        "mastools.scripts.watch",
+        "Watch for new, changed, or deleted accounts that mention URLs, and show them right away.",
+    ),
+}
+
+
+def chosen_subcommand(argv):
+    """Return the name of the subcommand on the command line, if there is one.
+
+    The top-level parser has no options of its own other than --help, so that's the first argument
+    that isn't an option.
+    """
+
+    return next((arg for arg in argv if not arg.startswith("-")), None)
 
-def handle_command_line():
-    """Create a command command line, then parse it."""
+
+def make_parser(argv=None):
+    """Return the parser for the mastools command line.
+
+    Only the subcommand chosen in argv (sys.argv by default) gets all its options. The rest are
+    listed by name and help so that they show up in --help.
+    """
+
+    if argv is None:
+        argv = sys.argv[1:]
+    chosen = chosen_subcommand(argv)
 
     parser = argparse.ArgumentParser(description=handle_command_line.__doc__)
 
@@ -19,10 +77,116 @@ def handle_command_line():
     universal.add_argument(
         "--verbose", "-v", help="Increase logging verbosity", action="count", default=0
     )
+    common.add_batch_size_argument(universal)
+    profiling.add_arguments(universal)
+
+    for name, (module_name, help_text) in SUBCOMMANDS.items():
+        if name == chosen:
+            importlib.import_module(module_name).setup_command_line(subgroup, universal)
+        else:
+            subgroup.add_parser(name, help=help_text, parents=[universal])
+
+    this = subgroup.add_parser(
+        "run", help="Run several subcommands over the same connection", parents=[universal]
+    )
+    this.add_argument(
+        "commands",
+        help='Subcommands to run in order, each with its options, like "show-user-changes --full"',
+        nargs="+",
+    )
+    this.set_defaults(func=run_commands)
+
+    return parser
+
+
+class ThreadStdout:  # pylint: disable=too-few-public-methods
+    """Stands in for stdout, sending what each thread writes to its own buffer if it has one."""
+
+    def __init__(self, stdout):
+        self.stdout = stdout
+        self.local = threading.local()
+
+    def __getattr__(self, name):
+        return getattr(getattr(self.local, "buffer", self.stdout), name)
+
+
+def run_buffered(stdout, command):
+    """Run the command in this thread, and return what it wrote to stdout."""
+
+    # pylint: disable=import-outside-toplevel
+    from mastools.models.base import close_sessions
 
-    for child_module in (unconfirmed_users, user_changes):
-        child_module.setup_command_line(subgroup, universal)
+    stdout.local.buffer = io.StringIO()
+    try:
+        run_command(command.func, command)
+        return stdout.local.buffer.getvalue()
+    finally:
+        del stdout.local.buffer
+        close_sessions()
+
+
+def run_concurrently(commands, concurrency):
+    """Run up to `concurrency` of the commands at a time, each in a thread with its own session.
+
+    Their database queries overlap, but their output is held back and written in the same order as
+    if they'd run one after another. If one fails, the output of those before it is still written,
+    the ones that haven't started yet are skipped, and its exception is raised.
+    """
+
+    stdout = ThreadStdout(sys.stdout)
+    sys.stdout = stdout
+    try:
+        with ThreadPoolExecutor(max_workers=concurrency) as executor:
+            futures = [executor.submit(run_buffered, stdout, command) for command in commands]
+            try:
+                for future in futures:
+                    stdout.stdout.write(future.result())
+                    stdout.stdout.flush()
+            finally:
+                for future in futures:
+                    future.cancel()
+    finally:
+        sys.stdout = stdout.stdout
+
+
+def run_commands(args):
+    """Run each of the subcommands, one after another or several at a time.
+
+    They all share the same pooled database engine, so a single cron job can run every check over
+    one connection. If the config file's "concurrency" is more than 1, that many run at the same
+    time, each with a connection of its own.
+    """
+
+    commands = []
+    for command in args.commands:
+        argv = shlex.split(command)
+        parser = make_parser(argv)
+        commands.append(parser.parse_args(argv))
+        if getattr(commands[-1], "func", run_commands) is run_commands:
+            parser.error(f"not a subcommand that run can run: {args.commands}")
+
+    concurrency = common.get_concurrency()
+    if concurrency > 1 and len(commands) > 1:
+        run_concurrently(commands, concurrency)
+        return
+
+    for command in commands:
+        run_command(command.func, command)
+
+
+def run_command(func, args):
+    """Run func(args), profiling it if the args say to."""
+
+    if getattr(args, "profile", None) or getattr(args, "profile_dump", None):
+        profiling.profiled(func, args)
+    else:
+        func(args)
+
+
+def handle_command_line():
+    """Create a command command line, then parse it."""
 
+    parser = make_parser()
     args = parser.parse_args()
     try:
         func = args.func
@@ -39,4 +203,4 @@ def handle_command_line():
 
     logging.basicConfig(level=log_level)
 
-    func(args)
+    run_command(func, args)
@@ -1,26 +1,197 @@
 """Common things used by all scripts."""
 
+import argparse
+import hashlib
 import json
+import os
+import re
+import sqlite3
+from contextlib import closing, contextmanager
+from datetime import datetime, timedelta, timezone
 from pathlib import Path
 
+from mastools.scripts import profiling
+
 MASTOOLS_DIR = Path("~/.mastools").expanduser()
 CONFIG_FILE = MASTOOLS_DIR / "config.json"
 
+# The layout of the snapshot files. This is separate from the version of the data stored in them.
+SNAPSHOT_FORMAT = 2
+SNAPSHOT_SCHEMA = """
+CREATE TABLE meta (name TEXT PRIMARY KEY, value);
+CREATE TABLE entries (
+    position INTEGER PRIMARY KEY,
+    key TEXT NOT NULL UNIQUE,
+    value TEXT NOT NULL,
+    digest BLOB NOT NULL
+);
+"""
+
+# Pass this as a value to save_cache to keep the value that's already in the cache.
+UNCHANGED = object()
+
+# How many rows to fetch from the database's server-side cursor at a time
+DEFAULT_BATCH_SIZE = 1000
+
+DURATION_UNITS = {"m": "minutes", "h": "hours", "d": "days"}
+
 
 def get_config():
-    """Return the parsed contents of the config file."""
+    """Return the primary database's connection details from the config file."""
+
+    config = json.loads(CONFIG_FILE.read_text())
+    config.pop("replica", None)
+    config.pop("concurrency", None)
+    return config
+
+
+def get_replica_config():
+    """Return the read replica's connection details, and whether to use the primary if it's down.
+
+    The replica's details are the primary's, overridden by any in the config file's "replica" entry.
+    If there's no such entry, they're None.
+    """
+
+    config = json.loads(CONFIG_FILE.read_text())
+    config.pop("concurrency", None)
+    replica = config.pop("replica", None)
+    if replica is None:
+        return None, False
+
+    replica = dict(replica)
+    fallback = replica.pop("fallback_to_primary", False)
+    return {**config, **replica}, fallback
 
-    return json.loads(CONFIG_FILE.read_text())
+
+def get_concurrency():
+    """Return how many subcommands `mastools run` may run at the same time, from the config file.
+
+    That's 1, running them one after another, unless the config file says otherwise.
+    """
+
+    if not CONFIG_FILE.exists():
+        return 1
+
+    concurrency = json.loads(CONFIG_FILE.read_text()).get("concurrency", 1)
+    if not isinstance(concurrency, int) or isinstance(concurrency, bool) or concurrency < 1:
+        raise ValueError(f"concurrency must be a whole number of at least 1, not {concurrency!r}")
+    return concurrency
+
+
+def parse_since(value):
+    """Return the time described by an ISO timestamp or a duration ago like "90m", "2h", or "1d".
+
+    Mastodon stores its timestamps in UTC without a time zone, so that's what this returns too.
+    """
+
+    match = re.fullmatch(r"(\d+)([mhd])", value)
+    if match:
+        delta = timedelta(**{DURATION_UNITS[match[2]]: int(match[1])})
+        return datetime.now(timezone.utc).replace(tzinfo=None) - delta
+
+    try:
+        return datetime.fromisoformat(value)
+    except ValueError as exc:
+        raise argparse.ArgumentTypeError(
+            f"expected a timestamp or a duration like 2h, got {value!r}"
+        ) from exc
+
+
+def add_batch_size_argument(parser):
+    """Add the option to set how many rows to fetch at a time."""
+
+    parser.add_argument(
+        "--batch-size",
+        help=f"Fetch this many rows at a time from the database (default: {DEFAULT_BATCH_SIZE})",
+        type=int,
+        default=DEFAULT_BATCH_SIZE,
+    )
+
+
+def stream(session, statement, batch_size=DEFAULT_BATCH_SIZE):
+    """Return the rows of the select(), streamed through a server-side cursor.
+
+    Otherwise psycopg2 fetches the whole result set into memory before returning the first row.
+    """
+
+    return profiling.timed(
+        "scan", session.execute(statement.execution_options(yield_per=batch_size))
+    )
 
 
 def cache_file(cache_key):
-    """Return the Path of the cache file for the key."""
+    """Return the Path of the old-style JSON cache file for the key."""
 
     return MASTOOLS_DIR / f"{cache_key}_cache.json"
 
 
-def load_cache(cache_key, version):
-    """Return the contents of the cache for the key, if its version is correct."""
+def snapshot_file(cache_key):
+    """Return the Path of the snapshot file for the key."""
+
+    return MASTOOLS_DIR / f"{cache_key}_cache.sqlite3"
+
+
+def encode(value):
+    """Return the canonical JSON text of the value."""
+
+    return json.dumps(value, sort_keys=True, separators=(",", ":"))
+
+
+def hash_text(text):
+    """Return a short hash of the text."""
+
+    return hashlib.blake2b(text.encode(), digest_size=16).digest()
+
+
+def digest(value):
+    """Return a short hash of the value that's equal for equal values."""
+
+    return hash_text(encode(value))
+
+
+def upgrade_snapshot(connection):
+    """Add the digests that format 1 snapshots didn't have, in place."""
+
+    connection.execute("ALTER TABLE entries ADD COLUMN digest BLOB NOT NULL DEFAULT x''")
+    rows = connection.execute("SELECT position, value FROM entries").fetchall()
+    for position, value in rows:
+        text = encode(json.loads(value))
+        connection.execute(
+            "UPDATE entries SET value = ?, digest = ? WHERE position = ?",
+            (text, hash_text(text), position),
+        )
+    connection.execute("UPDATE meta SET value = 2 WHERE name = 'format'")
+    connection.commit()
+
+
+def open_snapshot(cache_key, version):
+    """Return a connection to the snapshot for the key, or None if there isn't one yet.
+
+    Raise a ValueError if the snapshot's layout or version doesn't match what we expect.
+    """
+
+    path = snapshot_file(cache_key)
+    if not path.exists():
+        return None
+
+    connection = sqlite3.connect(path)
+    meta = dict(connection.execute("SELECT name, value FROM meta"))
+    if meta.get("format") == 1:
+        upgrade_snapshot(connection)
+        meta["format"] = 2
+
+    for name, expected in (("format", SNAPSHOT_FORMAT), ("version", version)):
+        if meta.get(name) != expected:
+            connection.close()
+            raise ValueError(
+                f"Unknown {cache_key} {name} number: expected {expected}, got {meta.get(name)}"
+            )
+
+    return connection
+
+
+def migrate_json_cache(cache_key, version):
+    """Convert an old JSON cache file into a snapshot, and return its contents."""
 
     # Try to get the results of the last run, but fall back to an empty dict if that's not
     # available. That's most likely to happen on the first run.
@@ -34,17 +205,138 @@ def load_cache(cache_key, version):
             f"Unknown {cache_key} version number: expected {version}, got {cache['version']}"
         )
 
-    return cache[cache_key]
+    data = cache[cache_key]
+    save_cache(cache_key, version, data)
+    cache_file(cache_key).unlink()
+    return data
+
+
+def load_cache(cache_key, version):
+    """Return the contents of the cache for the key, if its version is correct."""
+
+    with profiling.phase("cache"):
+        connection = open_snapshot(cache_key, version)
+        if connection is None:
+            return migrate_json_cache(cache_key, version)
+
+        with closing(connection):
+            return {
+                key: json.loads(value)
+                for key, value in connection.execute(
+                    "SELECT key, value FROM entries ORDER BY position"
+                )
+            }
+
+
+def load_cache_digests(cache_key, version):
+    """Return the digests of the contents of the cache for the key, if its version is correct.
+
+    This is much smaller than the contents themselves, and it's enough to tell whether something
+    has changed.
+    """
+
+    with profiling.phase("cache"):
+        connection = open_snapshot(cache_key, version)
+        if connection is None:
+            return {
+                key: digest(value) for key, value in migrate_json_cache(cache_key, version).items()
+            }
+
+        with closing(connection):
+            return dict(connection.execute("SELECT key, digest FROM entries ORDER BY position"))
+
+
+def lookup_cache(cache_key, version, key, default=None):
+    """Return one item from the cache for the key without loading the rest of it."""
+
+    with profiling.phase("cache"):
+        connection = open_snapshot(cache_key, version)
+        if connection is None:
+            return migrate_json_cache(cache_key, version).get(key, default)
+
+        with closing(connection):
+            row = connection.execute("SELECT value FROM entries WHERE key = ?", (key,)).fetchone()
+
+    return default if row is None else json.loads(row[0])
+
+
+@contextmanager
+def cache_writer(cache_key, version):
+    """Return a function that adds a key and value to a new cache for the key.
+
+    The new cache replaces the old one when the with block ends, or is thrown away if it raises an
+    exception. Values that are UNCHANGED are copied from the old cache without being loaded.
+    """
+
+    # Save these results for the next run. Keep the version information with them from the start,
+    # because experience says if we don't do this then the next release will add a feature that
+    # requires a change in the data layout, and then we'll have to write a data migration or
+    # something.
+    #
+    # Build the new snapshot next to the old one and then swap it into place, so that a crash
+    # halfway through leaves the last complete snapshot behind instead of half of a new one.
+
+    path = snapshot_file(cache_key)
+    temp_path = path.with_name(f"{path.name}.{os.getpid()}.tmp")
+    temp_path.unlink(missing_ok=True)
+
+    try:
+        with closing(sqlite3.connect(temp_path)) as connection:
+            connection.executescript(SNAPSHOT_SCHEMA)
+            connection.executemany(
+                "INSERT INTO meta (name, value) VALUES (?, ?)",
+                (("format", SNAPSHOT_FORMAT), ("version", version)),
+            )
+            if path.exists():
+                connection.execute("ATTACH DATABASE ? AS old", (str(path),))
+
+            def write(key, value):
+                if value is UNCHANGED:
+                    connection.execute(
+                        "INSERT INTO entries (key, value, digest) "
+                        "SELECT key, value, digest FROM old.entries WHERE key = ?",
+                        (key,),
+                    )
+                else:
+                    text = encode(value)
+                    connection.execute(
+                        "INSERT INTO entries (key, value, digest) VALUES (?, ?, ?)",
+                        (key, text, hash_text(text)),
+                    )
+
+            yield write
+            with profiling.phase("cache"):
+                connection.commit()
+        os.replace(temp_path, path)
+    finally:
+        temp_path.unlink(missing_ok=True)
 
 
 def save_cache(cache_key, version, data):
-    """Write the data to the cache for the key."""
+    """Write the data to the cache for the key.
+
+    Values that are UNCHANGED are copied from the existing cache without being loaded.
+    """
+
+    with profiling.phase("cache"), cache_writer(cache_key, version) as write:
+        for key, value in data.items():
+            write(key, value)
+
+
+def iter_cache(cache_key, version):
+    """Yield the (key, digest, JSON text of the value) of every item in the cache, in key order.
 
-    # Save these results for the next run. Include the version information and nest the user
-    # information inside a "users" key from the start, because experience says if we don't do this
-    # then the next release will add a feature that requires a change in the data layout, and then
-    # we'll have to write a data migration or something.
+    The items are read from the snapshot as they're needed, so this takes the same memory however
+    big the cache is. Keys are sorted by code point, the same way Python sorts strings.
+    """
 
-    cache_data = {cache_key: data, "version": version}
+    connection = open_snapshot(cache_key, version)
+    if connection is None:
+        # Converting the old JSON cache makes a snapshot, if there was anything to convert.
+        migrate_json_cache(cache_key, version)
+        connection = open_snapshot(cache_key, version)
+        if connection is None:
+            return
 
-    cache_file(cache_key).write_text(json.dumps(cache_data, indent=2))
+    with closing(connection):
+        yield from connection.execute("SELECT key, digest, value FROM entries ORDER BY key")
@@ -9,49 +9,473 @@
 """Fix locale files which have been damaged upstream."""
 
 import argparse
+import contextlib
+import glob
+import hashlib
+import io
 import json
+import math
+import os
+import re
+import shutil
+import tempfile
+from concurrent.futures import ProcessPoolExecutor
+from functools import lru_cache, partial
+from json.decoder import WHITESPACE, scanstring
+from json.scanner import NUMBER_RE
 from pathlib import Path
 from sys import stdout
+from typing import NamedTuple
 
 from ruamel.yaml import YAML
 
+YAML_SUFFIXES = (".yaml", ".yml")
+JSON_SUFFIXES = (".json",)
+MANIFEST_VERSION = 1
+CHUNK_SIZE = 1 << 16
+INDENT = "  "
 
-def repair_string(value: str) -> str:
+CONSTANT_RE = re.compile(r"true|false|null|NaN|-?Infinity")
+CONSTANTS = {
+    "true": True,
+    "false": False,
+    "null": None,
+    "NaN": math.nan,
+    "Infinity": math.inf,
+    "-Infinity": -math.inf,
+}
+
+
+class Rule(NamedTuple):
+    """A term to fix, and what to fix it to.
+
+    If whole_word is set, only match it when it isn't part of a longer word. If preserve_case is
+    set, also fix its Capitalized and UPPERCASE forms to the same form of the replacement.
+    """
+
+    find: str
+    replace: str
+    whole_word: bool = False
+    preserve_case: bool = False
+
+
+DEFAULT_RULES = (Rule("post", "toot"), Rule("Post", "Toot"))
+
+
+def case_forms(rule: Rule):
+    """Yield each (find, replace) pair that the rule covers."""
+    yield rule.find, rule.replace
+    if rule.preserve_case:
+        yield rule.find[:1].upper() + rule.find[1:], rule.replace[:1].upper() + rule.replace[1:]
+        yield rule.find.upper(), rule.replace.upper()
+
+
+def trie_pattern(terms) -> str:
+    """Return a regular expression that matches the longest of the terms it can.
+
+    Sharing prefixes keeps Python's regex engine from trying every term at every position.
+    """
+    trie = {}
+    for term in terms:
+        node = trie
+        for char in term:
+            node = node.setdefault(char, {})
+        node[""] = True
+
+    def node_pattern(node):
+        branches = [
+            re.escape(char) + node_pattern(child) for char, child in sorted(node.items()) if char
+        ]
+        if not branches:
+            return ""
+        pattern = branches[0] if len(branches) == 1 else "(?:" + "|".join(branches) + ")"
+        # Greedy, so the regex engine only settles for a shorter term if the longer one fails.
+        return f"(?:{pattern})?" if "" in node else pattern
+
+    return node_pattern(trie)
+
+
+@lru_cache()
+def compile_rules(rules: tuple[Rule, ...]):
+    """Return a function that fixes every rule's terms in a string in one pass.
+
+    Every term is matched by the same regular expression, so each string is scanned once however
+    many rules there are, and a replacement is never itself replaced by a later rule.
+    """
+    replacements = {}
+    words = set()
+    substrings = set()
+    for rule in rules:
+        for find, replace in case_forms(rule):
+            if find:
+                replacements.setdefault(find, replace)
+                (words if rule.whole_word else substrings).add(find)
+    if not replacements:
+        return lambda value: value
+
+    alternatives = []
+    if words:
+        alternatives.append(rf"(?<!\w){trie_pattern(words)}(?!\w)")
+    if substrings:
+        alternatives.append(trie_pattern(substrings))
+    pattern = re.compile("|".join(alternatives))
+
+    def replace_match(match):
+        return replacements[match.group()]
+
+    def repair(value):
+        new_value = pattern.sub(replace_match, value)
+        if new_value == value:
+            return value
+        # Keep ruamel's quoting style, which lives in str subclasses.
+        return new_value if type(value) is str else type(value)(new_value)
+
+    return repair
+
+
+def load_rules(filepath: Path) -> tuple[Rule, ...]:
+    """Load a rule table from a JSON list of objects with Rule's fields."""
+    try:
+        return tuple(Rule(**rule) for rule in json.loads(filepath.read_text()))
+    except TypeError as exc:
+        raise ValueError(f"Invalid rule table in {filepath}: {exc}") from exc
+
+
+def repair_string(value: str, rules: tuple[Rule, ...] = DEFAULT_RULES) -> str:
     """Fix a broken locale string."""
-    return value.replace("post", "toot").replace("Post", "Toot")
+    return compile_rules(rules)(value)
 
 
-def deep_update(item):
+def deep_update(item, rules: tuple[Rule, ...] = DEFAULT_RULES):
     """Fix arbitrarily deeply nested locale values."""
-    for key, value in item.items():
-        if isinstance(value, dict):
-            deep_update(value)
+    repair = compile_rules(rules)
+    # Walk the tree with a stack instead of recursing so that no nesting is too deep.
+    stack = [item]
+    while stack:
+        container = stack.pop()
+        entries = container.items() if isinstance(container, dict) else enumerate(container)
+        for key, value in entries:
+            if isinstance(value, str):
+                container[key] = repair(value)
+            elif isinstance(value, (dict, list)):
+                stack.append(value)
+
+
+@contextlib.contextmanager
+def atomic_writer(filepath: Path):
+    """Return a temp file to write new contents to, which then replace the file's all at once."""
+    with tempfile.NamedTemporaryFile(
+        "w", dir=filepath.parent, prefix=f".{filepath.name}.", delete=False, encoding="utf-8"
+    ) as temp:
+        try:
+            yield temp
+        except BaseException:
+            temp.close()
+            os.unlink(temp.name)
+            raise
+    if filepath.exists():
+        shutil.copymode(filepath, temp.name)
+    os.replace(temp.name, filepath)
+
+
+def write_atomically(filepath: Path, text: str):
+    """Replace the file's contents without ever leaving it half-written."""
+    with atomic_writer(filepath) as output:
+        output.write(text)
+
+
+def json_tokens(stream, chunk_size: int = CHUNK_SIZE):
+    """Yield the JSON tokens in a text stream as (kind, value) pairs, reading a chunk at a time.
+
+    Punctuation is its own kind, with a value of None. Strings are "string", and numbers, true,
+    false, and null are "literal", with the values json.load would give them.
+    """
+    buffer = ""
+    position = 0
+    at_eof = False
+    while True:
+        position = WHITESPACE.match(buffer, position).end()
+        if position == len(buffer):
+            if at_eof:
+                return
+            buffer = stream.read(chunk_size)
+            position = 0
+            at_eof = not buffer
+            continue
+
+        char = buffer[position]
+        if char in "{}[]:,":
+            position += 1
+            yield char, None
+            continue
+
+        # The token may run past the end of what's been read so far. If it might, read more and
+        # try again, keeping only the unconsumed part of the buffer so memory stays flat.
+        try:
+            kind = None
+            if char == '"':
+                value, end = scanstring(buffer, position + 1)
+                kind = "string"
+            else:
+                value, end = scan_literal(buffer, position)
+                kind = "literal"
+        except json.JSONDecodeError:
+            if at_eof:
+                raise
+            end = len(buffer)
+        # A number followed by the end of the buffer, or by "." or "e-" there, may not be all there.
+        if not at_eof and end >= len(buffer) - (2 if kind == "literal" else 0):
+            chunk = stream.read(chunk_size)
+            buffer = buffer[position:] + chunk
+            position = 0
+            at_eof = not chunk
+            continue
+
+        position = end
+        yield kind, value
+
+
+def scan_literal(buffer: str, position: int):
+    """Return the number, true, false, or null at the position, and where it ends."""
+    match = NUMBER_RE.match(buffer, position)
+    if match:
+        integer, fraction, exponent = match.groups()
+        if fraction or exponent:
+            return float(integer + (fraction or "") + (exponent or "")), match.end()
+        return int(integer), match.end()
+
+    match = CONSTANT_RE.match(buffer, position)
+    if match:
+        return CONSTANTS[match.group()], match.end()
+
+    raise json.JSONDecodeError("Expecting value", buffer, position)
+
+
+def write_repaired_json(stream, output, rules: tuple[Rule, ...] = DEFAULT_RULES):
+    """Fix every string value in the JSON stream, however deeply nested, and write as it goes.
+
+    The output is formatted the same as json.dumps(indent=2, ensure_ascii=False). Only a chunk of
+    the input and the path to the current value are held in memory at once.
+    """
+    repair = compile_rules(rules)
+    values = {"string", "literal", "{", "["}
+    # Whether each open container is an object, and how many items it's had so far
+    stack = []
+    expect = values
+    after_key = False
+
+    for kind, value in json_tokens(stream):
+        if kind not in expect:
+            raise ValueError(f"Unexpected {kind!r} in JSON")
+
+        if kind == ",":
+            expect = {"string"} if stack[-1][0] else values
+            continue
+        if kind == ":":
+            output.write(": ")
+            expect = values
+            after_key = True
+            continue
+
+        if kind in "}]":
+            _, count = stack.pop()
+            output.write(("\n" + INDENT * len(stack) if count else "") + kind)
         else:
-            item[key] = repair_string(value)
+            is_key = bool(stack) and stack[-1][0] and not after_key
+            if stack and not after_key:
+                stack[-1][1] += 1
+                output.write(("," if stack[-1][1] > 1 else "") + "\n" + INDENT * len(stack))
+            after_key = False
 
+            if kind == "string":
+                output.write(json.dumps(value if is_key else repair(value), ensure_ascii=False))
+                if is_key:
+                    expect = {":"}
+                    continue
+            elif kind == "literal":
+                output.write(json.dumps(value))
+            else:
+                output.write(kind)
+                stack.append([kind == "{", 0])
+                expect = {"string", "}"} if kind == "{" else values | {"]"}
+                continue
 
-def repair_json(filepath: Path, overwrite: bool = False):
-    """Fix broken strings in JSON files."""
-    locale = json.load(filepath.open())
-    new_locale = {key: repair_string(value) for key, value in locale.items()}
-    output = json.dumps(new_locale, indent=2, ensure_ascii=False)
-    if overwrite:
-        filepath.write_text(output)
-    else:
-        stdout.write(output)
+        # A value just ended.
+        if not stack:
+            expect = set()
+        else:
+            expect = {",", "}" if stack[-1][0] else "]"}
 
+    if stack or expect:
+        raise ValueError("Unexpected end of JSON")
 
-def repair_yaml(filepath: Path, overwrite: bool = False):
-    """Fix broken strings in YAML files."""
+
+def write_repaired_yaml(filepath: Path, output, rules: tuple[Rule, ...] = DEFAULT_RULES):
+    """Fix broken strings in a YAML file, and write it out."""
     yaml = YAML()
     yaml.explicit_start = True
     yaml.preserve_quotes = True
     locale = yaml.load(filepath)
 
-    deep_update(locale)
+    deep_update(locale, rules)
 
     yaml.width = 10000
-    yaml.dump(locale, filepath if overwrite else stdout)
+    yaml.dump(locale, output)
+
+
+def write_repaired(filepath: Path, output, rules: tuple[Rule, ...] = DEFAULT_RULES):
+    """Fix broken strings in a locale file, and write it out."""
+    if filepath.suffix in YAML_SUFFIXES:
+        write_repaired_yaml(filepath, output, rules)
+    elif filepath.suffix in JSON_SUFFIXES:
+        with filepath.open(encoding="utf-8") as stream:
+            write_repaired_json(stream, output, rules)
+    else:
+        raise ValueError(f"Unexpected extension: {filepath.suffix=}")
+
+
+def repaired(filepath: Path, rules: tuple[Rule, ...] = DEFAULT_RULES) -> str:
+    """Return the fixed contents of a locale file."""
+    output = io.StringIO()
+    write_repaired(filepath, output, rules)
+    return output.getvalue()
+
+
+def repair_json(filepath: Path, overwrite: bool = False, rules: tuple[Rule, ...] = DEFAULT_RULES):
+    """Fix broken strings in JSON files."""
+    repair_file(filepath, overwrite, rules=rules, output=stdout)
+
+
+def repair_yaml(filepath: Path, overwrite: bool = False, rules: tuple[Rule, ...] = DEFAULT_RULES):
+    """Fix broken strings in YAML files."""
+    repair_file(filepath, overwrite, rules=rules, output=stdout)
+
+
+def file_hash(filepath: Path) -> str:
+    """Return a hash of the file's contents."""
+    digest = hashlib.sha256()
+    with filepath.open("rb") as stream:
+        while chunk := stream.read(CHUNK_SIZE):
+            digest.update(chunk)
+    return digest.hexdigest()
+
+
+def repair_file(  # pylint: disable=too-many-arguments
+    filepath: Path,
+    overwrite: bool = False,
+    known_hash: str | None = None,
+    rules: tuple[Rule, ...] = DEFAULT_RULES,
+    output=None,
+):
+    """Fix one file, and return its path, its new hash, and its output if it wasn't overwritten.
+
+    If the file's hash is known_hash, it's already been fixed, so leave it alone. If output is
+    given, write to it instead of returning the output.
+    """
+    if overwrite and known_hash is not None and file_hash(filepath) == known_hash:
+        return filepath, known_hash, None
+
+    if not overwrite:
+        if output is None:
+            return filepath, None, repaired(filepath, rules)
+        write_repaired(filepath, output, rules)
+        return filepath, None, None
+
+    with atomic_writer(filepath) as temp:
+        write_repaired(filepath, temp, rules)
+    return filepath, file_hash(filepath), None
+
+
+def locale_files(patterns):
+    """Yield every locale file named by the paths, directories, and globs, without repeats."""
+    seen = set()
+    for pattern in patterns:
+        path = Path(pattern)
+        if path.is_dir():
+            matches = sorted(
+                match
+                for match in path.rglob("*")
+                if match.suffix in YAML_SUFFIXES + JSON_SUFFIXES and match.is_file()
+            )
+        elif glob.has_magic(pattern):
+            matches = sorted(
+                match
+                for match in map(Path, glob.glob(pattern, recursive=True))
+                if match.suffix in YAML_SUFFIXES + JSON_SUFFIXES and match.is_file()
+            )
+        else:
+            if path.suffix not in YAML_SUFFIXES + JSON_SUFFIXES:
+                raise ValueError(f"Unexpected extension: {path.suffix=}")
+            matches = [path]
+
+        for match in matches:
+            if match.resolve() not in seen:
+                seen.add(match.resolve())
+                yield match
+
+
+def rules_hash(rules: tuple[Rule, ...]) -> str:
+    """Return a hash of the rule table."""
+    return hashlib.sha256(json.dumps(rules).encode()).hexdigest()
+
+
+def load_manifest(manifest: Path | None, rules: tuple[Rule, ...] = DEFAULT_RULES) -> dict:
+    """Return the hashes of the files that were fixed last time with the same rules."""
+    if manifest is None:
+        return {}
+    try:
+        data = json.loads(manifest.read_text())
+    except FileNotFoundError:
+        return {}
+    if data["version"] != MANIFEST_VERSION:
+        raise ValueError(
+            f"Unknown manifest version number: expected {MANIFEST_VERSION}, got {data['version']}"
+        )
+    # Files fixed with other rules may need fixing again.
+    if data.get("rules") != rules_hash(rules):
+        return {}
+    return data["files"]
+
+
+def save_manifest(manifest: Path, hashes: dict, rules: tuple[Rule, ...] = DEFAULT_RULES):
+    """Remember the hashes of the fixed files for next time."""
+    write_atomically(
+        manifest,
+        json.dumps(
+            {"version": MANIFEST_VERSION, "rules": rules_hash(rules), "files": hashes}, indent=2
+        ),
+    )
+
+
+def repair_files(filepaths, overwrite=False, jobs=None, manifest=None, rules=DEFAULT_RULES):
+    """Fix all the files in parallel, skipping any that the manifest says are already fixed."""
+    hashes = load_manifest(manifest, rules)
+    keys = [str(filepath.resolve()) for filepath in filepaths]
+
+    arguments = (
+        filepaths,
+        [overwrite] * len(filepaths),
+        [hashes.get(key) for key in keys],
+        [rules] * len(filepaths),
+    )
+
+    with contextlib.ExitStack() as stack:
+        # Starting worker processes costs more than fixing one file.
+        if jobs == 1 or len(filepaths) <= 1:
+            results = map(partial(repair_file, output=stdout), *arguments)
+        else:
+            executor = stack.enter_context(ProcessPoolExecutor(max_workers=jobs))
+            results = executor.map(repair_file, *arguments)
+
+        # Both maps return results in order, so stdout gets each file's output in turn.
+        for key, (_, new_hash, output) in zip(keys, results):
+            if output is not None:
+                stdout.write(output)
+            if new_hash is not None:
+                hashes[key] = new_hash
+
+    if manifest is not None and overwrite:
+        save_manifest(manifest, hashes, rules)
 
 
 def handle_command_line():
@@ -63,14 +487,35 @@ def handle_command_line():
         action="store_true",
         help="Write the changes back to the input file.",
     )
-    parser.add_argument("filename", type=Path, help="The file to fix.")
+    parser.add_argument(
+        "-j",
+        "--jobs",
+        type=int,
+        help="How many files to fix at once. Defaults to the number of CPUs.",
+    )
+    parser.add_argument(
+        "-m",
+        "--manifest",
+        type=Path,
+        help="Record the fixed files here, and skip them next time if they haven't changed.",
+    )
+    parser.add_argument(
+        "-r",
+        "--rules",
+        type=Path,
+        help='A JSON list of terms to fix, like [{"find": "boost", "replace": "reblog", '
+        '"whole_word": true, "preserve_case": true}]. Defaults to fixing "post" and "Post".',
+    )
+    parser.add_argument(
+        "filenames",
+        nargs="+",
+        help="The files to fix, or directories or globs of them.",
+    )
     args = parser.parse_args()
-    if args.filename.suffix in (".yaml", ".yml"):
-        repair_yaml(args.filename, args.overwrite)
-    elif args.filename.suffix == ".json":
-        repair_json(args.filename, args.overwrite)
-    else:
-        raise ValueError(f"Unexpected extension: {args.filename.suffix=}")
+    rules = DEFAULT_RULES if args.rules is None else load_rules(args.rules)
+    repair_files(
+        list(locale_files(args.filenames)), args.overwrite, args.jobs, args.manifest, rules
+    )
 
 
 if __name__ == "__main__":
@@ -0,0 +1,163 @@
+"""Keep a log of every change show-user-changes and watch report, and answer questions about it.
+
+Each run adds its changes to ~/.mastools/history.sqlite3 instead of replacing what was there, so
+it's possible to ask when an account first showed up, or how many accounts changed each hour. That
+file is all the history subcommand reads, so it never touches the Mastodon database.
+"""
+
+import json
+import sqlite3
+from contextlib import closing
+from datetime import datetime, timezone
+
+from mastools.scripts import common
+
+HISTORY_FILE_NAME = "history.sqlite3"
+
+HISTORY_SCHEMA = """
+CREATE TABLE IF NOT EXISTS events (
+    id INTEGER PRIMARY KEY,
+    recorded_at TEXT NOT NULL,
+    kind TEXT NOT NULL,
+    username TEXT NOT NULL,
+    data TEXT
+);
+CREATE INDEX IF NOT EXISTS events_by_username ON events (username, recorded_at);
+CREATE INDEX IF NOT EXISTS events_by_time ON events (recorded_at);
+"""
+
+# How many characters of an ISO timestamp identify each window
+WINDOWS = {"hour": len("2019-10-27T12"), "day": len("2019-10-27")}
+
+
+def history_file():
+    """Return the Path of the history file."""
+
+    return common.MASTOOLS_DIR / HISTORY_FILE_NAME
+
+
+def open_history():
+    """Return a connection to the history file, creating it if it doesn't exist yet."""
+
+    history_file().parent.mkdir(parents=True, exist_ok=True)
+    connection = sqlite3.connect(history_file())
+    connection.executescript(HISTORY_SCHEMA)
+    return connection
+
+
+def timestamp(when):
+    """Return the naive UTC ISO text that the history stores times as, so they sort correctly."""
+
+    if when.tzinfo is not None:
+        when = when.astimezone(timezone.utc).replace(tzinfo=None)
+    return when.isoformat(timespec="seconds")
+
+
+def recorded(changes, now=None):
+    """Yield the (kind, username, old data, new data) changes, and log them after the last one.
+
+    Every change from one run is logged with the same time, when the run started. They're only
+    committed once the changes run out, which is after show-user-changes has saved its cache, so a
+    run that fails partway through doesn't log changes that will be reported again next time.
+    """
+
+    recorded_at = timestamp(now or datetime.now(timezone.utc))
+    with closing(open_history()) as connection:
+        for change in changes:
+            kind, username, _, new_data = change
+            connection.execute(
+                "INSERT INTO events (recorded_at, kind, username, data) VALUES (?, ?, ?, ?)",
+                (
+                    recorded_at,
+                    kind,
+                    username,
+                    None if new_data is None else common.encode(new_data),
+                ),
+            )
+            yield change
+        connection.commit()
+
+
+def time_criteria(since=None, until=None):
+    """Return the SQL conditions and parameters that select events between the two times."""
+
+    conditions = []
+    parameters = []
+    if since is not None:
+        conditions.append("recorded_at >= ?")
+        parameters.append(timestamp(since))
+    if until is not None:
+        conditions.append("recorded_at < ?")
+        parameters.append(timestamp(until))
+    return conditions, parameters
+
+
+def events(username=None, since=None, until=None):
+    """Yield the (recorded_at, kind, username, data) of each logged change, oldest first."""
+
+    conditions, parameters = time_criteria(since, until)
+    if username is not None:
+        conditions.append("username = ?")
+        parameters.append(username)
+
+    where = f"WHERE {' AND '.join(conditions)}" if conditions else ""
+    with closing(open_history()) as connection:
+        for recorded_at, kind, name, data in connection.execute(
+            f"SELECT recorded_at, kind, username, data FROM events {where} "
+            "ORDER BY recorded_at, id",
+            parameters,
+        ):
+            yield recorded_at, kind, name, None if data is None else json.loads(data)
+
+
+def counts(window, since=None, until=None):
+    """Yield the (start of window, kind, number of changes) for each window that had changes."""
+
+    conditions, parameters = time_criteria(since, until)
+    where = f"WHERE {' AND '.join(conditions)}" if conditions else ""
+    with closing(open_history()) as connection:
+        yield from connection.execute(
+            f"SELECT substr(recorded_at, 1, {WINDOWS[window]}) AS start, kind, count(*) "
+            f"FROM events {where} GROUP BY start, kind ORDER BY start, kind",
+            parameters,
+        )
+
+
+def setup_command_line(subgroup, parent):
+    """Add the subcommand."""
+
+    this = subgroup.add_parser("history", help=show_history.__doc__, parents=[parent])
+    this.add_argument("username", help="Only show this user's changes", nargs="?")
+    this.add_argument(
+        "--since",
+        help="Only show changes since this timestamp, or this long ago (like 7d)",
+        type=common.parse_since,
+    )
+    this.add_argument(
+        "--until",
+        help="Only show changes before this timestamp, or this long ago",
+        type=common.parse_since,
+    )
+    this.add_argument(
+        "--per",
+        help="Count the changes in each hour or day instead of listing them",
+        choices=sorted(WINDOWS),
+    )
+    this.set_defaults(func=show_history)
+
+
+def show_history(args):
+    """Show the changes that have been reported before, or how many there were over time."""
+
+    if args.per:
+        if args.username:
+            raise ValueError("--per counts everyone's changes, so it can't be given a username")
+        for start, kind, count in counts(args.per, args.since, args.until):
+            print(f"{start}  {kind:<8} {count}")
+        return
+
+    for recorded_at, kind, username, data in events(args.username, args.since, args.until):
+        print(f"{recorded_at}  {kind:<8} {username}")
+        if data is not None and args.username:
+            print(f"  fields: {data['fields']!r}")
+            print(f"  note: {data['note']!r}")
@@ -0,0 +1,123 @@
+"""Apply a moderation action to lots of accounts at once, a chunk at a time.
+
+Each chunk is changed with one statement, which matches its rows with a single array parameter on
+PostgreSQL (`WHERE id = ANY(%s)`), and is committed on its own, so that no lock on accounts or users
+is held for longer than one chunk takes. What's been done so far is kept in a progress file in
+~/.mastools, so a run that was interrupted picks up where it left off the next time.
+"""
+
+import json
+import logging
+import os
+
+from sqlalchemy import ARRAY, any_, bindparam
+
+from mastools.scripts import common
+
+LOG = logging.getLogger(__name__)
+
+DEFAULT_CHUNK_SIZE = 500
+
+
+def add_arguments(parser):
+    """Add the options that every moderation subcommand has."""
+
+    parser.add_argument(
+        "--chunk-size",
+        help=f"Change this many accounts per transaction (default: {DEFAULT_CHUNK_SIZE})",
+        type=int,
+        default=DEFAULT_CHUNK_SIZE,
+    )
+    parser.add_argument(
+        "--dry-run", help="Show what would be changed without changing it", action="store_true"
+    )
+    parser.add_argument(
+        "--restart",
+        help="Forget about an unfinished run instead of finishing it, and start over",
+        action="store_true",
+    )
+
+
+def one_of(session, column, values):
+    """Return a condition that the column is one of the values.
+
+    On PostgreSQL that's one array parameter, so the statement is the same however many values
+    there are. Other databases get an IN list.
+    """
+
+    if session.get_bind().dialect.name == "postgresql":
+        return column == any_(
+            bindparam("values", list(values), type_=ARRAY(column.type), unique=True)
+        )
+    return column.in_(list(values))
+
+
+def progress_file(action):
+    """Return the Path of the progress file for the action."""
+
+    return common.MASTOOLS_DIR / f"{action}_progress.json"
+
+
+def load_progress(action):
+    """Return the progress of an unfinished run of the action, or None if there isn't one."""
+
+    try:
+        return json.loads(progress_file(action).read_text())
+    except FileNotFoundError:
+        return None
+
+
+def save_progress(action, progress):
+    """Replace the progress file for the action, all at once."""
+
+    path = progress_file(action)
+    path.parent.mkdir(parents=True, exist_ok=True)
+    temp_path = path.with_name(f"{path.name}.{os.getpid()}.tmp")
+    temp_path.write_text(json.dumps(progress))
+    os.replace(temp_path, path)
+
+
+def moderate(session, action, find_targets, apply, args):  # pylint: disable=too-many-arguments
+    """Apply the action to its targets a chunk at a time, and return how many it changed.
+
+    find_targets() returns a list of (id, description) pairs for the rows to change, and
+    apply(session, ids) changes a chunk of them and returns how many it changed. Each chunk is
+    committed, and then recorded in the progress file. If a run dies in between, the next one
+    applies that chunk again, so apply needs to skip rows that it's already changed.
+    """
+
+    progress = None if args.restart else load_progress(action)
+    if progress is None:
+        targets = find_targets()
+        # Don't keep the transaction that found them open while changing them.
+        session.rollback()
+        if args.dry_run:
+            for _, description in targets:
+                print(f"Would {action} {description}")
+            return 0
+        progress = {"targets": [target for target, _ in targets], "done": 0}
+        save_progress(action, progress)
+    else:
+        left = len(progress["targets"]) - progress["done"]
+        LOG.warning(
+            "finishing the %d left from an unfinished %s run; use --restart to start over",
+            left,
+            action,
+        )
+        if args.dry_run:
+            print(f"Would {action} the {left} left from an unfinished run")
+            return 0
+
+    targets = progress["targets"]
+    changed = 0
+    for start in range(progress["done"], len(targets), args.chunk_size):
+        chunk = targets[start : start + args.chunk_size]
+        changed += apply(session, chunk)
+        session.commit()
+
+        progress["done"] = start + len(chunk)
+        save_progress(action, progress)
+        LOG.info("%s: %d of %d done", action, progress["done"], len(targets))
+
+    progress_file(action).unlink()
+    return changed
@@ -0,0 +1,251 @@
+"""Measure where a run's time goes, phase by phase, for --profile.
+
+The subcommands mark the phases of their work with phase() or timed(). While profiling, each phase
+adds up the time spent in it, not counting the phases inside it; the SQL queries it ran and how
+long they took; how many rows or records came out of it; and how much memory the process had used
+at most by the time it last finished. When not profiling, marking phases costs next to nothing.
+
+This only imports SQLAlchemy once profiling starts, so that the mastools command stays quick to
+load.
+"""
+
+import cProfile
+import json
+import resource
+import sys
+import threading
+import time
+from contextlib import contextmanager, nullcontext
+
+# The stats of each phase by name while profiling, or None
+PROFILE = None
+
+# Queries and time that don't belong to any phase
+OTHER = "(other)"
+
+# Each thread's stack of [name, start time, time spent in phases inside it]
+STACKS = threading.local()
+LOCK = threading.Lock()
+
+NOT_PROFILING = nullcontext()
+
+
+def new_stats():
+    """Return the stats of a phase that hasn't been seen yet."""
+
+    return {"seconds": 0.0, "sql_seconds": 0.0, "queries": 0, "rows": 0, "peak_rss_kb": 0}
+
+
+def stack():
+    """Return this thread's stack of running phases."""
+
+    try:
+        return STACKS.stack
+    except AttributeError:
+        STACKS.stack = []
+        return STACKS.stack
+
+
+def peak_rss_kb():
+    """Return the most memory the process has used so far, in kB (bytes on macOS)."""
+
+    return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+
+
+def enter(name):
+    """Start timing a phase."""
+
+    stack().append([name, time.perf_counter(), 0.0])
+
+
+def leave(rows):
+    """Stop timing the innermost phase, and add rows to its count."""
+
+    frames = stack()
+    name, start, inside = frames.pop()
+    elapsed = time.perf_counter() - start
+    if frames:
+        frames[-1][2] += elapsed
+
+    with LOCK:
+        stats = PROFILE.setdefault(name, new_stats())
+        stats["seconds"] += elapsed - inside
+        stats["rows"] += rows
+        stats["peak_rss_kb"] = max(stats["peak_rss_kb"], peak_rss_kb())
+
+
+@contextmanager
+def profiled_phase(name, rows):
+    """Time the with block as the named phase."""
+
+    enter(name)
+    try:
+        yield
+    finally:
+        leave(rows)
+
+
+def phase(name, rows=0):
+    """Return a context manager that times its with block as the named phase, if profiling.
+
+    rows is how many rows or records the block handles.
+    """
+
+    if PROFILE is None:
+        return NOT_PROFILING
+    return profiled_phase(name, rows)
+
+
+def profiled_iterator(name, iterable):
+    """Yield the items of the iterable, timing the work of producing each as the named phase."""
+
+    iterator = iter(iterable)
+    try:
+        while True:
+            enter(name)
+            try:
+                item = next(iterator)
+            except BaseException:
+                leave(0)
+                raise
+            leave(1)
+            yield item
+    except StopIteration:
+        return
+    finally:
+        # Let generators clean up as soon as we're done with them, like a plain for loop would.
+        close = getattr(iterator, "close", None)
+        if close is not None:
+            close()
+
+
+def timed(name, iterable):
+    """Return the iterable, with the work of producing its items timed as the named phase.
+
+    That's the time spent getting each item out of the iterable, not the time spent by whatever
+    uses them, so it works for the stages of a pipeline of generators.
+    """
+
+    if PROFILE is None:
+        return iterable
+    return profiled_iterator(name, iterable)
+
+
+def before_cursor_execute(conn, *args):  # pylint: disable=unused-argument
+    """Note when a query started."""
+
+    conn.info.setdefault("mastools_query_start", []).append(time.perf_counter())
+
+
+def after_cursor_execute(conn, *args):  # pylint: disable=unused-argument
+    """Count the query, and its time, against the phase that ran it."""
+
+    elapsed = time.perf_counter() - conn.info["mastools_query_start"].pop()
+    frames = stack()
+    name = frames[-1][0] if frames else OTHER
+    with LOCK:
+        stats = PROFILE.setdefault(name, new_stats())
+        stats["sql_seconds"] += elapsed
+        stats["queries"] += 1
+
+
+def summary(stats, total_seconds):
+    """Return the phases' stats, slowest first, followed by the leftovers and the totals."""
+
+    phases = [
+        dict(phase=name, **values)
+        for name, values in sorted(stats.items(), key=lambda item: -item[1]["seconds"])
+        if name != OTHER
+    ]
+
+    other = dict(phase=OTHER, **stats.get(OTHER, new_stats()))
+    other["seconds"] = total_seconds - sum(values["seconds"] for values in phases)
+    other["peak_rss_kb"] = 0
+    phases.append(other)
+
+    # Rows pass through several phases, so adding them up wouldn't mean anything.
+    total = dict(phase="total", **new_stats())
+    for values in phases:
+        for key in ("sql_seconds", "queries"):
+            total[key] += values[key]
+    total.update(seconds=total_seconds, rows=None, peak_rss_kb=peak_rss_kb())
+    return phases + [total]
+
+
+def render_table(rows):
+    """Yield the lines of a table of the summary rows."""
+
+    yield (
+        f"{'phase':<12} {'seconds':>9} {'%':>5} {'sql s':>9} {'queries':>8} {'rows':>9} "
+        f"{'peak MB':>8}"
+    )
+    total_seconds = rows[-1]["seconds"] or 1
+    for row in rows:
+        yield (
+            f"{row['phase']:<12} {row['seconds']:>9.3f} "
+            f"{100 * row['seconds'] / total_seconds:>5.1f} {row['sql_seconds']:>9.3f} "
+            f"{row['queries']:>8} {'' if row['rows'] is None else row['rows']:>9} "
+            f"{row['peak_rss_kb'] / 1024:>8.1f}"
+        )
+
+
+def report(rows, output_format, output=None):
+    """Write the summary rows as a table or as JSON, to stderr by default."""
+
+    output = output or sys.stderr
+    if output_format == "json":
+        output.write(json.dumps(rows, indent=2) + "\n")
+    else:
+        output.write("\n".join(render_table(rows)) + "\n")
+
+
+def add_arguments(parser):
+    """Add the profiling options to the parser."""
+
+    parser.add_argument(
+        "--profile",
+        help="When done, show how long each phase took, the queries it ran, the rows it handled, "
+        "and the memory used, on stderr as a table or JSON (default: table)",
+        nargs="?",
+        const="table",
+        choices=("table", "json"),
+    )
+    parser.add_argument(
+        "--profile-dump",
+        help="Also write cProfile stats to this file, for pstats or snakeviz",
+        metavar="FILE",
+    )
+
+
+def profiled(func, args):
+    """Run func(args), and then report where the time went as --profile and --profile-dump say."""
+
+    # pylint: disable=import-outside-toplevel,global-statement
+    from sqlalchemy import event
+    from sqlalchemy.engine import Engine
+
+    global PROFILE
+    if PROFILE is not None:
+        # Already profiling, like a subcommand of a profiled run
+        func(args)
+        return
+
+    PROFILE = {}
+    event.listen(Engine, "before_cursor_execute", before_cursor_execute)
+    event.listen(Engine, "after_cursor_execute", after_cursor_execute)
+    profiler = cProfile.Profile() if args.profile_dump else None
+    start = time.perf_counter()
+    try:
+        if profiler is None:
+            func(args)
+        else:
+            profiler.runcall(func, args)
+    finally:
+        total_seconds = time.perf_counter() - start
+        event.remove(Engine, "before_cursor_execute", before_cursor_execute)
+        event.remove(Engine, "after_cursor_execute", after_cursor_execute)
+        stats, PROFILE = PROFILE, None
+
+        if profiler is not None:
+            profiler.dump_stats(args.profile_dump)
+        report(summary(stats, total_seconds), args.profile or "table")
@@ -0,0 +1,99 @@
+"""Delete unconfirmed users and their accounts, like the ones from a flood of junk signups.
+
+Mastodon deletes unconfirmed users itself a while after they sign up. This is for clearing out a
+flood of them right away, the same way: the user and then its account.
+"""
+
+from sqlalchemy import delete, func, or_, select
+
+from mastools.models import session_for, Accounts, Users
+from mastools.scripts import common, moderation
+from mastools.scripts.unconfirmed_users import ACCOUNTS, USERS
+
+
+def setup_command_line(subgroup, parent):
+    """Add the subcommand."""
+
+    this = subgroup.add_parser(
+        "purge-unconfirmed", help=purge_unconfirmed.__doc__, parents=[parent]
+    )
+    this.add_argument(
+        "--since",
+        help="Only delete users created since this timestamp, or this long ago (like 2h)",
+        type=common.parse_since,
+    )
+    this.add_argument(
+        "--before",
+        help="Only delete users created before this timestamp, or this long ago (like 2d)",
+        type=common.parse_since,
+    )
+    this.add_argument(
+        "--email-domain",
+        help="Only delete users with email addresses at this domain. Can be given more than once",
+        action="append",
+        default=[],
+    )
+    moderation.add_arguments(this)
+    this.set_defaults(func=purge_unconfirmed)
+
+
+def purgeable_users(  # pylint: disable=too-many-arguments
+    session, since=None, before=None, email_domains=(), batch_size=common.DEFAULT_BATCH_SIZE
+):
+    """Return the (user id, username, email) of each unconfirmed user matching the filters."""
+
+    statement = (
+        select(USERS.id, ACCOUNTS.username, USERS.email)
+        .join_from(Users.__table__, Accounts.__table__, USERS.account_id == ACCOUNTS.id)
+        .where(USERS.confirmed_at == None)  # pylint: disable=singleton-comparison
+        .order_by(USERS.id)
+    )
+    if since is not None:
+        statement = statement.where(USERS.created_at >= since)
+    if before is not None:
+        statement = statement.where(USERS.created_at < before)
+    if email_domains:
+        email = func.lower(USERS.email)
+        statement = statement.where(
+            or_(
+                *(email.endswith(f"@{domain.lower()}", autoescape=True) for domain in email_domains)
+            )
+        )
+    return list(common.stream(session, statement, batch_size))
+
+
+def purge_users(session, user_ids):
+    """Delete the users that are still unconfirmed, then their accounts, and return how many."""
+
+    # Only delete the accounts of the users that were deleted, in case any confirmed in the meantime.
+    account_ids = session.scalars(
+        delete(Users.__table__)
+        .where(moderation.one_of(session, USERS.id, user_ids))
+        .where(USERS.confirmed_at == None)  # pylint: disable=singleton-comparison
+        .returning(USERS.account_id)
+    ).all()
+    if account_ids:
+        session.execute(
+            delete(Accounts.__table__).where(moderation.one_of(session, ACCOUNTS.id, account_ids))
+        )
+    return len(account_ids)
+
+
+def purge_unconfirmed(args):
+    """Delete unconfirmed users, and their accounts, that signed up when or where you say."""
+
+    session = session_for(**common.get_config())
+
+    def find_targets():
+        if not (args.since or args.before or args.email_domain):
+            raise ValueError("Say which users to purge with --since, --before, or --email-domain")
+        return [
+            (user_id, f"{username} <{email}>")
+            for user_id, username, email in purgeable_users(
+                session, args.since, args.before, args.email_domain, args.batch_size
+            )
+        ]
+
+    count = moderation.moderate(session, "purge-unconfirmed", find_targets, purge_users, args)
+    if not args.dry_run:
+        print(f"Deleted {count} unconfirmed users and their accounts")
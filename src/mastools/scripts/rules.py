@@ -0,0 +1,173 @@
+"""Spot the things spammers like to put in their account info.
+
+Rules live in ~/.mastools/rules.json, which looks like:
+
+    {
+        "url": {"literals": ["http"]},
+        "shortener": {"literals": ["bit.ly", "tinyurl.com"]},
+        "phone": {"patterns": ["\\\\+?\\\\d[\\\\d ().-]{8,}\\\\d"]}
+    }
+
+Literals are matched anywhere in the text, and patterns are regular expressions. Both ignore case.
+
+All the literals are searched for at once, with an Aho-Corasick automaton if pyahocorasick is
+installed (`pip install pyahocorasick`) or a trie folded into a regular expression if it isn't.
+All the patterns are combined into one regular expression. That way checking an account that
+matches nothing costs about the same however many rules there are.
+"""
+
+import json
+import re
+from functools import lru_cache
+
+try:
+    import ahocorasick
+except ImportError:  # pragma: no cover
+    ahocorasick = None
+
+from mastools.scripts import common
+
+RULES_FILE_NAME = "rules.json"
+
+# This is the same as has_url.
+DEFAULT_DEFINITIONS = {"url": {"literals": ["http"]}}
+
+
+def trie_pattern(literals):
+    """Return a regular expression that matches any of the literals.
+
+    Sharing prefixes keeps Python's regex engine from trying every literal at every position.
+    """
+
+    trie = {}
+    for literal in literals:
+        node = trie
+        for char in literal:
+            if "" in node:
+                # A shorter literal is a prefix of this one, so this one can't match anything the
+                # shorter one doesn't.
+                break
+            node = node.setdefault(char, {})
+        else:
+            node.clear()
+            node[""] = True
+
+    def node_pattern(node):
+        if "" in node:
+            return ""
+        branches = [re.escape(char) + node_pattern(child) for char, child in sorted(node.items())]
+        if len(branches) == 1:
+            return branches[0]
+        return "(?:" + "|".join(branches) + ")"
+
+    return node_pattern(trie)
+
+
+def literal_matcher(literals):
+    """Return a function that returns True if a text contains any of the lowercase literals."""
+
+    literals = [literal for literal in literals if literal]
+    if not literals:
+        return lambda text: False
+
+    if ahocorasick is None:
+        return re.compile(trie_pattern(literals)).search
+
+    automaton = ahocorasick.Automaton()
+    for literal in literals:
+        automaton.add_word(literal, literal)
+    automaton.make_automaton()
+    return lambda text: next(automaton.iter(text), None) is not None
+
+
+def pattern_matcher(patterns):
+    """Return a function that returns True if a text matches any of the patterns."""
+
+    if not patterns:
+        return lambda text: False
+
+    return re.compile("|".join(f"(?:{pattern})" for pattern in patterns), re.IGNORECASE).search
+
+
+def account_texts(account):
+    """Return the lowercased texts to check for the account or its cached data."""
+
+    if isinstance(account, dict):
+        note, fields = account["note"], account["fields"]
+    else:
+        note, fields = account.note, account.fields
+
+    return (note or "").lower(), str(fields).lower()
+
+
+class Rules:
+    """A compiled set of spam rules."""
+
+    def __init__(self, definitions):
+        self.definitions = definitions
+        self.fingerprint = common.digest(definitions).hex()
+
+        try:
+            literals = {
+                name: [literal.lower() for literal in definition.get("literals", ())]
+                for name, definition in definitions.items()
+            }
+            patterns = {
+                name: definition.get("patterns", ()) for name, definition in definitions.items()
+            }
+
+            # One matcher per rule, to tell which ones an account matched...
+            self.matchers = {
+                name: (literal_matcher(literals[name]), pattern_matcher(patterns[name]))
+                for name in definitions
+            }
+            # ...and one for all of them together, to tell whether it matched any at all.
+            self.any_literal = literal_matcher(
+                [literal for values in literals.values() for literal in values]
+            )
+            self.any_pattern = pattern_matcher(
+                [pattern for values in patterns.values() for pattern in values]
+            )
+        except (AttributeError, TypeError, re.error) as exc:
+            raise ValueError(f"Invalid spam rules: {exc}") from exc
+
+    @property
+    def is_default(self):
+        """Return True if these are the built-in rules."""
+
+        return self.definitions == DEFAULT_DEFINITIONS
+
+    def search(self, account) -> bool:
+        """Return True if any rule matches the account's note or fields."""
+
+        return any(
+            self.any_literal(text) or self.any_pattern(text) for text in account_texts(account)
+        )
+
+    def matching(self, account):
+        """Return the names of every rule that matches the account's note or fields."""
+
+        texts = account_texts(account)
+        return [
+            name
+            for name, (has_literal, has_pattern) in self.matchers.items()
+            if any(has_literal(text) or has_pattern(text) for text in texts)
+        ]
+
+
+@lru_cache()
+def default_rules():
+    """Return the built-in rules."""
+
+    return Rules(DEFAULT_DEFINITIONS)
+
+
+def load_rules():
+    """Return the rules from the rules file, or the built-in rules if there isn't one."""
+
+    try:
+        definitions = json.loads((common.MASTOOLS_DIR / RULES_FILE_NAME).read_text())
+    except FileNotFoundError:
+        return default_rules()
+
+    return Rules(definitions)
@@ -0,0 +1,144 @@
+"""Warn about sudden bursts of signups, like the ones that come before a flood of junk accounts.
+
+Signups are counted per minute and per hour for each email domain, separately for confirmed and
+unconfirmed users. Each count is compared to the average over the windows just before it, and any
+that jump well above that are reported. All the counting happens in PostgreSQL, so only the few
+windows worth reporting are sent back.
+
+Mastodon doesn't index users.created_at. On big instances, adding an index makes this much faster:
+
+    CREATE INDEX CONCURRENTLY index_users_on_created_at ON users (created_at);
+"""
+
+import logging
+from datetime import datetime, timedelta, timezone
+
+from sqlalchemy import text
+
+from mastools.models import report_session_for
+from mastools.scripts import common
+
+LOG = logging.getLogger(__name__)
+
+# Each window, and how many of them to average for the baseline by default
+WINDOWS = {"minute": 60, "hour": 24}
+
+FLOOD_QUERY = text(
+    """
+WITH counts AS (
+    SELECT
+        date_trunc(:unit, created_at) AS window_start,
+        lower(split_part(email, '@', 2)) AS domain,
+        confirmed_at IS NULL AS unconfirmed,
+        count(*) AS signups
+    FROM users
+    WHERE created_at >= :start
+    GROUP BY 1, 2, 3
+), rated AS (
+    SELECT
+        counts.*,
+        -- Windows without any signups have no row, so divide by how many windows there should be.
+        coalesce(
+            sum(signups) OVER (
+                PARTITION BY domain, unconfirmed
+                ORDER BY window_start
+                RANGE BETWEEN CAST(:baseline_span AS interval) PRECEDING
+                    AND CAST(:step AS interval) PRECEDING
+            ),
+            0
+        )::float / :baseline_windows AS baseline
+    FROM counts
+)
+SELECT window_start, domain, unconfirmed, signups, baseline
+FROM rated
+WHERE window_start >= date_trunc(:unit, CAST(:since AS timestamp))
+    AND signups >= :min_signups
+    AND signups >= :ratio * baseline
+ORDER BY window_start, domain, unconfirmed
+"""
+)
+
+
+def setup_command_line(subgroup, parent):
+    """Add the subcommand."""
+
+    this = subgroup.add_parser(
+        "detect-signup-flood", help=detect_signup_flood.__doc__, parents=[parent]
+    )
+    this.add_argument(
+        "--since",
+        help="Check the windows since this timestamp, or this long ago (default: 1h)",
+        type=common.parse_since,
+    )
+    this.add_argument(
+        "--windows",
+        help="Which windows to count signups in (default: both)",
+        nargs="+",
+        choices=list(WINDOWS),
+        default=list(WINDOWS),
+    )
+    this.add_argument(
+        "--baseline",
+        help="Compare each window to the average of this many windows before it "
+        "(default: 60 minutes or 24 hours)",
+        type=int,
+    )
+    this.add_argument(
+        "--ratio",
+        help="Warn when a window has this many times its baseline (default: 5)",
+        type=float,
+        default=5.0,
+    )
+    this.add_argument(
+        "--min-signups",
+        help="But only when it has at least this many signups (default: 10)",
+        type=int,
+        default=10,
+    )
+    this.set_defaults(func=detect_signup_flood)
+
+
+def signup_floods(  # pylint: disable=too-many-arguments
+    session, unit, since, baseline_windows=None, ratio=5.0, min_signups=10
+):
+    """Yield the (start, domain, unconfirmed, signups, baseline) of each window with a flood.
+
+    unit is "minute" or "hour". Windows from the one containing since onward are checked against
+    the average number of signups in the baseline_windows windows before each of them.
+    """
+
+    baseline_windows = baseline_windows or WINDOWS[unit]
+    step = timedelta(**{f"{unit}s": 1})
+    start = since - step * (baseline_windows + 1)
+
+    yield from session.execute(
+        FLOOD_QUERY,
+        {
+            "unit": unit,
+            "start": start,
+            "since": since,
+            "step": f"1 {unit}",
+            "baseline_span": f"{baseline_windows} {unit}s",
+            "baseline_windows": baseline_windows,
+            "ratio": ratio,
+            "min_signups": min_signups,
+        },
+    )
+
+
+def detect_signup_flood(args):
+    """Warn about bursts of signups, compared to the usual rate for their email domain."""
+
+    session = report_session_for(common.get_config(), *common.get_replica_config())
+    since = args.since or datetime.now(timezone.utc).replace(tzinfo=None) - timedelta(hours=1)
+
+    for unit in args.windows:
+        LOG.debug("counting signups per %s since %s", unit, since)
+        for start, domain, unconfirmed, signups, baseline in signup_floods(
+            session, unit, since, args.baseline, args.ratio, args.min_signups
+        ):
+            status = "unconfirmed" if unconfirmed else "confirmed"
+            print(
+                f"Signup flood: {signups} {status} users from {domain} in the {unit} starting "
+                f"{start}, usually {baseline:.1f}"
+            )
@@ -0,0 +1,107 @@
+"""Suspend lots of local accounts at once, like a wave of spam accounts show-user-changes found.
+
+This sets suspended_at in the database directly, the same as a suspension from the admin UI does,
+but it doesn't run Mastodon's other suspension jobs, like removing the accounts' statuses and media
+or telling other servers.
+"""
+
+from datetime import datetime, timezone
+
+from sqlalchemy import update
+
+from mastools.models import session_for, Accounts
+from mastools.scripts import clusters, common, moderation, user_changes
+from mastools.scripts.user_changes import ACCOUNTS
+
+
+def setup_command_line(subgroup, parent):
+    """Add the subcommand."""
+
+    this = subgroup.add_parser("suspend", help=suspend.__doc__, parents=[parent])
+    this.add_argument("usernames", help="Usernames of local accounts to suspend", nargs="*")
+    this.add_argument(
+        "--flagged",
+        help="Suspend every account that show-user-changes last found matching the spam rules",
+        action="store_true",
+    )
+    this.add_argument(
+        "--cluster",
+        help="Suspend the accounts in this cluster from show-user-changes --cluster. "
+        "Can be given more than once",
+        type=int,
+        action="append",
+        default=[],
+    )
+    moderation.add_arguments(this)
+    this.set_defaults(func=suspend)
+
+
+def chosen_usernames(usernames=(), flagged=False, cluster_ids=()):
+    """Return the sorted usernames that were named, flagged, or in any of the clusters."""
+
+    chosen = set(usernames)
+    if flagged:
+        chosen.update(
+            username
+            for username, _, _ in common.iter_cache(
+                user_changes.CACHE_KEY, user_changes.CACHE_VERSION
+            )
+        )
+    for cluster_id in cluster_ids:
+        chosen.update(clusters.members(cluster_id))
+    return sorted(chosen)
+
+
+def suspendable_accounts(session, usernames, batch_size=common.DEFAULT_BATCH_SIZE):
+    """Return the (id, username) of each unsuspended local account with one of the usernames."""
+
+    accounts = []
+    for start in range(0, len(usernames), batch_size):
+        statement = (
+            user_changes.local_accounts(ACCOUNTS.id, ACCOUNTS.username)
+            .where(ACCOUNTS.suspended_at == None)  # pylint: disable=singleton-comparison
+            .where(
+                moderation.one_of(session, ACCOUNTS.username, usernames[start : start + batch_size])
+            )
+        )
+        accounts.extend(session.execute(statement))
+    return sorted(accounts)
+
+
+def suspend_accounts(session, account_ids, now):
+    """Suspend the accounts that aren't suspended already, and return how many that was."""
+
+    # Bumping updated_at lets show-user-changes notice them without a full scan.
+    statement = (
+        update(Accounts.__table__)
+        .where(moderation.one_of(session, ACCOUNTS.id, account_ids))
+        .where(ACCOUNTS.suspended_at == None)  # pylint: disable=singleton-comparison
+        .values(suspended_at=now, updated_at=now)
+    )
+    return session.execute(statement).rowcount
+
+
+def suspend(args):
+    """Suspend the local accounts named, flagged by show-user-changes, or in a cluster."""
+
+    session = session_for(**common.get_config())
+    now = datetime.now(timezone.utc).replace(tzinfo=None)
+
+    def find_targets():
+        usernames = chosen_usernames(args.usernames, args.flagged, args.cluster)
+        if not usernames:
+            raise ValueError("Say which accounts to suspend: usernames, --flagged, or --cluster")
+        return [
+            (account_id, username)
+            for account_id, username in suspendable_accounts(session, usernames, args.batch_size)
+        ]
+
+    count = moderation.moderate(
+        session,
+        "suspend",
+        find_targets,
+        lambda session, account_ids: suspend_accounts(session, account_ids, now),
+        args,
+    )
+    if not args.dry_run:
+        print(f"Suspended {count} accounts")
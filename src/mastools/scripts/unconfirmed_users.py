@@ -2,11 +2,18 @@
 
 import logging
 
-from mastools.models import session_for, Users
-from mastools.scripts import common
+from sqlalchemy import select
+
+from mastools.models import report_session_for, Accounts, Users
+from mastools.scripts import common, profiling
+from mastools.scripts.common import parse_since
 
 LOG = logging.getLogger(__name__)
 
+# Plain table columns, so that the rows skip the ORM
+ACCOUNTS = Accounts.__table__.c
+USERS = Users.__table__.c
+
 
 def setup_command_line(subgroup, parent):
     """Add the subcommand."""
@@ -14,23 +21,54 @@ def setup_command_line(subgroup, parent):
     this = subgroup.add_parser(
         "show-unconfirmed-users", help=show_unconfirmed_users.__doc__, parents=[parent]
     )
+    this.add_argument(
+        "--since",
+        help="Only show users created since this timestamp, or this long ago (like 2h)",
+        type=parse_since,
+    )
+    this.add_argument("--limit", help="Only show this many of the newest users", type=int)
     this.set_defaults(func=show_unconfirmed_users)
 
 
-def show_unconfirmed_users(args):  # pylint: disable=unused-argument
+def unconfirmed_users(session, since=None, limit=None, batch_size=common.DEFAULT_BATCH_SIZE):
+    """Yield the (email, username, created_at) of each unconfirmed user, oldest first."""
+
+    statement = (
+        select(USERS.id, USERS.email, ACCOUNTS.username, USERS.created_at)
+        .join_from(Users.__table__, Accounts.__table__, USERS.account_id == ACCOUNTS.id)
+        .where(USERS.confirmed_at == None)  # pylint: disable=singleton-comparison
+    )
+
+    if since is not None:
+        statement = statement.where(USERS.created_at >= since)
+
+    if limit is None:
+        statement = statement.order_by(USERS.created_at, USERS.id)
+    else:
+        # Pick the newest users, but still show them oldest first like everything else.
+        newest = (
+            statement.order_by(USERS.created_at.desc(), USERS.id.desc()).limit(limit).subquery()
+        )
+        statement = select(newest.c.email, newest.c.username, newest.c.created_at).order_by(
+            newest.c.created_at, newest.c.id
+        )
+
+    for user in common.stream(session, statement, batch_size):
+        yield user.email, user.username, user.created_at
+
+
+def show_unconfirmed_users(args):
     """Show users who haven't confirmed their email yet."""
 
-    session = session_for(**common.get_config())
+    session = report_session_for(common.get_config(), *common.get_replica_config())
 
     LOG.debug("fetching unconfirmed accounts")
 
-    query = (
-        session.query(Users)
-        .filter(Users.confirmed_at == None)  # pylint: disable=singleton-comparison
-        .order_by(Users.created_at)
-    )
-
-    for user in query:
-        print(f"{user.account.username} <{user.email}> was created at {user.created_at}")
+    count = 0
+    for count, (email, username, created_at) in enumerate(
+        unconfirmed_users(session, args.since, args.limit, args.batch_size), start=1
+    ):
+        with profiling.phase("render", rows=1):
+            print(f"{username} <{email}> was created at {created_at}")
 
-    LOG.info("found %d unconfirmed accounts", query.count())
+    LOG.info("found %d unconfirmed accounts", count)
@@ -10,14 +10,37 @@ spammers before they have a chance to post!
 """
 
 import argparse
+import csv
+import heapq
+import json
+import sys
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime
+from functools import partial
 from operator import itemgetter
 
-from mastools.models import session_for, Accounts
-from mastools.scripts import common
+from sqlalchemy import Text, cast, func, or_, select, text
+from sqlalchemy.orm import Session
+
+from mastools.models import report_session_for, Accounts
+from mastools.scripts import clusters, common, history, profiling, rules as spam_rules
 
 CACHE_KEY = "users"
 CACHE_VERSION = 1
 
+WATERMARK_KEY = "users_watermark"
+WATERMARK_VERSION = 1
+
+# Queries select plain table columns, which skips the ORM: rows come back as named tuples, without
+# entities, an identity map, or attribute instrumentation. The columns are still the models'.
+ACCOUNTS = Accounts.__table__.c
+
+NEW = "new"
+CHANGED = "changed"
+DELETED = "deleted"
+
+CSV_COLUMNS = ("kind", "username", "matched", "cluster", "note", "fields", "old_note", "old_fields")
+
 
 def has_url(account: Accounts) -> bool:
     """Return True if the account's note or fields seem to contain a URL."""
@@ -29,23 +52,472 @@ def has_url(account: Accounts) -> bool:
     return False
 
 
-def users_with_urls(session):
-    """Return a dictionary of usernames to their account info when they mention URLs."""
+def url_clause():
+    """Return a PostgreSQL filter that selects exactly the accounts has_url would.
+
+    `str(account.fields)` and `fields::text` quote things differently, but neither one can make
+    "http" appear or disappear, so matching the text of each gives the same answer.
+    """
+
+    return or_(ACCOUNTS.note.ilike("%http%"), cast(ACCOUNTS.fields, Text).ilike("%http%"))
+
+
+def account_data(account):
+    """Return the cached information about an account."""
+
+    return {"fields": account.fields, "note": account.note}
+
+
+def index_entry(account):
+    """Return the (id, creation time) pair that locates a cached account in the database."""
 
-    query = (
-        session.query(Accounts)
-        .filter(Accounts.domain == None)  # pylint: disable=singleton-comparison
-        .filter(Accounts.suspended_at == None)  # pylint: disable=singleton-comparison
-        .order_by(Accounts.created_at)
+    return [account.id, account.created_at.isoformat()]
+
+
+def local_accounts(*columns):
+    """Return a select() of the columns of every local account."""
+
+    return select(*columns).where(ACCOUNTS.domain == None)  # pylint: disable=singleton-comparison
+
+
+def flagged_accounts(session, batch_size, rules, *criteria, order_by=None):
+    """Yield every local, unsuspended account matching the criteria and the rules.
+
+    They come oldest first, or in the order given by order_by.
+    """
+
+    statement = (
+        local_accounts(
+            ACCOUNTS.id, ACCOUNTS.username, ACCOUNTS.created_at, ACCOUNTS.fields, ACCOUNTS.note
+        )
+        .where(ACCOUNTS.suspended_at == None)  # pylint: disable=singleton-comparison
+        .where(*criteria)
+        .order_by(*(order_by or (ACCOUNTS.created_at, ACCOUNTS.id)))
+    )
+
+    # Most accounts don't mention URLs, so let PostgreSQL throw them away instead of sending them
+    # all over to be checked here. Other databases, and custom rules, get the slower Python filter.
+    if rules.is_default and session.get_bind().dialect.name == "postgresql":
+        return iter(common.stream(session, statement.where(url_clause()), batch_size))
+
+    return profiling.timed(
+        "match",
+        (
+            account
+            for account in common.stream(session, statement, batch_size)
+            if rules.search(account)
+        ),
     )
 
+
+def shard_bounds(session, shards):
+    """Return the first id of each of up to `shards` ranges with about as many local accounts."""
+
+    numbered = local_accounts(
+        ACCOUNTS.id, func.ntile(shards).over(order_by=ACCOUNTS.id).label("shard")
+    ).subquery()
+    first_id = func.min(numbered.c.id)
+    return list(session.scalars(select(first_id).group_by(numbered.c.shard).order_by(first_id)))
+
+
+def export_snapshot(session):
+    """Return an id other connections can use to see exactly what this session sees, if possible."""
+
+    if session.get_bind().dialect.name != "postgresql":
+        return None
+    return session.execute(text("SELECT pg_export_snapshot()")).scalar()
+
+
+def scan_shard(engine, snapshot, id_range, batch_size, rules):
+    """Return a list of the flagged accounts with ids in [first, next), oldest first.
+
+    This runs in a worker thread, on a connection of its own from the engine's pool.
+    """
+
+    first_id, next_id = id_range
+    criteria = [ACCOUNTS.id >= first_id]
+    if next_id is not None:
+        criteria.append(ACCOUNTS.id < next_id)
+
+    with Session(bind=engine) as session:
+        if snapshot is not None:
+            # Look at the same snapshot of the database as every other shard.
+            session.execute(text("SET TRANSACTION ISOLATION LEVEL REPEATABLE READ"))
+            session.execute(text("SET TRANSACTION SNAPSHOT :snapshot"), {"snapshot": snapshot})
+        return list(flagged_accounts(session, batch_size, rules, *criteria))
+
+
+def sharded_accounts(session, batch_size, rules, shards):
+    """Yield the same accounts as flagged_accounts, but scan `shards` id ranges of them at once."""
+
+    bounds = shard_bounds(session, shards)
+    id_ranges = list(zip(bounds, bounds[1:] + [None]))
+    if not id_ranges:
+        return iter(())
+
+    snapshot = export_snapshot(session)
+    engine = session.get_bind()
+    with ThreadPoolExecutor(max_workers=len(id_ranges)) as executor:
+        results = list(
+            executor.map(
+                lambda id_range: scan_shard(engine, snapshot, id_range, batch_size, rules),
+                id_ranges,
+            )
+        )
+
+    # Each shard is in scan order already, so merging them puts them all in scan order.
+    return heapq.merge(*results, key=lambda account: (account.created_at, account.id))
+
+
+def url_accounts(session, batch_size=common.DEFAULT_BATCH_SIZE, rules=None, shards=1):
+    """Yield every local, unsuspended account that matches the spam rules, oldest first.
+
+    The default rules look for accounts that mention URLs. If shards is more than 1, the accounts
+    are split into that many id ranges, and each is scanned at the same time on its own pooled
+    connection.
+    """
+
+    rules = rules or spam_rules.default_rules()
+    if shards > 1:
+        return sharded_accounts(session, batch_size, rules, shards)
+    return flagged_accounts(session, batch_size, rules)
+
+
+def users_with_urls(session, batch_size=common.DEFAULT_BATCH_SIZE, rules=None, shards=1):
+    """Return a dictionary of usernames to their account info when they match the spam rules."""
+
     return {
-        account.username: {"fields": account.fields, "note": account.note}
-        for account in query
-        if has_url(account)
+        account.username: account_data(account)
+        for account in url_accounts(session, batch_size, rules, shards)
     }
 
 
+def current_watermark(session):
+    """Return the newest local account update time and the ids of the accounts updated then."""
+
+    latest = session.scalar(local_accounts(func.max(ACCOUNTS.updated_at)))
+    if latest is None:
+        return {}
+
+    seen_ids = session.scalars(local_accounts(ACCOUNTS.id).where(ACCOUNTS.updated_at == latest))
+    return {"updated_at": latest.isoformat(), "seen_ids": sorted(seen_ids)}
+
+
+def full_scan(session, batch_size=common.DEFAULT_BATCH_SIZE, rules=None, shards=1):
+    """Return the flagged users and the new watermark from a scan of every local account."""
+
+    # Take the watermark before scanning. Anything that changes in between will be picked up by the
+    # scan *and* looked at again next time, which is harmless. The other way around could miss it.
+    watermark = current_watermark(session)
+
+    users = {}
+    index = {}
+    for account in url_accounts(session, batch_size, rules, shards):
+        users[account.username] = account_data(account)
+        index[account.username] = index_entry(account)
+
+    return users, dict(watermark, accounts=index)
+
+
+def account_changes(*criteria):
+    """Return a select() of everything needed to reevaluate the local accounts matching criteria."""
+
+    return local_accounts(
+        ACCOUNTS.id,
+        ACCOUNTS.username,
+        ACCOUNTS.created_at,
+        ACCOUNTS.updated_at,
+        ACCOUNTS.suspended_at,
+        ACCOUNTS.fields,
+        ACCOUNTS.note,
+    ).where(*criteria)
+
+
+def apply_account_change(account, users, index, rules):
+    """Add the changed account to the flagged users and their index, or take it out of them."""
+
+    if account.suspended_at is None and rules.search(account):
+        users[account.username] = account_data(account)
+        index[account.username] = index_entry(account)
+    else:
+        users.pop(account.username, None)
+        index.pop(account.username, None)
+
+
+def in_scan_order(users, index):
+    """Return the users and index in the same order that a full scan would have returned them."""
+
+    order = sorted(
+        index, key=lambda username: (datetime.fromisoformat(index[username][1]), index[username][0])
+    )
+    return (
+        {username: users[username] for username in order},
+        {username: index[username] for username in order},
+    )
+
+
+def incremental_scan(
+    session, old_digests, watermark, batch_size=common.DEFAULT_BATCH_SIZE, rules=None
+):
+    """Return the flagged users and the new watermark from the accounts changed since the last run.
+
+    The result is the same as `full_scan`'s would be, but only the changed rows and the ids of the
+    previously flagged accounts are read from the database. Users whose rows haven't changed are
+    returned as common.UNCHANGED.
+    """
+
+    rules = rules or spam_rules.default_rules()
+    users = dict.fromkeys(old_digests, common.UNCHANGED)
+    index = dict(watermark["accounts"])
+
+    since = datetime.fromisoformat(watermark["updated_at"])
+    seen_ids = set(watermark["seen_ids"])
+    latest, latest_ids = since, set(seen_ids)
+
+    statement = account_changes(ACCOUNTS.updated_at >= since).order_by(
+        ACCOUNTS.updated_at, ACCOUNTS.id
+    )
+
+    for account in common.stream(session, statement, batch_size):
+        if account.updated_at == since and account.id in seen_ids:
+            continue
+
+        if account.updated_at > latest:
+            latest, latest_ids = account.updated_at, set()
+        latest_ids.add(account.id)
+
+        apply_account_change(account, users, index, rules)
+
+    # Deleted accounts don't leave a changed row behind, so make sure every flagged account that's
+    # left is still around and unsuspended. This only reads ids, so it's cheap.
+    statement = (
+        local_accounts(ACCOUNTS.id)
+        .where(ACCOUNTS.id.in_([entry[0] for entry in index.values()]))
+        .where(ACCOUNTS.suspended_at == None)  # pylint: disable=singleton-comparison
+    )
+    live_ids = {row.id for row in common.stream(session, statement, batch_size)}
+    for username, (account_id, _) in list(index.items()):
+        if account_id not in live_ids:
+            del users[username]
+            del index[username]
+
+    users, index = in_scan_order(users, index)
+    new_watermark = {
+        "updated_at": latest.isoformat(),
+        "seen_ids": sorted(latest_ids),
+        "accounts": index,
+    }
+    return users, new_watermark
+
+
+def targeted_scan(
+    session, old_digests, watermark, account_ids, batch_size=common.DEFAULT_BATCH_SIZE, rules=None
+):
+    """Return the flagged users and the new watermark after looking at only the given accounts.
+
+    This is for when something else, like a database trigger, says which accounts changed. The
+    watermark's time is left alone, so a later incremental scan will still look at everything that
+    changed since then, but it won't report these accounts again.
+    """
+
+    rules = rules or spam_rules.default_rules()
+    users = dict.fromkeys(old_digests, common.UNCHANGED)
+    index = dict(watermark["accounts"])
+
+    found_ids = set()
+    statement = account_changes(ACCOUNTS.id.in_(account_ids))
+    for account in common.stream(session, statement, batch_size):
+        found_ids.add(account.id)
+        apply_account_change(account, users, index, rules)
+
+    # Any of the accounts that weren't found must have been deleted.
+    usernames = {entry[0]: username for username, entry in index.items()}
+    for account_id in set(account_ids) - found_ids:
+        username = usernames.get(account_id)
+        if username is not None:
+            del users[username]
+            del index[username]
+
+    users, index = in_scan_order(users, index)
+    return users, dict(watermark, accounts=index)
+
+
+def diff_users(old_digests, new_users, load_old):
+    """Yield a (kind, username, old data, new data) tuple for each change between the two sets.
+
+    Only the digests of the old users are needed to spot changes. load_old(username) is called to
+    fetch the old data for the few users that have changed or gone away. This consumes old_digests.
+    """
+
+    for username, new_data in new_users.items():
+        if new_data is common.UNCHANGED:
+            del old_digests[username]
+            continue
+
+        try:
+            old_digest = old_digests.pop(username)
+        except KeyError:
+            # If the username isn't in the old data, then they're new. Report than and move on to
+            # the next account.
+            yield NEW, username, None, new_data
+            continue
+
+        if old_digest != common.digest(new_data):
+            # Something's changed since the last time we saw this user. Report that.
+            yield CHANGED, username, load_old(username), new_data
+
+    # Report any leftover old accounts that aren't in the new accounts. They were probably
+    # suspended.
+    for username in old_digests:
+        yield DELETED, username, load_old(username), None
+
+
+def username_order(session):
+    """Return the ORDER BY clause that sorts usernames by code point, the way Python does."""
+
+    # PostgreSQL otherwise sorts by the database's collation, which puts "B" between "a" and "c".
+    if session.get_bind().dialect.name == "postgresql":
+        return (ACCOUNTS.username.collate("C"),)
+    return (ACCOUNTS.username,)
+
+
+def merge_users(old_entries, new_users):
+    """Yield a (kind, username, old data, new data) tuple for each change between two user streams.
+
+    old_entries yields (username, digest, JSON text) like common.iter_cache does, and new_users
+    yields (username, data). Both must be sorted by username. They're walked side by side like a
+    merge join, one user at a time, so this uses the same memory however many users there are.
+    """
+
+    old_entries = iter(old_entries)
+    old = next(old_entries, None)
+
+    for username, new_data in new_users:
+        # Any old users that sort before this one aren't in the new set.
+        while old is not None and old[0] < username:
+            yield DELETED, old[0], json.loads(old[2]), None
+            old = next(old_entries, None)
+
+        if old is not None and old[0] == username:
+            if old[1] != common.digest(new_data):
+                yield CHANGED, username, json.loads(old[2]), new_data
+            old = next(old_entries, None)
+        else:
+            yield NEW, username, None, new_data
+
+    while old is not None:
+        yield DELETED, old[0], json.loads(old[2]), None
+        old = next(old_entries, None)
+
+
+def streamed_full_scan(session, batch_size, rules):
+    """Yield the changes found by a scan of every local account as it goes, in username order.
+
+    The new users are written to the next cache as they're read, and only the small index of where
+    each one is in the database is kept in memory. The cache and then the watermark are saved after
+    the last change has been yielded.
+    """
+
+    with profiling.phase("scan"):
+        watermark = current_watermark(session)
+    index = {}
+
+    with common.cache_writer(CACHE_KEY, CACHE_VERSION) as write:
+
+        def new_users():
+            accounts = flagged_accounts(
+                session, batch_size, rules, order_by=username_order(session)
+            )
+            for account in accounts:
+                data = account_data(account)
+                write(account.username, data)
+                index[account.username] = index_entry(account)
+                yield account.username, data
+
+        # Writing the new cache happens as the new users are read.
+        old_entries = profiling.timed("cache", common.iter_cache(CACHE_KEY, CACHE_VERSION))
+        yield from merge_users(old_entries, profiling.timed("cache", new_users()))
+
+    _, index = in_scan_order(index, index)
+    common.save_cache(
+        WATERMARK_KEY, WATERMARK_VERSION, dict(watermark, accounts=index, rules=rules.fingerprint)
+    )
+
+
+def iter_user_changes(  # pylint: disable=too-many-arguments
+    session,
+    full=False,
+    batch_size=common.DEFAULT_BATCH_SIZE,
+    rules=None,
+    account_ids=None,
+    shards=1,
+):
+    """Yield the changes to users with URLs since the last run by username, and update the cache.
+
+    The cache is updated once the last change has been yielded. If account_ids is given, only look
+    at those accounts. If it comes to scanning every account, split them into `shards` ranges to
+    scan at once.
+    """
+
+    rules = rules or spam_rules.default_rules()
+    watermark = common.load_cache(WATERMARK_KEY, WATERMARK_VERSION)
+
+    # Only trust the watermark if it describes the same set of users as the cache, found with the
+    # same rules. If either file went missing or got out of step with the other, or the rules
+    # changed, start over from scratch.
+    rescan = full or not watermark or watermark.get("rules") != rules.fingerprint
+    if not rescan:
+        old_digests = common.load_cache_digests(CACHE_KEY, CACHE_VERSION)
+        rescan = set(watermark["accounts"]) != set(old_digests)
+
+    if rescan and shards <= 1:
+        yield from streamed_full_scan(session, batch_size, rules)
+        return
+
+    if rescan:
+        old_digests = common.load_cache_digests(CACHE_KEY, CACHE_VERSION)
+
+    with profiling.phase("scan"):
+        if rescan:
+            new_users, new_watermark = full_scan(session, batch_size, rules, shards)
+        elif account_ids is not None:
+            new_users, new_watermark = targeted_scan(
+                session, old_digests, watermark, account_ids, batch_size, rules
+            )
+        else:
+            new_users, new_watermark = incremental_scan(
+                session, old_digests, watermark, batch_size, rules
+            )
+    new_watermark["rules"] = rules.fingerprint
+
+    load_old = partial(common.lookup_cache, CACHE_KEY, CACHE_VERSION)
+    changes = sorted(diff_users(dict(old_digests), new_users, load_old), key=itemgetter(1))
+
+    # Save the users first. If we die before saving the watermark, the next run will look at a few
+    # accounts again (or start over), but it won't skip anything.
+    common.save_cache(CACHE_KEY, CACHE_VERSION, new_users)
+    common.save_cache(WATERMARK_KEY, WATERMARK_VERSION, new_watermark)
+
+    yield from changes
+
+
+def find_user_changes(  # pylint: disable=too-many-arguments
+    session,
+    full=False,
+    batch_size=common.DEFAULT_BATCH_SIZE,
+    rules=None,
+    account_ids=None,
+    shards=1,
+):
+    """Return a list of the changes to users with URLs since the last run, and update the cache.
+
+    If account_ids is given, only look at those accounts. If it comes to scanning every account,
+    split them into `shards` ranges to scan at once.
+    """
+
+    return list(iter_user_changes(session, full, batch_size, rules, account_ids, shards))
+
+
 def render_field_changes(old_fields, new_fields):
     """Pretty-print changes in a user's bio fields."""
 
@@ -94,10 +566,18 @@ def render_note_changes(old_note, new_note):
         yield f"  + {new_note!r}"
 
 
-def render_new_user(username, data):
+def render_matched_rules(matched):
+    """Pretty-print the names of the spam rules that a user matched."""
+
+    if matched:
+        yield f" matched: {', '.join(matched)}"
+
+
+def render_new_user(username, data, matched=()):
     """Pretty-print information about a new user."""
 
     yield f"New user: {username}"
+    yield from render_matched_rules(matched)
 
     yield " fields:"
     yield from render_field_changes({}, data["fields"])
@@ -106,10 +586,11 @@ def render_new_user(username, data):
     yield from render_note_changes("", data["note"])
 
 
-def render_changed_user(username, old_data, new_data):
+def render_changed_user(username, old_data, new_data, matched=()):
     """Pretty-print information about a changed user."""
 
     yield f"Changed user: {username}"
+    yield from render_matched_rules(matched)
 
     yield " fields:"
     yield from render_field_changes(old_data["fields"], new_data["fields"])
@@ -130,6 +611,20 @@ def render_deleted_user(username, data):
     yield from render_note_changes(data["note"], "")
 
 
+def render_cluster(cluster, changes, rules=None):
+    """Pretty-print a group of new users that look alike, with the first of them as an example."""
+
+    usernames = [username for _, username, _, _ in changes]
+    noun = "account" if len(usernames) == 1 else "accounts"
+    yield f"{len(usernames)} new {noun} matching cluster {cluster.id} ({cluster.size} in all)"
+    if cluster.representative not in usernames:
+        yield f" first seen: {cluster.representative}"
+    yield f" accounts: {', '.join(usernames)}"
+
+    _, username, _, data = changes[0]
+    yield from render_new_user(username, data, rules.matching(data) if rules else ())
+
+
 def show_output(gen):
     """Print each line of output to stdout, then a blank line.
 
@@ -144,12 +639,144 @@ def show_output(gen):
     print()
 
 
+def render_change(kind, username, old_data, new_data, rules=None):
+    """Pretty-print a change found by diff_users, with the spam rules it matches."""
+
+    matched = rules.matching(new_data) if rules and new_data else ()
+    if kind == NEW:
+        return render_new_user(username, new_data, matched)
+    if kind == CHANGED:
+        return render_changed_user(username, old_data, new_data, matched)
+    return render_deleted_user(username, old_data)
+
+
+def change_record(kind, username, old_data, new_data, rules=None, cluster=None):
+    """Return a dict describing a change, for the machine-readable formats."""
+
+    return {
+        "kind": kind,
+        "username": username,
+        "matched": rules.matching(new_data) if rules and new_data else [],
+        "cluster": cluster.id if cluster else None,
+        "old": old_data,
+        "new": new_data,
+    }
+
+
+def text_emitter(output, rules=None):
+    """Return an emitter that writes the same report that people read."""
+
+    def emit(cluster, changes):
+        if cluster is None or cluster.size == 1:
+            blocks = [render_change(*change, rules=rules) for change in changes]
+        else:
+            blocks = [render_cluster(cluster, changes, rules)]
+
+        # One write per block instead of one print per line
+        for block in blocks:
+            output.write("\n".join(block) + "\n\n")
+
+    return emit
+
+
+def ndjson_emitter(output, rules=None):
+    """Return an emitter that writes one line of JSON per account."""
+
+    def emit(cluster, changes):
+        for change in changes:
+            output.write(json.dumps(change_record(*change, rules=rules, cluster=cluster)) + "\n")
+
+    return emit
+
+
+def csv_emitter(output, rules=None):
+    """Return an emitter that writes one CSV row per account, with a header before the first."""
+
+    writer = csv.writer(output)
+    header = [CSV_COLUMNS]
+
+    def emit(cluster, changes):
+        # Only write the header if there's something to put under it, so that a quiet run from cron
+        # still prints nothing at all.
+        writer.writerows(header)
+        header.clear()
+        for change in changes:
+            record = change_record(*change, rules=rules, cluster=cluster)
+            old_data = record["old"] or {}
+            new_data = record["new"] or {}
+            writer.writerow(
+                (
+                    record["kind"],
+                    record["username"],
+                    " ".join(record["matched"]),
+                    "" if record["cluster"] is None else record["cluster"],
+                    new_data.get("note", ""),
+                    json.dumps(new_data["fields"]) if new_data else "",
+                    old_data.get("note", ""),
+                    json.dumps(old_data["fields"]) if old_data else "",
+                )
+            )
+
+    return emit
+
+
+EMITTERS = {"text": text_emitter, "ndjson": ndjson_emitter, "csv": csv_emitter}
+
+
+def emit_changes(changes, emit, cluster=False):
+    """Pass the (kind, username, old data, new data) changes to the emitter, clustered or not."""
+
+    if cluster:
+        groups = clusters.clustered(changes)
+    else:
+        groups = ((None, [change]) for change in changes)
+
+    for group_cluster, group in profiling.timed("cluster", groups) if cluster else groups:
+        with profiling.phase("render", rows=len(group)):
+            emit(group_cluster, group)
+
+
+def add_format_argument(parser):
+    """Add the --format option to the parser."""
+
+    parser.add_argument(
+        "--format",
+        help="Write the report as text for people, or NDJSON or CSV for programs (default: text)",
+        choices=list(EMITTERS),
+        default="text",
+    )
+
+
+def add_arguments(parser):
+    """Add this command's options to the parser."""
+
+    parser.add_argument(
+        "--full",
+        help="Scan every account instead of only the ones changed since the last run",
+        action="store_true",
+    )
+    parser.add_argument(
+        "--shards",
+        help="Scan every account in this many parts at once, each on its own database connection. "
+        "Keep it within the pool_size config setting (default: 1)",
+        type=int,
+        default=1,
+    )
+    parser.add_argument(
+        "--cluster",
+        help="Report new accounts that look alike together, as one cluster",
+        action="store_true",
+    )
+    add_format_argument(parser)
+
+
 def setup_command_line(subgroup, parent):
     """Add the subcommand."""
 
     this = subgroup.add_parser(
         "show-user-changes", help=show_user_changes.__doc__, parents=[parent]
     )
+    add_arguments(this)
     this.set_defaults(func=show_user_changes)
 
 
@@ -157,34 +784,21 @@ def handle_command_line():
     """Backward-compatible command line setup."""
 
     parser = argparse.ArgumentParser(description=show_user_changes.__doc__)
+    add_arguments(parser)
+    common.add_batch_size_argument(parser)
     args = parser.parse_args()
     show_user_changes(args)
 
 
-def show_user_changes(args):  # pylint: disable=unused-argument
+def show_user_changes(args):
     """Fetch all current users with URLs in their account info and show any changes."""
 
-    session = session_for(**common.get_config())
+    session = report_session_for(common.get_config(), *common.get_replica_config())
+    rules = spam_rules.load_rules()
 
-    old_users = common.load_cache(CACHE_KEY, CACHE_VERSION)
-    new_users = users_with_urls(session)
-
-    for username, new_data in new_users.items():
-        try:
-            old_data = old_users.pop(username)
-        except KeyError:
-            # If the username isn't in the old data, then they're new. Report than and move on to
-            # the next account.
-            show_output(render_new_user(username, new_data))
-            continue
-
-        if old_data != new_data:
-            # Something's changed since the last time we saw this user. Report that.
-            show_output(render_changed_user(username, old_data, new_data))
-
-    # Report any leftover old accounts that aren't in the new accounts. They were probably
-    # suspended.
-    for username, old_data in old_users.items():
-        show_output(render_deleted_user(username, old_data))
-
-    common.save_cache(CACHE_KEY, CACHE_VERSION, new_users)
+    changes = iter_user_changes(
+        session, full=args.full, batch_size=args.batch_size, rules=rules, shards=args.shards
+    )
+    # Whatever the other phases don't account for is the work of comparing to the last run.
+    changes = profiling.timed("history", history.recorded(profiling.timed("diff", changes)))
+    emit_changes(changes, EMITTERS[args.format](sys.stdout, rules), cluster=args.cluster)
@@ -0,0 +1,182 @@
+"""Watch for account changes as they happen instead of polling for them.
+
+A trigger on the accounts table sends a notification with the account's id whenever a local account
+is created, deleted, suspended, or has its note or fields changed. This listens for those, waits
+for a burst of them to die down, and then checks just those accounts the same way
+show-user-changes does. It shares show-user-changes's cache, so the two can be used together.
+"""
+
+import logging
+import select
+import sys
+import time
+
+from sqlalchemy import text
+
+from mastools.models import session_for
+from mastools.scripts import common, history, rules as spam_rules, user_changes
+
+LOG = logging.getLogger(__name__)
+
+CHANNEL = "mastools_accounts"
+
+INSTALL_TRIGGER = f"""
+CREATE OR REPLACE FUNCTION mastools_notify_account_change() RETURNS trigger AS $$
+BEGIN
+    IF TG_OP = 'DELETE' THEN
+        IF OLD.domain IS NULL THEN
+            PERFORM pg_notify('{CHANNEL}', OLD.id::text);
+        END IF;
+        RETURN OLD;
+    END IF;
+
+    IF NEW.domain IS NULL AND (
+        TG_OP = 'INSERT'
+        OR NEW.note IS DISTINCT FROM OLD.note
+        OR NEW.fields IS DISTINCT FROM OLD.fields
+        OR NEW.suspended_at IS DISTINCT FROM OLD.suspended_at
+    ) THEN
+        PERFORM pg_notify('{CHANNEL}', NEW.id::text);
+    END IF;
+    RETURN NEW;
+END;
+$$ LANGUAGE plpgsql;
+
+DROP TRIGGER IF EXISTS mastools_notify_account_change ON accounts;
+CREATE TRIGGER mastools_notify_account_change
+    AFTER INSERT OR DELETE OR UPDATE OF note, fields, suspended_at ON accounts
+    FOR EACH ROW EXECUTE FUNCTION mastools_notify_account_change();
+"""
+
+UNINSTALL_TRIGGER = """
+DROP TRIGGER IF EXISTS mastools_notify_account_change ON accounts;
+DROP FUNCTION IF EXISTS mastools_notify_account_change();
+"""
+
+
+def setup_command_line(subgroup, parent):
+    """Add the subcommand."""
+
+    this = subgroup.add_parser("watch", help=watch.__doc__, parents=[parent])
+    this.add_argument(
+        "--install-trigger",
+        help="Install the trigger on the accounts table that this listens to, then start watching",
+        action="store_true",
+    )
+    this.add_argument(
+        "--uninstall-trigger", help="Remove the trigger, then exit", action="store_true"
+    )
+    this.add_argument(
+        "--debounce",
+        help="Wait until there have been no changes for this many seconds (default: 2)",
+        type=float,
+        default=2.0,
+    )
+    this.add_argument(
+        "--max-delay",
+        help="But don't wait more than this many seconds after the first change (default: 30)",
+        type=float,
+        default=30.0,
+    )
+    user_changes.add_format_argument(this)
+    this.set_defaults(func=watch)
+
+
+def listen(session):
+    """Return a raw connection, of its own, that's listening for account changes."""
+
+    # LISTEN only works outside of a transaction, and this connection will sit waiting for as long
+    # as we run, so don't borrow one from the pool that the queries use.
+    pooled = session.get_bind().raw_connection()
+    connection = pooled.driver_connection
+    pooled.detach()
+    connection.autocommit = True
+    with connection.cursor() as cursor:
+        cursor.execute(f"LISTEN {CHANNEL}")
+    return connection
+
+
+def collect_account_ids(connection, debounce, max_delay):
+    """Wait for account changes, and return the ids of the accounts in the next burst of them.
+
+    After the first notification arrives, keep collecting them until none have arrived for debounce
+    seconds, or until max_delay seconds have passed, whichever comes first. That way a flurry of
+    edits is handled with one query.
+    """
+
+    account_ids = set()
+    deadline = None
+
+    while True:
+        if deadline is None:
+            timeout = None
+        else:
+            timeout = min(debounce, deadline - time.monotonic())
+            if timeout <= 0:
+                return account_ids
+
+        readable, _, _ = select.select([connection], [], [], timeout)
+        if not readable:
+            if account_ids:
+                return account_ids
+            continue
+
+        connection.poll()
+        while connection.notifies:
+            notification = connection.notifies.pop(0)
+            try:
+                account_ids.add(int(notification.payload))
+            except ValueError:
+                LOG.warning("ignoring unexpected notification %r", notification.payload)
+
+        if account_ids and deadline is None:
+            deadline = time.monotonic() + max_delay
+
+
+def show_changes(changes, emit):
+    """Show the changes right away, even if stdout isn't a terminal."""
+
+    user_changes.emit_changes(history.recorded(changes), emit)
+    sys.stdout.flush()
+
+
+def watch(args):
+    """Watch for new, changed, or deleted accounts that mention URLs, and show them right away."""
+
+    session = session_for(**common.get_config())
+
+    if args.uninstall_trigger:
+        session.execute(text(UNINSTALL_TRIGGER))
+        session.commit()
+        return
+
+    if args.install_trigger:
+        session.execute(text(INSTALL_TRIGGER))
+        session.commit()
+
+    rules = spam_rules.load_rules()
+    emit = user_changes.EMITTERS[args.format](sys.stdout, rules)
+    connection = listen(session)
+
+    # Start listening before catching up on anything that changed while we weren't, so that nothing
+    # slips through the gap in between.
+    LOG.info("catching up on changes since the last run")
+    show_changes(
+        user_changes.find_user_changes(session, batch_size=args.batch_size, rules=rules), emit
+    )
+    session.rollback()
+
+    try:
+        while True:
+            account_ids = collect_account_ids(connection, args.debounce, args.max_delay)
+            LOG.info("checking %d changed accounts", len(account_ids))
+            changes = user_changes.find_user_changes(
+                session, batch_size=args.batch_size, rules=rules, account_ids=sorted(account_ids)
+            )
+            # Don't sit idle in a transaction while waiting for the next batch.
+            session.rollback()
+            show_changes(changes, emit)
+    except KeyboardInterrupt:
+        pass
+    finally:
+        connection.close()
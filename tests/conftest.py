@@ -0,0 +1,70 @@
+"""Fixtures shared by all the tests."""
+
+import os
+
+import pytest
+from sqlalchemy import create_engine
+from sqlalchemy.engine import make_url
+from sqlalchemy.orm import sessionmaker
+
+from mastools.models.base import Base
+from mastools.scripts import common
+
+
+@pytest.fixture
+def session():
+    """Return a session on an empty in-memory database with the Mastodon tables."""
+
+    engine = create_engine("sqlite://")
+    Base.metadata.create_all(engine)
+    session = sessionmaker(bind=engine)()
+    yield session
+    session.close()
+
+
+@pytest.fixture
+def mastools_dir(tmp_path, monkeypatch):
+    """Keep the caches in a temporary directory."""
+
+    monkeypatch.setattr(common, "MASTOOLS_DIR", tmp_path)
+    return tmp_path
+
+
+@pytest.fixture
+def pg_session():
+    """Return a session on a PostgreSQL database with empty Mastodon tables.
+
+    Set MASTOOLS_TEST_DATABASE_URL to an SQLAlchemy URL for a scratch database to run these tests.
+    The tables are dropped afterward, so don't point it at anything that matters.
+    """
+
+    url = os.environ.get("MASTOOLS_TEST_DATABASE_URL")
+    if not url:
+        pytest.skip("MASTOOLS_TEST_DATABASE_URL isn't set")
+
+    engine = create_engine(url)
+    Base.metadata.drop_all(engine)
+    Base.metadata.create_all(engine)
+    session = sessionmaker(bind=engine)()
+    yield session
+    session.close()
+    Base.metadata.drop_all(engine)
+    engine.dispose()
+
+
+@pytest.fixture
+def pg_config():
+    """Return ~/.mastools/config.json-style connection details for the test PostgreSQL database."""
+
+    url = os.environ.get("MASTOOLS_TEST_DATABASE_URL")
+    if not url:
+        pytest.skip("MASTOOLS_TEST_DATABASE_URL isn't set")
+
+    url = make_url(url)
+    return {
+        "host": url.query.get("host", url.host),
+        "database": url.database,
+        "user": url.username,
+        "password": url.password or "",
+        "port": url.port or 5432,
+    }
@@ -0,0 +1,64 @@
+"""Test the common database things."""
+
+import pytest
+from sqlalchemy import text
+from sqlalchemy.exc import OperationalError
+
+from mastools.models import base
+
+
+def test_session_for_shares_engine(pg_config):
+    """Sessions for the same details share one pooled engine."""
+
+    config = dict(pg_config, pool_size=2, pool_pre_ping=True, statement_timeout="1500ms")
+    session = base.session_for(**config)
+
+    assert session is base.session_for(**config)
+    assert session.get_bind() is base.engine_for(**config)
+    assert session.get_bind().pool.size() == 2
+    assert session.execute(text("SHOW statement_timeout")).scalar() == "1500ms"
+
+    session.close()
+    session.get_bind().dispose()
+
+
+def test_read_only_session(pg_config):
+    """Read-only sessions read one snapshot and can't write."""
+
+    session = base.session_for(read_only=True, **pg_config)
+
+    assert session is not base.session_for(**pg_config)
+    assert session.execute(text("SHOW transaction_isolation")).scalar() == "repeatable read"
+    assert session.execute(text("SHOW transaction_read_only")).scalar() == "on"
+
+    session.close()
+    session.get_bind().dispose()
+
+
+def test_report_session_falls_back(pg_config, caplog):
+    """If the replica is down, reports use the primary, but only if that's allowed."""
+
+    replica = dict(pg_config, port=1)
+
+    with pytest.raises(OperationalError):
+        base.report_session_for(pg_config, replica)
+
+    session = base.report_session_for(pg_config, replica, fallback=True)
+    assert session is base.session_for(read_only=True, **pg_config)
+    assert "can't reach the read replica" in caplog.text
+
+    session.close()
+    session.get_bind().dispose()
+
+
+def test_report_session_logs_lag(pg_config, caplog):
+    """The replica's lag is logged, or that it isn't one."""
+
+    replica = dict(pg_config, pool_size=1)
+    session = base.report_session_for(pg_config, replica)
+
+    assert session is base.session_for(read_only=True, **replica)
+    assert "isn't replicating" in caplog.text
+
+    session.close()
+    session.get_bind().dispose()
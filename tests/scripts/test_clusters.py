@@ -0,0 +1,98 @@
+"""Test the clusters script."""
+
+import random
+import sqlite3
+import string
+from datetime import datetime
+
+import pytest
+
+from mastools.scripts import clusters
+
+NOW = datetime(2019, 10, 27, 12, 0, 0)
+
+
+def spam_data(number):
+    """Return the data of one account in a wave of spam accounts."""
+
+    return {
+        "note": f"Call our support team on 1-800-{number} for help with your account! "
+        f"https://support-{number}.example/help",
+        "fields": [{"name": "Website", "value": f"https://support-{number}.example/"}],
+    }
+
+
+def random_data(rng):
+    """Return the data of an account with nothing in common with the others."""
+
+    words = (
+        "".join(rng.choice(string.ascii_lowercase) for _ in range(rng.randint(3, 8)))
+        for _ in range(15)
+    )
+    return {"note": " ".join(words), "fields": []}
+
+
+def new(username, data):
+    """Return a new-user change."""
+
+    return ("new", username, None, data)
+
+
+def test_similarity():
+    """Near-duplicates have similar signatures, and unrelated accounts don't."""
+
+    rng = random.Random(0)
+    spam = clusters.signature(spam_data(1234))
+    assert clusters.similarity(spam, clusters.signature(spam_data(98765))) == 1.0
+    edited = dict(spam_data(1), note=spam_data(1)["note"].replace("help with", "problems with"))
+    assert clusters.similarity(spam, clusters.signature(edited)) >= clusters.THRESHOLD
+    assert clusters.similarity(spam, clusters.signature(random_data(rng))) < 0.2
+    assert clusters.signature({"note": "", "fields": []}) is None
+
+
+def test_clustered(mastools_dir):  # pylint: disable=unused-argument
+    """New users that look alike come out together, after everything else."""
+
+    rng = random.Random(0)
+    changes = [new(f"spam{number}", spam_data(number)) for number in range(5)]
+    changes.insert(2, ("deleted", "gone", {"note": "", "fields": []}, None))
+    changes.insert(3, new("loner", random_data(rng)))
+    changes.append(new("blank", {"note": "", "fields": []}))
+
+    result = list(clusters.clustered(changes, now=NOW))
+    assert result[:2] == [(None, [changes[2]]), (None, [changes[-1]])]
+    assert sorted(result[2:]) == sorted(
+        [
+            (
+                clusters.Cluster(1, "spam0", 5),
+                [change for change in changes if "spam" in change[1]],
+            ),
+            (clusters.Cluster(2, "loner", 1), [changes[3]]),
+        ]
+    )
+
+
+def test_clustered_remembers(mastools_dir):  # pylint: disable=unused-argument
+    """New users join clusters from earlier runs."""
+
+    list(clusters.clustered([new("spam1", spam_data(1)), new("spam2", spam_data(2))], now=NOW))
+    later = [new("spam3", spam_data(3))]
+    assert list(clusters.clustered(later, now=NOW)) == [(clusters.Cluster(1, "spam1", 3), later)]
+
+
+def test_clustered_saves_at_end(mastools_dir):  # pylint: disable=unused-argument
+    """A run that stops partway through doesn't save its clusters."""
+
+    changes = clusters.clustered([new("spam1", spam_data(1)), new("spam2", spam_data(2))])
+    next(changes)
+    changes.close()
+    assert list(clusters.clustered([new("spam3", spam_data(3))], now=NOW))[0][0].size == 1
+
+
+def test_unknown_version(mastools_dir):  # pylint: disable=unused-argument
+    """An index made with different signatures isn't used."""
+
+    with sqlite3.connect(clusters.clusters_file()) as connection:
+        connection.execute("PRAGMA user_version = 99")
+    with pytest.raises(ValueError, match="clusters version"):
+        clusters.open_index()
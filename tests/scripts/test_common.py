@@ -0,0 +1,142 @@
+"""Test the common script helpers."""
+
+import json
+import sqlite3
+from contextlib import closing
+
+import pytest
+
+from mastools.scripts import common
+
+USERS = {
+    "zed": {"fields": [{"name": "web", "value": "https://example.com"}], "note": ""},
+    "amy": {"fields": None, "note": "Visit http://example.com ☃"},
+}
+
+
+def test_cache_round_trip(mastools_dir):
+    """What goes into the cache comes back out in the same order."""
+
+    common.save_cache("users", 1, USERS)
+
+    loaded = common.load_cache("users", 1)
+    assert loaded == USERS
+    assert list(loaded) == ["zed", "amy"]
+    assert [path.name for path in mastools_dir.iterdir()] == ["users_cache.sqlite3"]
+
+
+def test_cache_missing(mastools_dir):  # pylint: disable=unused-argument
+    """There's nothing in the cache before the first run."""
+
+    assert common.load_cache("users", 1) == {}
+    assert common.lookup_cache("users", 1, "amy") is None
+
+
+def test_lookup_cache(mastools_dir):  # pylint: disable=unused-argument
+    """Single entries can be looked up."""
+
+    common.save_cache("users", 1, USERS)
+
+    assert common.lookup_cache("users", 1, "amy") == USERS["amy"]
+    assert common.lookup_cache("users", 1, "nobody", "default") == "default"
+
+
+def test_cache_wrong_version(mastools_dir):  # pylint: disable=unused-argument
+    """Loading a cache with an unexpected version is an error."""
+
+    common.save_cache("users", 1, USERS)
+
+    with pytest.raises(ValueError):
+        common.load_cache("users", 2)
+
+
+def test_cache_overwrite(mastools_dir):  # pylint: disable=unused-argument
+    """Saving replaces the whole snapshot."""
+
+    common.save_cache("users", 1, USERS)
+    common.save_cache("users", 1, {"bob": {"fields": [], "note": "hi"}})
+
+    assert common.load_cache("users", 1) == {"bob": {"fields": [], "note": "hi"}}
+
+
+def test_cache_migration(mastools_dir):
+    """Old JSON caches are converted to snapshots the first time they're read."""
+
+    (mastools_dir / "users_cache.json").write_text(
+        json.dumps({"users": USERS, "version": 1}, indent=2)
+    )
+
+    assert common.lookup_cache("users", 1, "zed") == USERS["zed"]
+    assert not (mastools_dir / "users_cache.json").exists()
+    assert common.load_cache("users", 1) == USERS
+
+
+def test_cache_digests(mastools_dir):  # pylint: disable=unused-argument
+    """The cache can hand back short digests of its contents instead of the contents."""
+
+    common.save_cache("users", 1, USERS)
+
+    digests = common.load_cache_digests("users", 1)
+    assert list(digests) == ["zed", "amy"]
+    assert digests["amy"] == common.digest(USERS["amy"])
+    assert len(digests["amy"]) == 16
+    assert digests["amy"] != digests["zed"]
+
+
+def test_digest_ignores_key_order():
+    """Equal values have equal digests."""
+
+    assert common.digest({"note": "a", "fields": []}) == common.digest({"fields": [], "note": "a"})
+    assert common.digest({"note": "a", "fields": []}) != common.digest({"note": "b", "fields": []})
+
+
+def test_save_cache_unchanged(mastools_dir):  # pylint: disable=unused-argument
+    """UNCHANGED values are copied from the previous snapshot."""
+
+    common.save_cache("users", 1, USERS)
+    common.save_cache("users", 1, {"bob": {"note": "hi"}, "amy": common.UNCHANGED})
+
+    assert common.load_cache("users", 1) == {"bob": {"note": "hi"}, "amy": USERS["amy"]}
+
+
+def test_snapshot_upgrade(mastools_dir):
+    """Snapshots from before digests were stored are upgraded in place."""
+
+    with closing(sqlite3.connect(mastools_dir / "users_cache.sqlite3")) as connection:
+        connection.executescript(
+            """
+            CREATE TABLE meta (name TEXT PRIMARY KEY, value);
+            CREATE TABLE entries (
+                position INTEGER PRIMARY KEY, key TEXT NOT NULL UNIQUE, value TEXT NOT NULL
+            );
+            INSERT INTO meta VALUES ('format', 1), ('version', 1);
+            """
+        )
+        connection.executemany(
+            "INSERT INTO entries (key, value) VALUES (?, ?)",
+            ((key, json.dumps(value)) for key, value in USERS.items()),
+        )
+        connection.commit()
+
+    assert common.load_cache_digests("users", 1) == {
+        key: common.digest(value) for key, value in USERS.items()
+    }
+    assert common.load_cache("users", 1) == USERS
+
+
+def test_replica_config(mastools_dir, monkeypatch):
+    """The replica's details are the primary's, with its own settings on top."""
+
+    config_file = mastools_dir / "config.json"
+    monkeypatch.setattr(common, "CONFIG_FILE", config_file)
+    primary = {"host": "primary", "database": "mastodon", "user": "me", "password": "secret"}
+
+    config_file.write_text(json.dumps(primary))
+    assert common.get_config() == primary
+    assert common.get_replica_config() == (None, False)
+
+    config_file.write_text(
+        json.dumps(dict(primary, replica={"host": "replica", "fallback_to_primary": True}))
+    )
+    assert common.get_config() == primary
+    assert common.get_replica_config() == (dict(primary, host="replica"), True)
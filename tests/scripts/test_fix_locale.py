@@ -0,0 +1,270 @@
+"""Test the locale fixer."""
+
+import io
+import json
+import os
+import sys
+
+import pytest
+
+from mastools.scripts import fix_locale
+
+YAML_LOCALE = """\
+---
+en:
+  statuses:
+    post: "Post"
+    reply: Reply to this post
+"""
+
+YAML_FIXED = """\
+---
+en:
+  statuses:
+    post: "Toot"
+    reply: Reply to this toot
+"""
+
+
+@pytest.fixture(name="locale_tree")
+def fixture_locale_tree(tmp_path):
+    """Make a small tree of locale files."""
+
+    (tmp_path / "devise").mkdir()
+    (tmp_path / "en.yml").write_text(YAML_LOCALE)
+    (tmp_path / "devise" / "devise.en.yml").write_text(YAML_LOCALE)
+    (tmp_path / "en.json").write_text(json.dumps({"compose.post": "Post it"}))
+    (tmp_path / "README.md").write_text("Not a post")
+    return tmp_path
+
+
+def test_locale_files_expands_directories_and_globs(locale_tree):
+    """Directories and globs find every locale file, once each."""
+
+    found = list(
+        fix_locale.locale_files(
+            [str(locale_tree), str(locale_tree / "*.yml"), str(locale_tree / "en.json")]
+        )
+    )
+    assert sorted(found) == sorted(
+        [locale_tree / "devise" / "devise.en.yml", locale_tree / "en.json", locale_tree / "en.yml"]
+    )
+
+
+def test_locale_files_rejects_unknown_extensions(locale_tree):
+    """Naming a file that isn't a locale file is an error."""
+
+    with pytest.raises(ValueError):
+        list(fix_locale.locale_files([str(locale_tree / "README.md")]))
+
+
+@pytest.mark.parametrize("jobs", [1, 2])
+def test_repair_files_overwrites(locale_tree, jobs):
+    """Every file in the tree is fixed in place, however many processes do it."""
+
+    fix_locale.repair_files(
+        list(fix_locale.locale_files([str(locale_tree)])), overwrite=True, jobs=jobs
+    )
+
+    assert (locale_tree / "en.yml").read_text() == YAML_FIXED
+    assert (locale_tree / "devise" / "devise.en.yml").read_text() == YAML_FIXED
+    assert json.loads((locale_tree / "en.json").read_text()) == {"compose.post": "Toot it"}
+    assert (locale_tree / "README.md").read_text() == "Not a post"
+    # No temp files were left behind.
+    assert sorted(os.listdir(locale_tree)) == ["README.md", "devise", "en.json", "en.yml"]
+
+
+def test_repair_files_writes_stdout_in_order(locale_tree, monkeypatch):
+    """Without overwriting, each file's output is written in the order the files were named."""
+
+    output = io.StringIO()
+    monkeypatch.setattr(fix_locale, "stdout", output)
+    fix_locale.repair_files(
+        [locale_tree / "en.yml", locale_tree / "en.json", locale_tree / "devise" / "devise.en.yml"],
+        jobs=2,
+    )
+
+    assert output.getvalue() == (YAML_FIXED + '{\n  "compose.post": "Toot it"\n}' + YAML_FIXED)
+    assert (locale_tree / "en.yml").read_text() == YAML_LOCALE
+
+
+def test_repair_files_skips_files_in_manifest(locale_tree):
+    """Files that haven't changed since they were fixed aren't fixed again."""
+
+    manifest = locale_tree / "manifest.json"
+    filepaths = [locale_tree / "en.yml", locale_tree / "en.json"]
+    fix_locale.repair_files(filepaths, overwrite=True, jobs=1, manifest=manifest)
+    hashes = json.loads(manifest.read_text())["files"]
+    assert hashes[str((locale_tree / "en.yml").resolve())] == fix_locale.file_hash(
+        locale_tree / "en.yml"
+    )
+
+    # Something that would be fixed if the file were read again...
+    (locale_tree / "en.json").write_text('{\n  "compose.post": "Toot it"\n}')
+    fixed_json = (locale_tree / "en.json").read_bytes()
+    # ...and an upstream change that brings back the damage.
+    (locale_tree / "en.yml").write_text(YAML_LOCALE)
+
+    _, known_hash, output = fix_locale.repair_file(
+        locale_tree / "en.json",
+        overwrite=True,
+        known_hash=hashes[str((locale_tree / "en.json").resolve())],
+    )
+    assert (known_hash, output) == (hashes[str((locale_tree / "en.json").resolve())], None)
+
+    fix_locale.repair_files(filepaths, overwrite=True, jobs=1, manifest=manifest)
+    assert (locale_tree / "en.yml").read_text() == YAML_FIXED
+    assert (locale_tree / "en.json").read_bytes() == fixed_json
+
+
+def test_write_atomically_keeps_mode(tmp_path):
+    """Replacing a file keeps its permissions."""
+
+    filepath = tmp_path / "en.yml"
+    filepath.write_text("old")
+    filepath.chmod(0o644)
+    fix_locale.write_atomically(filepath, "new")
+    assert filepath.read_text() == "new"
+    assert filepath.stat().st_mode & 0o777 == 0o644
+
+
+@pytest.mark.parametrize(
+    "value,expected",
+    [
+        ("Post a post", "Toot a toot"),
+        ("Reposted", "Retooted"),
+        ("POST", "POST"),
+        ("", ""),
+    ],
+)
+def test_repair_string_default_rules(value, expected):
+    """The default rules do what the old chained replaces did."""
+
+    assert fix_locale.repair_string(value) == expected
+    assert fix_locale.repair_string(value) == value.replace("post", "toot").replace("Post", "Toot")
+
+
+BOOST_RULES = (
+    fix_locale.Rule("boost", "reblog", whole_word=True, preserve_case=True),
+    fix_locale.Rule("boosted", "reblogged", whole_word=True, preserve_case=True),
+    fix_locale.Rule("reblog", "boost"),
+)
+
+
+@pytest.mark.parametrize(
+    "value,expected",
+    [
+        ("Boost this", "Reblog this"),
+        ("BOOST", "REBLOG"),
+        ("boosted it", "reblogged it"),
+        ("booster", "booster"),
+        ("bOOst", "bOOst"),
+        # Rules apply to the original text, not to each other's replacements.
+        ("boost or reblog", "reblog or boost"),
+    ],
+)
+def test_repair_string_rule_table(value, expected):
+    """Whole-word and case-preserving rules are applied in one pass."""
+
+    assert fix_locale.repair_string(value, BOOST_RULES) == expected
+
+
+def test_load_rules(tmp_path):
+    """A rule table is read from JSON, and nonsense is an error."""
+
+    filepath = tmp_path / "rules.json"
+    filepath.write_text('[{"find": "boost", "replace": "reblog", "whole_word": true}]')
+    assert fix_locale.load_rules(filepath) == (fix_locale.Rule("boost", "reblog", True),)
+
+    filepath.write_text('[{"find": "boost"}]')
+    with pytest.raises(ValueError):
+        fix_locale.load_rules(filepath)
+
+
+def test_deep_update_deeply_nested():
+    """Nesting deeper than the recursion limit is fine, and lists and non-strings are handled."""
+
+    locale = inner = {}
+    for _ in range(sys.getrecursionlimit() + 100):
+        inner["child"] = {}
+        inner = inner["child"]
+    inner.update(text="post", items=["Post", None, {"more": "posts"}], count=3)
+
+    fix_locale.deep_update(locale)
+
+    assert inner == {"text": "toot", "items": ["Toot", None, {"more": "toots"}], "count": 3}
+
+
+def test_repair_files_rechecks_when_rules_change(locale_tree):
+    """Files in the manifest are fixed again if the rules have changed since."""
+
+    manifest = locale_tree / "manifest.json"
+    filepaths = [locale_tree / "en.yml"]
+    fix_locale.repair_files(filepaths, overwrite=True, jobs=1, manifest=manifest)
+    assert (locale_tree / "en.yml").read_text() == YAML_FIXED
+
+    rules = (fix_locale.Rule("toot", "post", whole_word=True, preserve_case=True),)
+    fix_locale.repair_files(filepaths, overwrite=True, jobs=1, manifest=manifest, rules=rules)
+    assert (locale_tree / "en.yml").read_text() == YAML_LOCALE
+
+
+class TrickleReader(io.StringIO):
+    """A stream that returns a few characters at a time, to split tokens across reads."""
+
+    def read(self, size=-1):
+        return super().read(3)
+
+
+JSON_DOCUMENTS = [
+    {},
+    {"compose.post": "Post it", "empty": "", "unicode": 'Tööt ✨ "quoted" \\ \n'},
+    {
+        "nested": {"deeper": {"post": "a post"}, "list": ["Post", 1, -2.5e3, True, None, [], {}]},
+        "numbers": [0, 12345678901234567890, 1.0, -0.0, 1e-7],
+    },
+    ["post", {"post": "post"}],
+    "just a post",
+]
+
+
+@pytest.mark.parametrize("document", JSON_DOCUMENTS)
+@pytest.mark.parametrize("reader", [io.StringIO, TrickleReader])
+def test_write_repaired_json_matches_json_dumps(document, reader):
+    """Streaming gives the same output as fixing the loaded document, even split across reads."""
+
+    text = json.dumps(document, indent=4)
+    output = io.StringIO()
+    fix_locale.write_repaired_json(reader(text), output)
+
+    expected = json.loads(text)
+    if isinstance(expected, str):
+        expected = fix_locale.repair_string(expected)
+    else:
+        fix_locale.deep_update(expected)
+    assert output.getvalue() == json.dumps(expected, indent=2, ensure_ascii=False)
+
+
+def test_repaired_json_flat_file_is_unchanged(tmp_path):
+    """Flat files come out byte for byte the same as they used to."""
+
+    locale = {f"key.{index}": f"Post number {index}: ümlaut post" for index in range(100)}
+    filepath = tmp_path / "en.json"
+    filepath.write_text(json.dumps(locale, separators=(",", ":")))
+
+    old_output = json.dumps(
+        {
+            key: value.replace("post", "toot").replace("Post", "Toot")
+            for key, value in locale.items()
+        },
+        indent=2,
+        ensure_ascii=False,
+    )
+    assert fix_locale.repaired(filepath) == old_output
+
+
+@pytest.mark.parametrize("text", ['{"a": "b"', '{"a" "b"}', '["a",]', '{"a": tru}', '"a" "b"', ""])
+def test_write_repaired_json_rejects_invalid_json(text):
+    """Invalid JSON is an error rather than garbage output."""
+
+    with pytest.raises(ValueError):
+        fix_locale.write_repaired_json(TrickleReader(text), io.StringIO())
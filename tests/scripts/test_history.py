@@ -0,0 +1,98 @@
+"""Test the change history."""
+
+import argparse
+from datetime import datetime, timedelta, timezone
+
+import pytest
+
+from mastools.scripts import history
+
+EPOCH = datetime(2019, 10, 27, 12, 0, 0)
+
+SPAM = {"fields": [], "note": "http://spam.example"}
+MORE_SPAM = {"fields": [], "note": "http://more-spam.example"}
+
+
+def record(changes, when):
+    """Log the changes as though they were reported at the given time."""
+
+    assert list(history.recorded(iter(changes), now=when)) == changes
+
+
+@pytest.fixture(name="logged")
+def fixture_logged(mastools_dir):  # pylint: disable=unused-argument
+    """Log a few runs' worth of changes."""
+
+    record([("new", "amy", None, SPAM), ("new", "bob", None, SPAM)], EPOCH)
+    record([("changed", "amy", SPAM, MORE_SPAM)], EPOCH + timedelta(minutes=30))
+    record([("deleted", "bob", SPAM, None)], EPOCH + timedelta(hours=2))
+
+
+def test_events_for_user(logged):  # pylint: disable=unused-argument
+    """A user's changes come back oldest first, with what they changed to."""
+
+    assert list(history.events("amy")) == [
+        ("2019-10-27T12:00:00", "new", "amy", SPAM),
+        ("2019-10-27T12:30:00", "changed", "amy", MORE_SPAM),
+    ]
+
+
+def test_events_in_window(logged):  # pylint: disable=unused-argument
+    """Changes can be limited to a window of time, given in any time zone."""
+
+    since = (EPOCH + timedelta(minutes=10)).replace(tzinfo=timezone.utc)
+    assert [(kind, username) for _, kind, username, _ in history.events(since=since)] == [
+        ("changed", "amy"),
+        ("deleted", "bob"),
+    ]
+    assert [
+        (kind, username)
+        for _, kind, username, _ in history.events(until=EPOCH + timedelta(hours=1))
+    ] == [("new", "amy"), ("new", "bob"), ("changed", "amy")]
+
+
+def test_counts(logged):  # pylint: disable=unused-argument
+    """Changes are counted per hour or per day."""
+
+    assert list(history.counts("hour")) == [
+        ("2019-10-27T12", "changed", 1),
+        ("2019-10-27T12", "new", 2),
+        ("2019-10-27T14", "deleted", 1),
+    ]
+    assert list(history.counts("day")) == [
+        ("2019-10-27", "changed", 1),
+        ("2019-10-27", "deleted", 1),
+        ("2019-10-27", "new", 2),
+    ]
+
+
+def test_failed_run_is_not_logged(mastools_dir):  # pylint: disable=unused-argument
+    """If the changes stop partway through, none of them are logged."""
+
+    def failing():
+        yield "new", "amy", None, SPAM
+        raise RuntimeError("the cache couldn't be saved")
+
+    with pytest.raises(RuntimeError):
+        list(history.recorded(failing(), now=EPOCH))
+
+    assert not list(history.events())
+
+
+def test_show_history(logged, capsys):  # pylint: disable=unused-argument
+    """The subcommand lists changes or counts them."""
+
+    history.show_history(argparse.Namespace(username=None, since=None, until=None, per="hour"))
+    assert capsys.readouterr().out.splitlines() == [
+        "2019-10-27T12  changed  1",
+        "2019-10-27T12  new      2",
+        "2019-10-27T14  deleted  1",
+    ]
+
+    history.show_history(argparse.Namespace(username="bob", since=None, until=None, per=None))
+    assert capsys.readouterr().out.splitlines() == [
+        "2019-10-27T12:00:00  new      bob",
+        "  fields: []",
+        "  note: 'http://spam.example'",
+        "2019-10-27T14:00:00  deleted  bob",
+    ]
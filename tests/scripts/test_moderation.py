@@ -0,0 +1,74 @@
+"""Test the moderation script."""
+
+import argparse
+
+import pytest
+
+from mastools.scripts import moderation
+
+
+def make_args(**kwargs):
+    """Return the options of a moderation subcommand."""
+
+    return argparse.Namespace(
+        **dict({"chunk_size": 2, "dry_run": False, "restart": False}, **kwargs)
+    )
+
+
+def test_moderate_in_chunks(session, mastools_dir):  # pylint: disable=unused-argument
+    """Each chunk is applied and committed in turn, and the progress file goes away at the end."""
+
+    chunks = []
+
+    def apply(session, ids):  # pylint: disable=unused-argument
+        chunks.append(ids)
+        assert moderation.load_progress("test")["done"] == 2 * (len(chunks) - 1)
+        return len(ids)
+
+    targets = [(target, f"target {target}") for target in range(5)]
+    assert moderation.moderate(session, "test", lambda: targets, apply, make_args()) == 5
+    assert chunks == [[0, 1], [2, 3], [4]]
+    assert not moderation.progress_file("test").exists()
+
+
+def test_moderate_resumes(session, mastools_dir):  # pylint: disable=unused-argument
+    """A run that died partway through is finished by the next one, unless it's restarted."""
+
+    def fail_on_third(session, ids):  # pylint: disable=unused-argument
+        if 2 in ids:
+            raise RuntimeError("connection lost")
+        return len(ids)
+
+    targets = [(target, str(target)) for target in range(5)]
+    with pytest.raises(RuntimeError):
+        moderation.moderate(session, "test", lambda: targets, fail_on_third, make_args())
+
+    chunks = []
+
+    def apply(session, ids):  # pylint: disable=unused-argument
+        chunks.append(ids)
+        return len(ids)
+
+    def find_nothing():
+        raise AssertionError("the unfinished run's targets should be used")
+
+    assert moderation.moderate(session, "test", find_nothing, apply, make_args(chunk_size=5)) == 3
+    assert chunks == [[2, 3, 4]]
+
+    with pytest.raises(RuntimeError):
+        moderation.moderate(session, "test", lambda: targets, fail_on_third, make_args())
+    chunks.clear()
+    moderation.moderate(session, "test", lambda: targets[:1], apply, make_args(restart=True))
+    assert chunks == [[0]]
+
+
+def test_moderate_dry_run(session, mastools_dir, capsys):  # pylint: disable=unused-argument
+    """A dry run only says what it would do."""
+
+    def apply(session, ids):
+        raise AssertionError("a dry run shouldn't change anything")
+
+    targets = [(1, "alice"), (2, "bob")]
+    moderation.moderate(session, "test", lambda: targets, apply, make_args(dry_run=True))
+    assert capsys.readouterr().out == "Would test alice\nWould test bob\n"
+    assert not moderation.progress_file("test").exists()
@@ -0,0 +1,60 @@
+"""Test the profiling script."""
+
+import argparse
+import io
+import json
+import pstats
+import time
+
+from mastools.models import Accounts
+from mastools.scripts import profiling
+
+
+def slow(seconds, items):
+    """Yield the items, taking a while over each."""
+
+    for item in items:
+        time.sleep(seconds)
+        yield item
+
+
+def test_not_profiling():
+    """Marking phases changes nothing when not profiling."""
+
+    items = [1, 2, 3]
+    assert profiling.timed("scan", items) is items
+    with profiling.phase("render"):
+        pass
+
+
+def test_profiled(session, capsys, tmp_path):
+    """Each phase gets its own time, queries, and rows, not counting the phases inside it."""
+
+    def func(args):  # pylint: disable=unused-argument
+        scanned = profiling.timed("scan", slow(0.02, range(3)))
+        for item in profiling.timed("diff", slow(0.01, scanned)):
+            with profiling.phase("render", rows=2):
+                session.query(Accounts).filter(Accounts.id == item).all()
+
+    args = argparse.Namespace(profile="json", profile_dump=tmp_path / "profile.out")
+    profiling.profiled(func, args)
+    rows = {row["phase"]: row for row in json.loads(capsys.readouterr().err)}
+
+    assert list(rows) == ["scan", "diff", "render", "(other)", "total"]
+    assert 0.06 <= rows["scan"]["seconds"] < 0.09
+    assert 0.03 <= rows["diff"]["seconds"] < 0.06
+    assert [rows[name]["rows"] for name in ("scan", "diff", "render")] == [3, 3, 6]
+    assert [rows[name]["queries"] for name in rows] == [0, 0, 3, 0, 3]
+    assert rows["total"]["seconds"] >= sum(rows[name]["seconds"] for name in ("scan", "diff"))
+    assert pstats.Stats(str(tmp_path / "profile.out")).total_calls
+    assert profiling.PROFILE is None
+
+
+def test_render_table():
+    """The table has a line per phase."""
+
+    output = io.StringIO()
+    profiling.report(profiling.summary({"scan": profiling.new_stats()}, 2.0), "table", output)
+    lines = output.getvalue().splitlines()
+    assert [line.split()[0] for line in lines] == ["phase", "scan", "(other)", "total"]
+    assert lines[2].split()[1:3] == ["2.000", "100.0"]
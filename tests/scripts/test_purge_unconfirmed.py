@@ -0,0 +1,77 @@
+"""Test the purge_unconfirmed script."""
+
+from datetime import datetime, timedelta
+
+from mastools.models import Accounts, Users
+from mastools.scripts import purge_unconfirmed
+
+EPOCH = datetime(2019, 10, 27, 12, 0, 0)
+
+
+def add_users(session):
+    """Add a few users, some unconfirmed, a day apart."""
+
+    for user_id, (email, confirmed) in enumerate(
+        [
+            ("one@spam.example", False),
+            ("two@SPAM.example", False),
+            ("three@example.com", False),
+            ("four@spam.example", True),
+        ],
+        start=1,
+    ):
+        created_at = EPOCH + timedelta(days=user_id)
+        session.add(
+            Accounts(
+                id=user_id,
+                username=email.split("@")[0],
+                note="",
+                fields=[],
+                created_at=created_at,
+                updated_at=created_at,
+            )
+        )
+        session.flush()
+        session.add(
+            Users(
+                id=user_id,
+                email=email,
+                created_at=created_at,
+                confirmed_at=created_at if confirmed else None,
+                account_id=user_id,
+            )
+        )
+    session.commit()
+
+
+def check_purge(session):
+    """Only unconfirmed users matching the filters are deleted, along with their accounts."""
+
+    add_users(session)
+    assert purge_unconfirmed.purgeable_users(session, email_domains=["spam.example"]) == [
+        (1, "one", "one@spam.example"),
+        (2, "two", "two@SPAM.example"),
+    ]
+    assert [
+        user_id
+        for user_id, _, _ in purge_unconfirmed.purgeable_users(
+            session, since=EPOCH + timedelta(days=2), before=EPOCH + timedelta(days=4)
+        )
+    ] == [2, 3]
+
+    assert purge_unconfirmed.purge_users(session, [1, 4]) == 1
+    session.commit()
+    assert [user.id for user in session.query(Users).order_by(Users.id)] == [2, 3, 4]
+    assert [account.id for account in session.query(Accounts).order_by(Accounts.id)] == [2, 3, 4]
+
+
+def test_purge(session):
+    """Purge users in SQLite."""
+
+    check_purge(session)
+
+
+def test_purge_postgresql(pg_session):
+    """Purge users with array parameters in PostgreSQL."""
+
+    check_purge(pg_session)
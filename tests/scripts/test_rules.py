@@ -0,0 +1,101 @@
+"""Test the spam rules."""
+
+import json
+import re
+from types import SimpleNamespace
+
+import pytest
+
+from mastools.scripts import rules, user_changes
+
+DEFINITIONS = {
+    "url": {"literals": ["http"]},
+    "shortener": {"literals": ["bit.ly", "tinyurl.com", "t.co/"]},
+    "phone": {"patterns": [r"\+?\d[\d ().-]{8,}\d"]},
+    "wallet": {"patterns": [r"\b(?:bc1|[13])[a-hj-np-z0-9]{25,39}\b"]},
+}
+
+
+@pytest.fixture(params=["installed", "missing"])
+def literal_backend(request, monkeypatch):
+    """Run the test with and without pyahocorasick."""
+
+    if request.param == "missing":
+        monkeypatch.setattr(rules, "ahocorasick", None)
+    elif rules.ahocorasick is None:
+        pytest.skip("pyahocorasick isn't installed")
+
+
+def account(note, fields=None):
+    """Return cached-style account data."""
+
+    return {"note": note, "fields": fields}
+
+
+@pytest.mark.parametrize(
+    "literals",
+    [
+        ["http"],
+        ["bit", "bitcoin", "bit.ly"],
+        ["bitcoin", "bit"],
+        ["a", "ab", "abc", "b"],
+        ["x+y", "x.y", "(?)", "[a]"],
+    ],
+)
+def test_trie_pattern(literals):
+    """The trie matches exactly when one of the literals is in the text."""
+
+    pattern = re.compile(rules.trie_pattern(literals))
+    for text in ["", "http", "a bit of", "bitcoin", "xay", "x.y", "(?)", "b", "[a]", "zzz"]:
+        assert bool(pattern.search(text)) == any(literal in text for literal in literals), text
+
+
+# pylint: disable=unused-argument,redefined-outer-name  ; pytest fixtures
+
+
+def test_default_rules_match_has_url(literal_backend):
+    """The built-in rules are the same as has_url."""
+
+    default = rules.Rules(rules.DEFAULT_DEFINITIONS)
+    assert default.is_default
+    for note, fields in [
+        ("", []),
+        ("HTTPS://example.com", []),
+        (None, None),
+        ("hello", [{"name": "web", "value": "Http://example.com"}]),
+        ("hello", [{"name": "web", "value": "example.com"}]),
+        ("K", [{"name": "web", "value": "example.com"}]),
+    ]:
+        data = account(note, fields)
+        assert default.search(data) == user_changes.has_url(SimpleNamespace(**data))
+
+
+def test_rules_matching(literal_backend):
+    """Every matching rule is reported, in the order they were defined."""
+
+    compiled = rules.Rules(DEFINITIONS)
+
+    data = account("Call +1 (555) 123-4567", [{"name": "web", "value": "HTTPS://BIT.LY/spam"}])
+    assert compiled.search(data)
+    assert compiled.matching(data) == ["url", "shortener", "phone"]
+
+    assert not compiled.search(account("Just a person who likes bits."))
+    assert compiled.matching(account("Just a person who likes bits.")) == []
+
+
+def test_invalid_rules():
+    """Broken rules are reported as such."""
+
+    with pytest.raises(ValueError):
+        rules.Rules({"broken": {"patterns": ["(unclosed"]}})
+
+
+def test_load_rules(mastools_dir):
+    """Rules come from the rules file, if there is one."""
+
+    assert rules.load_rules() is rules.default_rules()
+
+    (mastools_dir / "rules.json").write_text(json.dumps(DEFINITIONS))
+    loaded = rules.load_rules()
+    assert loaded.definitions == DEFINITIONS
+    assert not loaded.is_default
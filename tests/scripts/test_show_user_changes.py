@@ -1,6 +1,20 @@
 """Test the user_changes script."""
 
-from mastools.scripts import user_changes
+import csv
+import io
+import json
+import shutil
+from datetime import datetime, timedelta
+
+import pytest
+from sqlalchemy import create_engine, event
+from sqlalchemy.orm import sessionmaker
+
+from mastools.models import Accounts
+from mastools.models.base import Base
+from mastools.scripts import clusters, common, rules, user_changes
+
+EPOCH = datetime(2019, 10, 27, 12, 0, 0)
 
 
 def collect(gen):
@@ -192,3 +206,450 @@ Deleted user: spammer
   - 'I like to\\n\\n.\\n\\nFrom: spammer@example.com\\nSubject: Inject spam'
 """
     )
+
+
+def add_account(session, account_id, username, note="", fields=None, domain=None, minute=0):
+    """Add an account that was created and last updated at the given minute."""
+
+    when = EPOCH + timedelta(minutes=minute)
+    account = Accounts(
+        id=account_id,
+        username=username,
+        domain=domain,
+        note=note,
+        fields=fields or [],
+        created_at=when,
+        updated_at=when,
+    )
+    session.add(account)
+    session.commit()
+    return account
+
+
+def touch(session, account, minute, **changes):
+    """Update the account at the given minute."""
+
+    for key, value in changes.items():
+        setattr(account, key, value)
+    account.updated_at = EPOCH + timedelta(minutes=minute)
+    session.commit()
+
+
+def changes_both_ways(session, cache_dir):
+    """Return the incremental and full changes starting from the same cache."""
+
+    saved = cache_dir.parent / "saved"
+    shutil.copytree(cache_dir, saved)
+    incremental = user_changes.find_user_changes(session)
+    shutil.rmtree(cache_dir)
+    shutil.copytree(saved, cache_dir)
+    full = user_changes.find_user_changes(session, full=True)
+    shutil.rmtree(saved)
+    return incremental, full
+
+
+def test_users_with_urls(session):
+    """Only local, unsuspended accounts that mention URLs are returned."""
+
+    add_account(session, 1, "plain", note="hello")
+    add_account(session, 2, "noted", note="See HTTPS://example.com")
+    add_account(session, 3, "fielded", fields=[make_field("web", "http://example.com")])
+    add_account(session, 4, "remote", note="http://example.com", domain="example.com")
+    suspended = add_account(session, 5, "suspended", note="http://example.com")
+    touch(session, suspended, 1, suspended_at=EPOCH)
+
+    assert list(user_changes.users_with_urls(session)) == ["noted", "fielded"]
+
+
+def test_incremental_matches_full(session, mastools_dir):
+    """Incremental runs report exactly what a full scan would have."""
+
+    add_account(session, 1, "quiet", note="hello", minute=1)
+    spammer = add_account(session, 2, "spammer", note="http://spam.example", minute=2)
+    reformed = add_account(session, 3, "reformed", note="http://spam.example", minute=3)
+    doomed = add_account(session, 4, "doomed", note="http://spam.example", minute=4)
+    banned = add_account(session, 5, "banned", note="http://spam.example", minute=5)
+    sleeper = add_account(session, 6, "sleeper", note="hello", minute=6)
+
+    first = user_changes.find_user_changes(session)
+    assert [(kind, username) for kind, username, _, _ in first] == [
+        ("new", "banned"),
+        ("new", "doomed"),
+        ("new", "reformed"),
+        ("new", "spammer"),
+    ]
+
+    touch(session, spammer, 10, note="http://more-spam.example")
+    touch(session, reformed, 10, note="I've changed")
+    touch(session, sleeper, 11, fields=[make_field("web", "https://sleeper.example")])
+    touch(session, banned, 12, suspended_at=EPOCH)
+    session.delete(doomed)
+    session.commit()
+    add_account(session, 7, "newbie", note="https://newbie.example", minute=12)
+
+    incremental, full = changes_both_ways(session, mastools_dir)
+    assert incremental == full
+    # Changes of every kind are reported together in username order.
+    assert [(kind, username) for kind, username, _, _ in incremental] == [
+        ("deleted", "banned"),
+        ("deleted", "doomed"),
+        ("new", "newbie"),
+        ("deleted", "reformed"),
+        ("new", "sleeper"),
+        ("changed", "spammer"),
+    ]
+
+    # Nothing changed since the last run.
+    assert user_changes.find_user_changes(session) == []
+
+
+def test_incremental_skips_seen_rows(session, mastools_dir):
+    """Rows updated at the watermark are only looked at again if they weren't seen before."""
+
+    add_account(session, 1, "spammer", note="http://spam.example", minute=1)
+    user_changes.find_user_changes(session)
+
+    # Another account updated at exactly the same time as the watermark.
+    add_account(session, 2, "twin", note="http://twin.example", minute=1)
+
+    incremental, full = changes_both_ways(session, mastools_dir)
+    assert (
+        incremental
+        == full
+        == [("new", "twin", None, {"fields": [], "note": "http://twin.example"})]
+    )
+
+
+URL_CASES = [
+    ("", []),
+    ("http://example.com", []),
+    ("Visit HTTPS://EXAMPLE.COM", []),
+    ("hTtP", []),
+    ("htt p", []),
+    ("ht\ntp", []),
+    ("\\http", []),
+    ('"http"', []),
+    ("ｈｔｔｐ://fullwidth.example", []),
+    ("K is a Kelvin sign, not http-ish", []),
+    ("İstanbul", [("web", "htt"), ("p", "x")]),
+    ("plain", [("Website", "https://example.com")]),
+    ("plain", [("HTTP", "in the name")]),
+    ("plain", [("quote", 'it\'s "http" with quotes')]),
+    ("plain", [("newline", "line\nhttp")]),
+    ("plain", [("split", "ht"), ("tp", "across fields")]),
+    ("plain", [("unicode", "ħttp")]),
+    ("plain", [("escape", "\\u0068ttp")]),
+    (None, None),
+]
+
+
+def test_url_clause_matches_has_url(pg_session):
+    """PostgreSQL selects exactly the accounts that the Python filter would."""
+
+    for account_id, (note, fields) in enumerate(URL_CASES, start=1):
+        account = add_account(pg_session, account_id, f"user{account_id}")
+        account.note = "" if note is None else note
+        account.fields = None if fields is None else make_fields(fields)
+    pg_session.commit()
+
+    everyone = pg_session.query(Accounts).order_by(Accounts.id).all()
+    expected = [account.username for account in everyone if user_changes.has_url(account)]
+
+    assert list(user_changes.users_with_urls(pg_session)) == expected
+    assert expected
+
+
+def test_users_with_urls_streams(pg_session):
+    """The account scan is read through a server-side cursor, a batch at a time."""
+
+    for account_id in range(1, 11):
+        add_account(pg_session, account_id, f"user{account_id}", note="http://example.com")
+
+    cursor_names = []
+
+    def remember_cursor(conn, cursor, *args):  # pylint: disable=unused-argument
+        cursor_names.append(cursor.name)
+
+    event.listen(pg_session.get_bind(), "before_cursor_execute", remember_cursor)
+    users = user_changes.users_with_urls(pg_session, batch_size=3)
+
+    assert len(users) == 10
+    assert cursor_names and all(cursor_names)
+
+
+def test_diff_users_loads_only_changed_users():
+    """Old data is only fetched for users that are being reported as changed or deleted."""
+
+    old = {
+        "same": {"fields": [], "note": "http://same.example"},
+        "changed": {"fields": [], "note": "http://old.example"},
+        "kept": {"fields": [], "note": "http://kept.example"},
+        "gone": {"fields": [], "note": "http://gone.example"},
+    }
+    new = {
+        "same": {"fields": [], "note": "http://same.example"},
+        "changed": {"fields": [], "note": "http://new.example"},
+        "kept": common.UNCHANGED,
+        "added": {"fields": [], "note": "http://added.example"},
+    }
+    loaded = []
+
+    def load_old(username):
+        loaded.append(username)
+        return old[username]
+
+    digests = {username: common.digest(data) for username, data in old.items()}
+    changes = list(user_changes.diff_users(digests, new, load_old))
+
+    assert [(kind, username) for kind, username, _, _ in changes] == [
+        ("changed", "changed"),
+        ("new", "added"),
+        ("deleted", "gone"),
+    ]
+    assert loaded == ["changed", "gone"]
+
+
+def test_render_new_user_matched():
+    """The names of the rules a user matched are shown with them."""
+
+    out = user_changes.render_new_user(
+        "newuser", {"fields": [], "note": "http://bit.ly/x"}, ["url", "shortener"]
+    )
+
+    assert (
+        collect(out)
+        == """\
+New user: newuser
+ matched: url, shortener
+ fields:
+  <none>
+ note:
+  + 'http://bit.ly/x'
+"""
+    )
+
+
+def test_changed_rules_rescan(session, mastools_dir):  # pylint: disable=unused-argument
+    """Changing the rules looks at every account again, even if it hasn't changed."""
+
+    add_account(session, 1, "spammer", note="http://spam.example", minute=1)
+    add_account(session, 2, "caller", note="Call 555-123-4567", minute=2)
+    user_changes.find_user_changes(session)
+
+    phone_rules = rules.Rules({"phone": {"patterns": [r"\d{3}-\d{3}-\d{4}"]}})
+    changes = user_changes.find_user_changes(session, rules=phone_rules)
+
+    assert [(kind, username) for kind, username, _, _ in changes] == [
+        ("new", "caller"),
+        ("deleted", "spammer"),
+    ]
+
+
+def add_shardable_accounts(session):
+    """Add accounts whose creation order doesn't follow their ids, some of them flagged."""
+
+    for account_id in range(1, 41):
+        add_account(
+            session,
+            account_id,
+            f"user{account_id}",
+            note="http://example.com" if account_id % 3 else "hello",
+            fields=[make_field("web", "https://example.com")] if account_id % 5 == 0 else None,
+            minute=(account_id * 7) % 13,
+        )
+
+
+@pytest.mark.parametrize("shards", [2, 3, 7, 100])
+def test_sharded_scan_matches_serial(tmp_path, shards):
+    """Scanning in shards finds the same users in the same order as one scan."""
+
+    # Every connection to an in-memory database gets a different database, so use a file.
+    engine = create_engine(f"sqlite:///{tmp_path}/mastodon.sqlite3")
+    Base.metadata.create_all(engine)
+    session = sessionmaker(bind=engine)()
+    add_shardable_accounts(session)
+    custom = rules.Rules({"hello": {"literals": ["hello"]}})
+
+    for spam_rules in (None, custom):
+        serial = user_changes.users_with_urls(session, rules=spam_rules)
+        sharded = user_changes.users_with_urls(session, rules=spam_rules, shards=shards)
+        assert list(sharded.items()) == list(serial.items())
+        assert serial
+
+    session.close()
+    engine.dispose()
+
+
+def test_sharded_scan_postgresql(pg_session):
+    """On PostgreSQL, the shards share one snapshot and each use their own connection."""
+
+    add_shardable_accounts(pg_session)
+    serial = user_changes.users_with_urls(pg_session)
+    pg_session.rollback()
+
+    connections = set()
+
+    def remember_connection(conn, *args):  # pylint: disable=unused-argument
+        connections.add(id(conn.connection.dbapi_connection))
+
+    event.listen(pg_session.get_bind(), "before_cursor_execute", remember_connection)
+    sharded = user_changes.users_with_urls(pg_session, shards=4)
+
+    assert list(sharded.items()) == list(serial.items())
+    assert len(connections) == 5
+
+
+def test_merge_users():
+    """Two username-sorted streams are merged into the changes between them."""
+
+    old_users = {"Zed": {"note": "z"}, "amy": {"note": "a"}, "bob": {"note": "b"}}
+    old_entries = (
+        (username, common.digest(data), common.encode(data))
+        for username, data in sorted(old_users.items())
+    )
+    new_users = iter([("Yan", {"note": "y"}), ("amy", {"note": "a"}), ("bob", {"note": "b2"})])
+
+    assert list(user_changes.merge_users(old_entries, new_users)) == [
+        ("new", "Yan", None, {"note": "y"}),
+        ("deleted", "Zed", {"note": "z"}, None),
+        ("changed", "bob", {"note": "b"}, {"note": "b2"}),
+    ]
+
+
+def test_streamed_full_scan_saves_at_end(session, mastools_dir):  # pylint: disable=unused-argument
+    """Changes come out before the cache is updated, and an abandoned scan leaves it alone."""
+
+    add_account(session, 1, "first", note="http://example.com")
+    add_account(session, 2, "second", note="http://example.com")
+    user_changes.find_user_changes(session)
+    add_account(session, 3, "third", note="http://example.com")
+
+    changes = user_changes.iter_user_changes(session, full=True)
+    assert next(changes)[:2] == ("new", "third")
+    changes.close()
+    assert list(common.load_cache(user_changes.CACHE_KEY, user_changes.CACHE_VERSION)) == [
+        "first",
+        "second",
+    ]
+
+    assert [change[:2] for change in user_changes.iter_user_changes(session, full=True)] == [
+        ("new", "third")
+    ]
+    assert user_changes.find_user_changes(session) == []
+
+
+def test_username_order_postgresql(pg_session, mastools_dir):  # pylint: disable=unused-argument
+    """PostgreSQL sorts usernames the same way as the cache, whatever its collation."""
+
+    for account_id, username in enumerate(["bob", "Alice", "carol", "Bob", "_x", "Ädam"], start=1):
+        add_account(pg_session, account_id, username, note="http://example.com")
+
+    first = user_changes.find_user_changes(pg_session, full=True)
+    assert [username for _, username, _, _ in first] == [
+        "Alice",
+        "Bob",
+        "_x",
+        "bob",
+        "carol",
+        "Ädam",
+    ]
+    assert user_changes.find_user_changes(pg_session, full=True) == []
+
+
+def test_render_cluster():
+    """A cluster is shown as one of its accounts, plus the others' names."""
+
+    cluster = clusters.Cluster(7, "spam0", 4)
+    data = {"note": "http://spam.example", "fields": []}
+    changes = [(user_changes.NEW, f"spam{number}", None, data) for number in (1, 2, 3)]
+
+    assert (
+        collect(user_changes.render_cluster(cluster, changes, rules.default_rules()))
+        == """\
+3 new accounts matching cluster 7 (4 in all)
+ first seen: spam0
+ accounts: spam1, spam2, spam3
+New user: spam1
+ matched: url
+ fields:
+  <none>
+ note:
+  + 'http://spam.example'
+"""
+    )
+
+
+EMITTED_CHANGES = [
+    (user_changes.NEW, "new_spammer", None, {"note": "http://spam.example", "fields": []}),
+    (
+        user_changes.DELETED,
+        "old_spammer",
+        {"note": "", "fields": make_fields([("website", "http://old.example")])},
+        None,
+    ),
+]
+
+
+def emitted(name, changes, cluster=None):
+    """Return what the named emitter writes for the changes."""
+
+    output = io.StringIO()
+    emit = user_changes.EMITTERS[name](output, rules.default_rules())
+    for change in changes:
+        emit(cluster, [change])
+    return output.getvalue()
+
+
+def test_text_emitter():
+    """The text format is the report people read."""
+
+    assert emitted("text", EMITTED_CHANGES) == "".join(
+        collect(user_changes.render_change(*change, rules=rules.default_rules())) + "\n"
+        for change in EMITTED_CHANGES
+    )
+
+
+def test_ndjson_emitter():
+    """The NDJSON format has one object per account."""
+
+    records = [json.loads(line) for line in emitted("ndjson", EMITTED_CHANGES).splitlines()]
+    assert records == [
+        {
+            "kind": "new",
+            "username": "new_spammer",
+            "matched": ["url"],
+            "cluster": None,
+            "old": None,
+            "new": {"note": "http://spam.example", "fields": []},
+        },
+        {
+            "kind": "deleted",
+            "username": "old_spammer",
+            "matched": [],
+            "cluster": None,
+            "old": {"note": "", "fields": [{"name": "website", "value": "http://old.example"}]},
+            "new": None,
+        },
+    ]
+
+
+def test_csv_emitter():
+    """The CSV format has one header and one row per account, and nothing if nothing changed."""
+
+    cluster = clusters.Cluster(3, "new_spammer", 2)
+    rows = list(csv.reader(io.StringIO(emitted("csv", EMITTED_CHANGES, cluster))))
+    assert rows == [
+        list(user_changes.CSV_COLUMNS),
+        ["new", "new_spammer", "url", "3", "http://spam.example", "[]", "", ""],
+        [
+            "deleted",
+            "old_spammer",
+            "",
+            "3",
+            "",
+            "",
+            "",
+            '[{"name": "website", "value": "http://old.example"}]',
+        ],
+    ]
+    assert emitted("csv", []) == ""
@@ -0,0 +1,79 @@
+"""Test the signup_flood script."""
+
+from datetime import datetime, timedelta
+
+from sqlalchemy import insert
+
+from mastools.models import Accounts, Users
+from mastools.scripts import signup_flood
+
+EPOCH = datetime(2019, 10, 27, 12, 0, 0)
+
+
+def add_signups(session, signups):
+    """Add a user, and its account, for each (email, created_at, confirmed) in signups."""
+
+    accounts = []
+    users = []
+    for user_id, (email, created_at, confirmed) in enumerate(signups, start=1):
+        accounts.append(
+            {
+                "id": user_id,
+                "username": f"user{user_id}",
+                "created_at": created_at,
+                "updated_at": created_at,
+                "note": "",
+                "fields": [],
+            }
+        )
+        users.append(
+            {
+                "id": user_id,
+                "email": email,
+                "created_at": created_at,
+                "confirmed_at": created_at if confirmed else None,
+                "account_id": user_id,
+            }
+        )
+    session.execute(insert(Accounts), accounts)
+    session.execute(insert(Users), users)
+    session.flush()
+
+
+def test_signup_floods(pg_session):
+    """A sudden burst from one domain stands out, and steady signups don't."""
+
+    signups = []
+    for minute in range(120):
+        created_at = EPOCH + timedelta(minutes=minute)
+        signups.append((f"steady{minute}@example.com", created_at, True))
+        if minute % 10 == 0:
+            signups.append((f"quiet{minute}@Example.NET", created_at, False))
+    # A burst of unconfirmed signups in the 100th minute
+    burst = EPOCH + timedelta(minutes=100, seconds=30)
+    signups.extend((f"spam{index}@example.net", burst, False) for index in range(20))
+    add_signups(pg_session, signups)
+
+    since = EPOCH + timedelta(minutes=90)
+    assert list(signup_flood.signup_floods(pg_session, "minute", since)) == [
+        (EPOCH + timedelta(minutes=100), "example.net", True, 21, 0.1)
+    ]
+
+    # The hour it was in doesn't look like much, compared to the hour before it.
+    assert not list(signup_flood.signup_floods(pg_session, "hour", since, baseline_windows=1))
+    # But it does with a lower bar.
+    assert list(
+        signup_flood.signup_floods(pg_session, "hour", since, baseline_windows=1, ratio=3)
+    ) == [(EPOCH + timedelta(hours=1), "example.net", True, 26, 6.0)]
+
+
+def test_signup_floods_new_domain(pg_session):
+    """Signups from a domain that's never been seen before only count past min_signups."""
+
+    burst = EPOCH + timedelta(minutes=5)
+    add_signups(pg_session, [(f"new{index}@new.example", burst, True) for index in range(5)])
+
+    assert not list(signup_flood.signup_floods(pg_session, "minute", EPOCH))
+    assert list(signup_flood.signup_floods(pg_session, "minute", EPOCH, min_signups=5)) == [
+        (burst, "new.example", False, 5, 0.0)
+    ]
@@ -0,0 +1,81 @@
+"""Test the suspend script."""
+
+from datetime import datetime
+
+from mastools.models import Accounts
+from mastools.scripts import clusters, common, suspend, user_changes
+
+EPOCH = datetime(2019, 10, 27, 12, 0, 0)
+LATER = datetime(2019, 10, 28, 12, 0, 0)
+
+
+def add_accounts(session):
+    """Add some local accounts, one already suspended, and a remote one."""
+
+    for account_id, username in enumerate(["alice", "bob", "carol", "dave"], start=1):
+        session.add(
+            Accounts(
+                id=account_id,
+                username=username,
+                domain="remote.example" if username == "dave" else None,
+                note="",
+                fields=[],
+                created_at=EPOCH,
+                updated_at=EPOCH,
+                suspended_at=EPOCH if username == "carol" else None,
+            )
+        )
+    session.commit()
+
+
+def suspended(session):
+    """Return each account's username and suspension time."""
+
+    return {
+        account.username: account.suspended_at
+        for account in session.query(Accounts).order_by(Accounts.id)
+    }
+
+
+def check_suspend(session):
+    """Only unsuspended local accounts are suspended, and only once."""
+
+    add_accounts(session)
+    usernames = ["alice", "bob", "carol", "dave", "nobody"]
+    accounts = suspend.suspendable_accounts(session, usernames, batch_size=2)
+    assert accounts == [(1, "alice"), (2, "bob")]
+
+    assert suspend.suspend_accounts(session, [1, 3], LATER) == 1
+    assert suspend.suspend_accounts(session, [1, 2], LATER) == 1
+    session.commit()
+    assert suspended(session) == {"alice": LATER, "bob": LATER, "carol": EPOCH, "dave": None}
+
+
+def test_suspend(session):
+    """Suspend accounts in SQLite."""
+
+    check_suspend(session)
+
+
+def test_suspend_postgresql(pg_session):
+    """Suspend accounts with array parameters in PostgreSQL."""
+
+    check_suspend(pg_session)
+
+
+def test_chosen_usernames(mastools_dir):  # pylint: disable=unused-argument
+    """Accounts can be chosen by name, from the last report, or by cluster."""
+
+    common.save_cache(
+        user_changes.CACHE_KEY, user_changes.CACHE_VERSION, {"flagged": {"note": "", "fields": []}}
+    )
+    spam = {"note": "Call 1-800-555-0100 for support! https://support.example/", "fields": []}
+    list(clusters.clustered([("new", "spam1", None, spam), ("new", "spam2", None, spam)]))
+
+    assert suspend.chosen_usernames(["bob"]) == ["bob"]
+    assert suspend.chosen_usernames(["bob"], flagged=True, cluster_ids=[1]) == [
+        "bob",
+        "flagged",
+        "spam1",
+        "spam2",
+    ]
@@ -0,0 +1,90 @@
+"""Test the unconfirmed_users script."""
+
+import argparse
+from datetime import datetime, timedelta, timezone
+
+import pytest
+from sqlalchemy import event
+
+from mastools.models import Accounts, Users
+from mastools.scripts import unconfirmed_users
+
+EPOCH = datetime(2019, 10, 27, 12, 0, 0)
+
+
+def add_user(session, user_id, username, minute, confirmed=False):
+    """Add a user and their account, created at the given minute."""
+
+    when = EPOCH + timedelta(minutes=minute)
+    session.add(Accounts(id=user_id, username=username, note="", created_at=when, updated_at=when))
+    session.add(
+        Users(
+            id=user_id,
+            email=f"{username}@example.com",
+            created_at=when,
+            confirmed_at=when if confirmed else None,
+            account_id=user_id,
+        )
+    )
+    session.commit()
+
+
+@pytest.fixture
+def users(session):
+    """Add a few confirmed and unconfirmed users."""
+
+    add_user(session, 1, "old", 1)
+    add_user(session, 2, "confirmed", 2, confirmed=True)
+    add_user(session, 3, "middle", 3)
+    add_user(session, 4, "newest", 4)
+    return session
+
+
+def usernames(rows):
+    """Return just the usernames from unconfirmed_users."""
+
+    return [username for _, username, _ in rows]
+
+
+def test_unconfirmed_users(users):
+    """Unconfirmed users are shown oldest first with a single query."""
+
+    statements = []
+    event.listen(
+        users.get_bind(), "before_cursor_execute", lambda *args: statements.append(args[2])
+    )
+
+    rows = list(unconfirmed_users.unconfirmed_users(users))
+
+    assert rows[0] == ("old@example.com", "old", EPOCH + timedelta(minutes=1))
+    assert usernames(rows) == ["old", "middle", "newest"]
+    assert len(statements) == 1
+
+
+def test_unconfirmed_users_since(users):
+    """--since skips older users."""
+
+    since = EPOCH + timedelta(minutes=3)
+    assert usernames(unconfirmed_users.unconfirmed_users(users, since=since)) == [
+        "middle",
+        "newest",
+    ]
+
+
+def test_unconfirmed_users_limit(users):
+    """--limit picks the newest users, but still shows them oldest first."""
+
+    assert usernames(unconfirmed_users.unconfirmed_users(users, limit=2)) == ["middle", "newest"]
+
+
+def test_parse_since():
+    """Timestamps and durations are both understood."""
+
+    assert unconfirmed_users.parse_since("2019-10-27 12:00") == EPOCH
+
+    since = unconfirmed_users.parse_since("2h")
+    ago = datetime.now(timezone.utc).replace(tzinfo=None) - since
+    assert timedelta(hours=2) <= ago < timedelta(hours=2, minutes=1)
+
+    with pytest.raises(argparse.ArgumentTypeError):
+        unconfirmed_users.parse_since("yesterday")
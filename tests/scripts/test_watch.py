@@ -0,0 +1,62 @@
+"""Test the watch script."""
+
+import threading
+
+from sqlalchemy import text
+
+from mastools.scripts import user_changes, watch
+
+from test_show_user_changes import add_account, touch  # pylint: disable=import-error
+
+
+def test_targeted_changes(session, mastools_dir):  # pylint: disable=unused-argument
+    """Only the named accounts are looked at, and deleted ones are noticed."""
+
+    add_account(session, 1, "spammer", note="http://spam.example", minute=1)
+    doomed = add_account(session, 2, "doomed", note="http://spam.example", minute=2)
+    user_changes.find_user_changes(session)
+
+    sneaky = add_account(session, 3, "sneaky", note="http://sneaky.example", minute=3)
+    newbie = add_account(session, 4, "newbie", note="http://newbie.example", minute=4)
+    session.delete(doomed)
+    session.commit()
+
+    changes = user_changes.find_user_changes(session, account_ids=[2, newbie.id])
+    assert [(kind, username) for kind, username, _, _ in changes] == [
+        ("deleted", "doomed"),
+        ("new", "newbie"),
+    ]
+
+    # The next incremental scan still picks up what the targeted one skipped, but nothing twice.
+    changes = user_changes.find_user_changes(session)
+    assert [(kind, username) for kind, username, _, _ in changes] == [("new", sneaky.username)]
+
+
+def test_trigger_notifications(pg_session):
+    """The trigger reports changes to local accounts, and bursts of them are collected together."""
+
+    pg_session.execute(text(watch.INSTALL_TRIGGER))
+    pg_session.commit()
+    connection = watch.listen(pg_session)
+
+    try:
+        spammer = add_account(pg_session, 1, "spammer", note="hello")
+        add_account(pg_session, 2, "remote", note="hello", domain="example.com")
+        touch(pg_session, spammer, 1, note="http://spam.example")
+        touch(pg_session, spammer, 2, created_at=spammer.created_at)
+
+        assert watch.collect_account_ids(connection, debounce=0.1, max_delay=5) == {1}
+
+        def later():
+            pg_session.delete(spammer)
+            pg_session.commit()
+
+        timer = threading.Timer(0.2, later)
+        timer.start()
+        assert watch.collect_account_ids(connection, debounce=0.1, max_delay=5) == {1}
+        timer.join()
+    finally:
+        connection.close()
+        pg_session.rollback()
+        pg_session.execute(text(watch.UNINSTALL_TRIGGER))
+        pg_session.commit()